@@ -0,0 +1,297 @@
+"""
+Cleaner availability for dispatching. The index covers whole local days (company timezone) and is loaded with four
+queries: the cleaners, their dispatched schedules, their leave and their operating hours. Each cleaner keeps the busy
+intervals sorted by start with a running maximum of their ends, and the working windows merged and sorted, so
+checking a slot is a couple of bisections. Loaded indexes are cached in the shared cache per day range and the
+versions of the UTC dates it covers, plus a global version. A change to a dispatch, schedule, booking cancellation or
+leave bumps the dates of the slots it touched, a change to operating hours or to a cleaner's role or status bumps the
+global version. Bulk writes call bump_availability_version themselves.
+
+The cached index is advisory (free cleaner lists, the optimizer preview). A dispatch locks the cleaner's row and
+checks a freshly loaded index, see check_dispatch, so two concurrent dispatches cannot both take the same slot.
+"""
+import bisect
+import datetime
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from booking.calendar_events import get_company_timezone
+from booking.models import DispatchedAppointment, SpOperatingHour
+from service_provider.models import LeaveTime
+from user_module.models import User, UserProfile
+
+AVAILABILITY_VERSION_KEY = "cleaner_availability_version"
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class CleanerIntervals:
+    """Busy intervals and working windows of one cleaner."""
+
+    def __init__(self):
+        self.busy = []  # sorted [(start, end, kind, reference id)]
+        self.max_ends = []  # max_ends[i] = latest end among busy[:i + 1]
+        self.working = None  # merged sorted [(start, end)], None when the cleaner has no operating hours set
+        self.working_starts = []
+
+    def set_busy(self, busy):
+        """Replaces the busy intervals with [(start, end, kind, reference id)], in any order."""
+        self.busy = sorted(busy)
+        self.max_ends = []
+        for start, end, kind, reference in self.busy:
+            self.max_ends.append(max(self.max_ends[-1], end) if self.max_ends else end)
+
+    def add_busy(self, start, end, kind, reference):
+        """Adds one interval to a built index, see CleanerAvailabilityIndex.add_dispatch."""
+        position = bisect.bisect_right(self.busy, (start, end, kind, reference))
+        self.busy.insert(position, (start, end, kind, reference))
+        self.max_ends.insert(position, end)
+        for index in range(position, len(self.busy)):
+            self.max_ends[index] = max(self.max_ends[index - 1], self.busy[index][1]) if index else self.busy[0][1]
+
+    def set_working(self, windows):
+        merged = []
+        for start, end in sorted(windows):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.working = merged
+        self.working_starts = [start for start, end in merged]
+
+    def overlapping(self, start, end, exclude_booking=None):
+        """Busy intervals overlapping [start, end), latest first."""
+        found = []
+        # busy[:index] start before `end`; walking back stops once no earlier interval can reach past `start`
+        index = bisect.bisect_left(self.busy, (end,)) - 1
+        while index >= 0 and self.max_ends[index] > start:
+            busy_start, busy_end, kind, reference = self.busy[index]
+            if busy_end > start and not (kind == "booking" and reference == exclude_booking):
+                found.append(self.busy[index])
+            index -= 1
+        return found
+
+    def within_working_hours(self, start, end):
+        if self.working is None:
+            return True
+        index = bisect.bisect_right(self.working_starts, start) - 1
+        return index >= 0 and self.working[index][1] >= end
+
+
+class CleanerAvailabilityIndex:
+    def __init__(self, start_day, end_day, tz):
+        self.start_day, self.end_day, self.tz = start_day, end_day, tz
+        self.start = tz.localize(datetime.datetime.combine(start_day, datetime.time.min))
+        self.end = tz.localize(datetime.datetime.combine(end_day + datetime.timedelta(days=1), datetime.time.min))
+        self.cleaners = {}  # cleaner id: CleanerIntervals
+
+    @classmethod
+    def load(cls, start_day, end_day, tz=None, cleaner_ids=None):
+        """Index of every active cleaner (or of the given ones) for the local days start_day to end_day (inclusive)."""
+        index = cls(start_day, end_day, tz or get_company_timezone())
+        cleaners = UserProfile.objects.filter(role="Cleaner", status="Active", user__isnull=False)
+        if cleaner_ids is not None:
+            cleaners = cleaners.filter(user__in=cleaner_ids)
+        for cleaner_id in cleaners.values_list("user", flat=True):
+            index.cleaners[cleaner_id] = CleanerIntervals()
+        busy = {cleaner_id: [] for cleaner_id in index.cleaners}
+        for cleaner_id, booking_id, start, end in (
+                DispatchedAppointment.objects.filter(
+                    status="Dispatched",
+                    service_provider__in=index.cleaners,
+                    booking__booking_in_schedule__start_time__lt=index.end,
+                    booking__booking_in_schedule__end_time__gt=index.start,
+                )
+                .exclude(booking__status="cancelled")
+                .values_list(
+                    "service_provider",
+                    "booking",
+                    "booking__booking_in_schedule__start_time",
+                    "booking__booking_in_schedule__end_time",
+                )
+        ):
+            busy[cleaner_id].append((start, end, "booking", booking_id))
+        for cleaner_id, leave_id, start, end in LeaveTime.objects.filter(
+                service_provider__in=index.cleaners, start__lt=index.end, end__gt=index.start
+        ).values_list("service_provider", "id", "start", "end"):
+            busy[cleaner_id].append((start, end, "leave", leave_id))
+        for cleaner_id, intervals in busy.items():
+            index.cleaners[cleaner_id].set_busy(intervals)
+        hours = {}
+        for cleaner_id, day, is_available, start_hour, end_hour in SpOperatingHour.objects.filter(
+                service_provider__in=index.cleaners
+        ).values_list("service_provider", "day", "is_available", "start_hour", "end_hour"):
+            hours.setdefault(cleaner_id, {})[day] = (start_hour, end_hour) if is_available else None
+        for cleaner_id, days in hours.items():
+            index.cleaners[cleaner_id].set_working(index._working_windows(days))
+        return index
+
+    def _working_windows(self, days):
+        windows = []
+        day = self.start_day
+        while day <= self.end_day:
+            hours = days.get(WEEKDAY_NAMES[day.weekday()])
+            if hours:
+                start = self.tz.localize(datetime.datetime.combine(day, hours[0]))
+                end = self.tz.localize(datetime.datetime.combine(day, hours[1]))
+                # an end at or before the start runs past midnight
+                windows.append((start, end if end > start else end + datetime.timedelta(days=1)))
+            day += datetime.timedelta(days=1)
+        return windows
+
+    def covers(self, start, end):
+        return self.start <= start and end <= self.end
+
+    def conflicts(self, cleaner_id, start, end, exclude_booking=None):
+        """
+        Why cleaner_id cannot take [start, end): [{"type": "booking" | "leave" | "off_hours" | "inactive",
+        "id", "start", "end"}], empty when the slot is free. exclude_booking ignores that booking's own dispatch.
+        """
+        intervals = self.cleaners.get(cleaner_id)
+        if intervals is None:
+            return [{"type": "inactive", "id": cleaner_id, "start": None, "end": None}]
+        conflicts = [
+            {"type": kind, "id": reference, "start": busy_start, "end": busy_end}
+            for busy_start, busy_end, kind, reference in reversed(
+                intervals.overlapping(start, end, exclude_booking)
+            )
+        ]
+        if not intervals.within_working_hours(start, end):
+            conflicts.append({"type": "off_hours", "id": None, "start": start, "end": end})
+        return conflicts
+
+    def is_free(self, cleaner_id, start, end, exclude_booking=None):
+        return not self.conflicts(cleaner_id, start, end, exclude_booking)
+
+    def free_cleaners(self, start, end, exclude_booking=None):
+        return sorted(
+            cleaner_id
+            for cleaner_id, intervals in self.cleaners.items()
+            if intervals.within_working_hours(start, end)
+            and not intervals.overlapping(start, end, exclude_booking)
+        )
+
+    def add_dispatch(self, cleaner_id, booking_id, start, end):
+        """Keeps an index in hand current after a dispatch, without reloading it."""
+        if cleaner_id in self.cleaners:
+            self.cleaners[cleaner_id].add_busy(start, end, "booking", booking_id)
+
+
+def _index_key(start_day, end_day, version):
+    return "cleaner_availability:%s:%s:%s" % (start_day.isoformat(), end_day.isoformat(), version)
+
+
+def _date_version_key(date):
+    return "%s:%s" % (AVAILABILITY_VERSION_KEY, date.isoformat())
+
+
+def _dates(first, last):
+    return [first + datetime.timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def _slot_dates(start, end):
+    """UTC dates [start, end) falls on."""
+    first = start.astimezone(datetime.timezone.utc).date()
+    last = (end - datetime.timedelta(microseconds=1)).astimezone(datetime.timezone.utc).date()
+    return _dates(first, max(first, last))
+
+
+def _local_days(start, end, tz):
+    start_day = start.astimezone(tz).date()
+    end_day = (end - datetime.timedelta(microseconds=1)).astimezone(tz).date()
+    return start_day, max(start_day, end_day)
+
+
+def get_availability_index(start, end):
+    """Index covering the local days of [start, end), cached until the next relevant write."""
+    tz = get_company_timezone()
+    start_day, end_day = _local_days(start, end, tz)
+    # a local day falls on the UTC dates around it
+    version_keys = [AVAILABILITY_VERSION_KEY] + [
+        _date_version_key(date)
+        for date in _dates(start_day - datetime.timedelta(days=1), end_day + datetime.timedelta(days=1))
+    ]
+    versions = cache.get_many(version_keys)
+    version = hashlib.md5(":".join(str(versions.get(key, 0)) for key in version_keys).encode()).hexdigest()
+    key = _index_key(start_day, end_day, version)
+    index = cache.get(key)
+    if index is None:
+        index = CleanerAvailabilityIndex.load(start_day, end_day, tz)
+        cache.set(key, index, settings.CLEANER_AVAILABILITY_CACHE_SECONDS)
+    return index
+
+
+def bump_availability_version(slots=None):
+    """
+    Drops the cached indexes covering the given [(start, end)] slots once the transaction commits, or every cached
+    index when slots is None. An index loaded before the commit read the old rows and is cached under the old
+    versions.
+    """
+    if slots is None:
+        keys = {AVAILABILITY_VERSION_KEY}
+    else:
+        keys = set()
+        for start, end in slots:
+            if start is None and end is None:
+                continue  # not scheduled
+            if not isinstance(start, datetime.datetime) or not isinstance(end, datetime.datetime):
+                # strings assigned to a saved instance stay strings, fall back to every day
+                keys.add(AVAILABILITY_VERSION_KEY)
+                continue
+            start, end = [timezone.make_aware(value) if timezone.is_naive(value) else value for value in (start, end)]
+            keys.update(_date_version_key(date) for date in _slot_dates(start, end))
+    if not keys:
+        return
+
+    def bump():
+        # a fresh token rather than cache.incr, which is not atomic on every backend
+        token = uuid.uuid4().hex
+        cache.set_many({key: token for key in keys}, None)
+
+    transaction.on_commit(bump)
+
+
+def lock_cleaners(cleaner_ids):
+    """Locks the user rows of the cleaners until the transaction ends, in id order so dispatches cannot deadlock."""
+    list(User.objects.select_for_update().filter(id__in=cleaner_ids).order_by("id").values_list("id", flat=True))
+
+
+def booking_slot(booking):
+    """[start, end) a booking occupies: its schedule, or its appointment plus its total hours."""
+    schedule = getattr(booking, "booking_in_schedule", None)
+    if schedule is not None:
+        return schedule.start_time, schedule.end_time
+    start = booking.appointment_date_time
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    return start, start + datetime.timedelta(hours=booking.total_hours or 0)
+
+
+def check_dispatch(booking, cleaner_id):
+    """
+    Conflicts of dispatching cleaner_id to booking, see CleanerAvailabilityIndex.conflicts. Must run in the
+    transaction that inserts the dispatch: the cleaner stays locked until it ends and the check reads the database,
+    not the cached index.
+    """
+    lock_cleaners([cleaner_id])
+    start, end = booking_slot(booking)
+    tz = get_company_timezone()
+    start_day, end_day = _local_days(start, end, tz)
+    index = CleanerAvailabilityIndex.load(start_day, end_day, tz, cleaner_ids=[cleaner_id])
+    return index.conflicts(cleaner_id, start, end, exclude_booking=booking.id)
+
+
+def describe_conflicts(conflicts):
+    labels = {
+        "booking": "booked for booking #{id} from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}",
+        "leave": "on leave from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}",
+        "off_hours": "outside operating hours",
+        "inactive": "not an active cleaner",
+    }
+    return "Cleaner is not available: " + ", ".join(
+        labels[conflict["type"]].format(**conflict) for conflict in conflicts
+    )
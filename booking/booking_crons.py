@@ -1,82 +1,59 @@
 import datetime
 
-from django.conf import settings
-from django.core.mail import EmailMessage
-from django.template.loader import get_template
-from django.utils import timezone
-
-from booking.models import Booking
 from apscheduler.schedulers.blocking import BlockingScheduler
+from channels.layers import get_channel_layer
 
-from booking.utils import email_logs
+from booking.mailer import dispatch_outbox
+from booking.metrics import metric_day, rebuild_daily_metrics
+from booking.payroll import payroll_day, rebuild_payroll
+from booking.reminders import send_booking_reminders
+from booking.utils import extend_booking_horizons
+from user_module.imports import process_customer_imports
 
 schedule = BlockingScheduler()
 
 
-def send_email(event_name, event_date, email):
-    """
-    Send email to user
-    """
-    rtx = {"event_name": event_name, "event_date": event_date}
+@schedule.scheduled_job("interval", minutes=59)
+def booking_reminders():
+    stats = send_booking_reminders()
+    print("Booking reminders: %(sent)s sent, %(failed)s failed of %(due)s due" % stats)
 
-    message = get_template("three_days.html").render(rtx)
-    email = EmailMessage(
-        subject="Booking Reminder",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
-    )
-    email.content_subtype = "html"
-    email.send()
 
+@schedule.scheduled_job("interval", seconds=30, max_instances=1, coalesce=True)
+def send_outbox_emails():
+    for batch in dispatch_outbox():
+        print("Outbox batch: %(sent)s/%(size)s sent, %(failed)s failed, %(retry)s retried in %(seconds)ss "
+              "(%(per_second)s/s)" % batch)
 
-@schedule.scheduled_job("interval", minutes=59)
-def booking_three_days_reminder():
-    booking = Booking.objects.filter(
-        status__in=["scheduled", "dispatched"],
-        appointment_date_time__lte=timezone.now() + datetime.timedelta(days=3),
-        three_day_reminder=False,
-    )
-    for obj in booking:
-        event_name = obj.bod.frequency.service.title
-        event_date = obj.appointment_date_time
-        email = obj.bod.user.email
-        send_email(event_name, event_date, email)
-        email_logs(obj.bod.user, "Booking Reminder")
-    booking.update(three_day_reminder=True)
 
+@schedule.scheduled_job("interval", seconds=30, max_instances=1, coalesce=True)
+def import_customer_csvs():
+    for customer_import in process_customer_imports():
+        print("Customer import %s: %s" % (customer_import.id, customer_import.status))
 
-@schedule.scheduled_job("interval", minutes=59)
-def booking_one_day_reminder():
-    booking = Booking.objects.filter(
-        status__in=["scheduled", "dispatched"],
-        appointment_date_time__lte=timezone.now() + datetime.timedelta(days=1),
-        one_day_reminder=False,
-    )
-    for obj in booking:
-        event_name = obj.bod.frequency.service.title
-        event_date = obj.appointment_date_time
-        email = obj.bod.user.email
-        send_email(event_name, event_date, email)
-        email_logs(obj.bod.user, "Booking Reminder")
-    booking.update(one_day_reminder=True)
 
+@schedule.scheduled_job("cron", hour=1)
+def extend_recurring_bookings():
+    extend_booking_horizons()
 
-@schedule.scheduled_job("interval", minutes=59)
-def three_hour_reminder():
-    booking = Booking.objects.filter(
-        status__in=["scheduled", "dispatched"],
-        appointment_date_time__lte=timezone.now() + datetime.timedelta(hours=3),
-        three_hour_reminder=False,
-    )
-    for obj in booking:
-        event_name = obj.bod.frequency.service.title
-        event_date = obj.appointment_date_time
-        email = obj.bod.user.email
-        send_email(event_name, event_date, email)
-        email_logs(obj.bod.user, "Booking Reminder")
-    booking.update(three_hour_reminder=True)
+
+@schedule.scheduled_job("cron", hour=2)
+def reconcile_daily_metrics():
+    rebuild_daily_metrics(metric_day() - datetime.timedelta(days=1))
+
+
+@schedule.scheduled_job("cron", hour=3)
+def reconcile_payroll():
+    # yesterday's period too, it may have closed overnight
+    today = payroll_day()
+    rebuild_payroll(today - datetime.timedelta(days=1), today)
+
+
+@schedule.scheduled_job("interval", minutes=10)
+def prune_channel_layer():
+    channel_layer = get_channel_layer()
+    if hasattr(channel_layer, "prune"):
+        channel_layer.prune()
 
 
 schedule.start()
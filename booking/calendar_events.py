@@ -0,0 +1,134 @@
+"""
+Calendar of bookings over an arbitrary date range, bucketed by local day in the company timezone. Bookings are
+read from BookingListing with one range query on appointment_date_time. Days before today are closed, so their
+events are cached and only recomputed after one of their bookings changes. Day versions live in the shared cache, so
+every worker sees the same versions.
+"""
+import datetime
+import uuid
+
+import pytz
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from booking.models import BookingListing
+
+CALENDAR_EVENT_FIELDS = (
+    "booking",
+    "bod",
+    "status",
+    "appointment_date_time",
+    "schedule_end",
+    "service_title",
+    "customer_name",
+    "cleaner",
+    "cleaner_name",
+    "colour",
+)
+
+
+def get_company_timezone(apps=global_apps):
+    name = apps.get_model("booking", "Company").objects.values_list("company_timezone", flat=True).first()
+    try:
+        return pytz.timezone(name or settings.TIME_ZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(settings.TIME_ZONE)
+
+
+def _day_version_key(day):
+    return "booking_calendar_version:" + day.isoformat()
+
+
+def _day_key(day, version):
+    return "booking_calendar:%s:%s" % (day.isoformat(), version)
+
+
+def invalidate_calendar_days(appointment_date_times, tz=None):
+    """Drops the cached events of the local days the given appointments fall on."""
+    tz = tz or get_company_timezone()
+    keys = [_day_version_key(day) for day in {value.astimezone(tz).date() for value in appointment_date_times if value}]
+    if not keys:
+        return
+
+    def bump():
+        # a fresh token rather than incr, which is not atomic on every cache backend
+        token = uuid.uuid4().hex
+        cache.set_many({key: token for key in keys}, None)
+
+    bump()
+    # again once the transaction commits, so a day read meanwhile from the old rows is not kept
+    transaction.on_commit(bump)
+
+
+def _to_event(row, tz):
+    start = row["appointment_date_time"].astimezone(tz)
+    end = row["schedule_end"].astimezone(tz) if row["schedule_end"] else None
+    return {
+        "id": row["booking"],
+        "bod": row["bod"],
+        "title": row["service_title"],
+        "customer": row["customer_name"],
+        "cleaner": row["cleaner"],
+        "cleaner_name": row["cleaner_name"],
+        "status": row["status"],
+        "start": start.isoformat(),
+        "end": end.isoformat() if end else None,
+        "colour": row["colour"],
+    }
+
+
+def _query_events(start_day, end_day, tz):
+    """Events of every day between start_day and end_day (inclusive) with one sargable range query."""
+    start = tz.localize(datetime.datetime.combine(start_day, datetime.time.min))
+    end = tz.localize(datetime.datetime.combine(end_day + datetime.timedelta(days=1), datetime.time.min))
+    days = {}
+    for row in (
+            BookingListing.objects.filter(
+                appointment_date_time__gte=start, appointment_date_time__lt=end
+            )
+            .order_by("appointment_date_time", "booking")
+            .values(*CALENDAR_EVENT_FIELDS)
+    ):
+        event = _to_event(row, tz)
+        days.setdefault(row["appointment_date_time"].astimezone(tz).date(), []).append(event)
+    return days
+
+
+def get_calendar(start_day, end_day, cleaner=None, status=None):
+    """
+    Returns [{"date": day, "events": [...]}] for each local day between start_day and end_day (inclusive).
+    cleaner and status narrow the events down after the cached days are read.
+    """
+    tz = get_company_timezone()
+    today = datetime.datetime.now(tz).date()
+    all_days = [
+        start_day + datetime.timedelta(days=offset)
+        for offset in range((end_day - start_day).days + 1)
+    ]
+    past_days = [day for day in all_days if day < today]
+    versions = cache.get_many([_day_version_key(day) for day in past_days])
+    keys = {day: _day_key(day, versions.get(_day_version_key(day), 0)) for day in past_days}
+    cached = cache.get_many(keys.values())
+    events = {day: cached[key] for day, key in keys.items() if key in cached}
+
+    missing = [day for day in all_days if day not in events]
+    if missing:
+        queried = _query_events(missing[0], missing[-1], tz)
+        for day in missing:
+            events[day] = queried.get(day, [])
+        cache.set_many(
+            {keys[day]: events[day] for day in missing if day in keys},
+            settings.BOOKING_CALENDAR_CACHE_SECONDS,
+        )
+
+    calendar = []
+    for day in all_days:
+        day_events = events[day]
+        if cleaner:
+            day_events = [event for event in day_events if str(event["cleaner"]) == str(cleaner)]
+        if status:
+            day_events = [event for event in day_events if event["status"] == status]
+        calendar.append({"date": day, "events": day_events})
+    return calendar
@@ -0,0 +1,77 @@
+"""
+In-process snapshot of the service catalog (Service, Package, Item, Extra, Tax and Banners). The snapshot is built
+with one query per table and reused until CatalogVersion changes, so the public service pages and the pricing code
+no longer re-read the catalog on every request.
+"""
+import threading
+from collections import defaultdict
+
+from django.db.models import F
+
+from booking.models import Banners, CatalogVersion, Extra, Item, Package, Service, Tax
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class CatalogSnapshot:
+    def __init__(self, version):
+        self.version = version
+        self.taxes = Tax.objects.in_bulk()
+        self.services = {service.id: service for service in Service.objects.order_by("id")}
+        self.services_by_slug = {service.slug: service for service in self.services.values()}
+        self.packages = {package.id: package for package in Package.objects.order_by("id")}
+        self.items = {item.id: item for item in Item.objects.order_by("id")}
+        self.extras = {extra.id: extra for extra in Extra.objects.order_by("id")}
+        self.banners = list(Banners.objects.order_by("id"))
+        self.packages_by_service = defaultdict(list)
+        self.items_by_package = defaultdict(list)
+        self.extras_by_service = defaultdict(list)
+        self.banners_by_service = defaultdict(list)
+        for package in self.packages.values():
+            self.packages_by_service[package.service_id].append(package)
+        for item in self.items.values():
+            self.items_by_package[item.package_id].append(item)
+        for extra in self.extras.values():
+            self.extras_by_service[extra.service_id].append(extra)
+        for banner in self.banners:
+            self.banners_by_service[banner.service_id].append(banner)
+        self._data = {}
+        self._data_lock = threading.Lock()
+
+    def get_tax(self, service_id):
+        service = self.services.get(service_id)
+        if service is None or service.tax_id is None:
+            return None
+        return self.taxes.get(service.tax_id)
+
+    def memoize(self, key, build):
+        """Caches derived data (mostly serializer output) for the lifetime of this snapshot."""
+        if key not in self._data:
+            value = build()
+            with self._data_lock:
+                self._data.setdefault(key, value)
+        return self._data[key]
+
+
+def get_catalog_version():
+    return CatalogVersion.objects.values_list("version", flat=True).first() or 0
+
+
+def get_catalog():
+    """Current snapshot. Costs one small query when the catalog is unchanged."""
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = CatalogSnapshot(version)
+            snapshot = _snapshot
+    return snapshot
+
+
+def bump_catalog_version(**kwargs):
+    """post_save/post_delete receiver for the catalog models."""
+    if not CatalogVersion.objects.update(version=F("version") + 1):
+        CatalogVersion.objects.create(version=1)
@@ -0,0 +1,211 @@
+"""
+Daily dispatch optimizer. The scheduled, undispatched bookings of a local day are assigned to the active cleaners
+so that the total travel (home to first booking, then booking to booking) stays low. Only cleaners free for the slot
+according to booking.availability (other dispatches, leave, operating hours) are considered.
+
+The assignment is a cheapest-insertion heuristic over a bookings x cleaners cost matrix computed with NumPy. The
+cheapest feasible (booking, cleaner) pair is taken first, then only that cleaner's column is recomputed, from its
+stops before and after each remaining booking.
+"""
+import math
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from booking.availability import (
+    CleanerAvailabilityIndex,
+    bump_availability_version,
+    describe_conflicts,
+    lock_cleaners,
+)
+from booking.calendar_events import get_company_timezone
+from booking.geo import distance_matrix_km, haversine_km, parse_point
+from booking.listing import schedule_listing_refresh
+from booking.models import Booking, DispatchedAppointment
+from user_module.models import UserProfile
+
+
+class DispatchDay:
+    """Undispatched bookings and active cleaners of one local day, with the availability index of that day."""
+
+    def __init__(self, day):
+        self.day = day
+        self.index = CleanerAvailabilityIndex.load(day, day, get_company_timezone())
+        rows = list(
+            Booking.objects.filter(
+                status="scheduled",
+                booking_in_schedule__start_time__gte=self.index.start,
+                booking_in_schedule__start_time__lt=self.index.end,
+            )
+            .exclude(booking_in_dispatched_appointment__status="Dispatched")
+            .order_by("booking_in_schedule__start_time", "id")
+            .values_list(
+                "id", "latitude", "longitude", "booking_in_schedule__start_time", "booking_in_schedule__end_time"
+            )
+        )
+        self.booking_ids = [row[0] for row in rows]
+        self.booking_points = np.array([parse_point(row[1], row[2]) for row in rows], dtype=float).reshape(-1, 2)
+        self.starts = [row[3] for row in rows]
+        self.ends = [row[4] for row in rows]
+        self.cleaner_ids = sorted(self.index.cleaners)
+        homes = dict(
+            (user, parse_point(latitude, longitude))
+            for user, latitude, longitude in UserProfile.objects.filter(
+                user__in=self.cleaner_ids
+            ).values_list("user", "latitude", "longitude")
+        )
+        self.home_points = np.array(
+            [homes.get(cleaner_id, (math.nan, math.nan)) for cleaner_id in self.cleaner_ids], dtype=float
+        ).reshape(-1, 2)
+
+    def slot(self, booking_id):
+        position = self.booking_ids.index(booking_id)
+        return self.starts[position], self.ends[position]
+
+
+def _route_legs(day, routes):
+    """{booking position: km from the previous stop (or home)}, nan where a coordinate is unknown."""
+    legs = {}
+    for cleaner_position, stops in routes.items():
+        points = np.vstack([day.home_points[cleaner_position], day.booking_points[stops]])
+        distances = haversine_km(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+        legs.update(zip(stops, distances.tolist()))
+    return legs
+
+
+def _insertion_costs(day, stops, home, positions, start_seconds):
+    """Extra km of inserting each booking in `positions` into a cleaner route `stops` (sorted by start)."""
+    stop_seconds = start_seconds[stops] if stops else np.empty(0)
+    after = np.searchsorted(stop_seconds, start_seconds[positions])
+    route = np.vstack([home, day.booking_points[stops]]) if stops else home.reshape(1, 2)
+    previous = route[after]
+    points = day.booking_points[positions]
+    cost = haversine_km(previous[:, 0], previous[:, 1], points[:, 0], points[:, 1])
+    has_next = after < len(stops)
+    if has_next.any():
+        following = route[np.minimum(after + 1, len(stops))]
+        detour = haversine_km(points[:, 0], points[:, 1], following[:, 0], following[:, 1]) - haversine_km(
+            previous[:, 0], previous[:, 1], following[:, 0], following[:, 1]
+        )
+        cost = cost + np.where(has_next, detour, 0)
+    return cost
+
+
+def plan_dispatch(day):
+    """
+    Proposed assignment for a local day: {"date", "assignments": [{"booking_id", "cleaner_id", "start", "end",
+    "distance_km"}], "unassigned": [booking ids], "total_distance_km"}. distance_km is the leg from the cleaner's
+    previous stop or home, None when a coordinate is missing.
+    """
+    day = day if isinstance(day, DispatchDay) else DispatchDay(day)
+    bookings, cleaners = len(day.booking_ids), len(day.cleaner_ids)
+    assigned = {}  # booking position: cleaner position
+    routes = {}  # cleaner position: [booking positions] sorted by start
+    if bookings and cleaners:
+        start_seconds = np.array([start.timestamp() for start in day.starts])
+        cost = distance_matrix_km(day.booking_points, day.home_points)
+        # unknown coordinates cost as much as the longest known distance, so known close cleaners win
+        penalty = float(np.nanmax(cost)) if not np.isnan(cost).all() else 0.0
+        cost = np.where(np.isnan(cost), penalty, cost)
+        feasible = np.array(
+            [
+                [day.index.is_free(cleaner_id, day.starts[j], day.ends[j]) for cleaner_id in day.cleaner_ids]
+                for j in range(bookings)
+            ],
+            dtype=bool,
+        ).reshape(bookings, cleaners)
+        remaining = np.ones(bookings, dtype=bool)
+        while True:
+            masked = np.where(feasible & remaining[:, None], cost, np.inf)
+            j, c = np.unravel_index(np.argmin(masked), masked.shape)
+            if not np.isfinite(masked[j, c]):
+                break
+            assigned[j] = c
+            remaining[j] = False
+            stops = routes.setdefault(c, [])
+            stops.insert(int(np.searchsorted(start_seconds[stops], start_seconds[j], side="right")), j)
+            cleaner_id = day.cleaner_ids[c]
+            day.index.add_dispatch(cleaner_id, day.booking_ids[j], day.starts[j], day.ends[j])
+            positions = np.flatnonzero(remaining & feasible[:, c])
+            if not len(positions):
+                continue
+            feasible[positions, c] = [
+                day.index.is_free(cleaner_id, day.starts[position], day.ends[position]) for position in positions
+            ]
+            column = _insertion_costs(day, stops, day.home_points[c], positions, start_seconds)
+            cost[positions, c] = np.where(np.isnan(column), penalty, column)
+    legs = _route_legs(day, routes)
+    assignments = [
+        {
+            "booking_id": day.booking_ids[j],
+            "cleaner_id": day.cleaner_ids[assigned[j]],
+            "start": day.starts[j],
+            "end": day.ends[j],
+            "distance_km": None if math.isnan(legs[j]) else round(legs[j], 3),
+        }
+        for j in sorted(assigned)
+    ]
+    return {
+        "date": day.day,
+        "assignments": assignments,
+        "unassigned": [day.booking_ids[j] for j in range(bookings) if j not in assigned],
+        "total_distance_km": round(
+            sum(assignment["distance_km"] or 0 for assignment in assignments), 3
+        ),
+    }
+
+
+def commit_dispatch(day, assignments=None):
+    """
+    Dispatches a day in one transaction: the given [(booking id, cleaner id)] (checked again against the current
+    availability) or else the current plan. All DispatchedAppointment rows go in with one bulk_create.
+    Raises ValueError when a booking is not open for dispatch that day or a cleaner is not free.
+    """
+    with transaction.atomic():
+        dispatch_day = DispatchDay(day)
+        if assignments is None:
+            assignments = [
+                (assignment["booking_id"], assignment["cleaner_id"])
+                for assignment in plan_dispatch(dispatch_day)["assignments"]
+            ]
+        else:
+            assignments = sorted(
+                ((int(booking_id), int(cleaner_id)) for booking_id, cleaner_id in assignments),
+                key=lambda pair: (dispatch_day.slot(pair[0]) if pair[0] in dispatch_day.booking_ids else ()),
+            )
+            for booking_id, cleaner_id in assignments:
+                if booking_id not in dispatch_day.booking_ids:
+                    raise ValueError("Booking %s is not open for dispatch on %s" % (booking_id, day))
+                start, end = dispatch_day.slot(booking_id)
+                conflicts = dispatch_day.index.conflicts(cleaner_id, start, end, exclude_booking=booking_id)
+                if conflicts:
+                    raise ValueError("Booking %s: %s" % (booking_id, describe_conflicts(conflicts)))
+                dispatch_day.index.add_dispatch(cleaner_id, booking_id, start, end)
+        booking_ids = [booking_id for booking_id, cleaner_id in assignments]
+        if len(set(booking_ids)) != len(booking_ids):
+            raise ValueError("A booking can only be dispatched once")
+        # lock the bookings so a concurrent dispatch of the same day cannot slip in between
+        locked = Booking.objects.select_for_update().filter(id__in=booking_ids, status="scheduled").count()
+        if locked != len(booking_ids):
+            raise ValueError("Some bookings changed while dispatching, please retry")
+        # and the cleaners, then check again against what other dispatches committed since the day was loaded
+        cleaner_ids = sorted({cleaner_id for booking_id, cleaner_id in assignments})
+        lock_cleaners(cleaner_ids)
+        index = CleanerAvailabilityIndex.load(day, day, dispatch_day.index.tz, cleaner_ids=cleaner_ids)
+        for booking_id, cleaner_id in assignments:
+            start, end = dispatch_day.slot(booking_id)
+            if index.conflicts(cleaner_id, start, end, exclude_booking=booking_id):
+                raise ValueError("Some cleaners were dispatched elsewhere meanwhile, please retry")
+            index.add_dispatch(cleaner_id, booking_id, start, end)
+        DispatchedAppointment.objects.bulk_create(
+            [
+                DispatchedAppointment(booking_id=booking_id, service_provider_id=cleaner_id)
+                for booking_id, cleaner_id in assignments
+            ]
+        )
+        Booking.objects.filter(id__in=booking_ids).update(status="dispatched", updated_at=timezone.now())
+        # bulk writes send no signals
+        bump_availability_version([dispatch_day.slot(booking_id) for booking_id in booking_ids])
+        schedule_listing_refresh(booking_ids)
+    return {"date": day, "dispatched": len(assignments)}
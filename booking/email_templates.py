@@ -0,0 +1,53 @@
+"""
+Email template rendering. Bodies stored in EmailTypes are compiled once and kept per process, keyed by the row's id
+and its last change (EmailTypes.created_at is auto_now). Saving or deleting a row drops its entry. Templates under
+Templates/ go through the same render_batch API, so callers render many contexts against one compiled template.
+"""
+import threading
+
+from django.template import Context, Template
+from django.template.loader import get_template
+
+from booking.models import EmailTypes
+
+_lock = threading.Lock()
+_email_type_templates = {}  # email type id: (changed at, compiled template)
+_file_templates = {}  # template name: template
+
+
+def get_email_type_template(email_type):
+    """Compiled template of an EmailTypes row, compiled only when the row changed since the last call."""
+    cached = _email_type_templates.get(email_type.id)
+    if cached and cached[0] == email_type.created_at:
+        return cached[1]
+    compiled = Template(email_type.body)
+    with _lock:
+        _email_type_templates[email_type.id] = (email_type.created_at, compiled)
+    return compiled
+
+
+def get_file_template(name):
+    template = _file_templates.get(name)
+    if template is None:
+        template = get_template(name)
+        with _lock:
+            _file_templates[name] = template
+    return template
+
+
+def invalidate_email_type(sender, instance, **kwargs):
+    with _lock:
+        _email_type_templates.pop(instance.id, None)
+
+
+def render_batch(source, contexts):
+    """
+    Renders every context against one compiled template and returns the bodies in the same order.
+    source is an EmailTypes row, or the name of a file template.
+    """
+    if isinstance(source, EmailTypes):
+        template = get_email_type_template(source)
+        return [template.render(Context(context)) for context in contexts]
+    template = get_file_template(source)
+    return [template.render(context) for context in contexts]
+
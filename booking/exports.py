@@ -0,0 +1,71 @@
+"""
+Streaming CSV exports. Rows are read with .values_list().iterator(), which walks a PostgreSQL server-side cursor
+EXPORT_CHUNK_SIZE rows at a time, with the names joined in SQL instead of a serializer lookup per row. Each CSV line
+is yielded to a StreamingHttpResponse as soon as it is written, and trailing totals are summed along the way, so
+memory stays flat however many rows are exported.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+from user_module.models import UserProfile
+
+EXPORT_CHUNK_SIZE = 2000
+
+PAYROLL_HEADER = ["service provider", "hourly wage", "hours worked", "amount", "paid", "total tips"]
+CUSTOMER_HEADER = ["email", "role", "first_name", "last_name", "language", "address", "city", "state", "zip_code"]
+
+
+class Echo:
+    """File-like object handing every written line back, so csv.writer can format lines one at a time."""
+
+    def write(self, value):
+        return value
+
+
+def full_name(first_name, last_name):
+    return " ".join(name for name in (first_name, last_name) if name)
+
+
+def csv_response(lines, filename):
+    """StreamingHttpResponse downloading the rows of an iterable as a CSV attachment."""
+    writer = csv.writer(Echo())
+    return StreamingHttpResponse(
+        (writer.writerow(line) for line in lines),
+        content_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="%s"' % filename},
+    )
+
+
+def payroll_lines(payroll):
+    """CSV rows of a Payroll queryset, ending with the total and paid amounts."""
+    yield PAYROLL_HEADER
+    total_amount = total_paid = 0
+    rows = payroll.order_by("period_start", "sp").values_list(
+        "sp__user_in_profile__first_name",
+        "sp__user_in_profile__last_name",
+        "hourly_wage",
+        "total_hours",
+        "total_amount",
+        "paid_amount",
+        "tip_amount",
+    )
+    for first_name, last_name, hourly_wage, hours, amount, paid, tips in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        total_amount += amount
+        total_paid += paid
+        yield [full_name(first_name, last_name), hourly_wage, hours, amount, paid, tips]
+    yield ["total_amount", total_amount]
+    yield ["total_paid", total_paid]
+
+
+def customer_lines():
+    """CSV rows of every customer profile."""
+    yield CUSTOMER_HEADER
+    rows = (
+        UserProfile.objects.filter(role="Customer")
+        .order_by("user")
+        .values_list(
+            "user__email", "role", "first_name", "last_name", "language", "address", "city", "state", "zip_code"
+        )
+    )
+    yield from rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
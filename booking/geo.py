@@ -0,0 +1,93 @@
+"""
+Coordinate helpers. Distances are great-circle (haversine) kilometres computed with NumPy, so a whole matrix of
+cleaner-to-booking distances costs one vectorized call.
+
+Points are also bucketed into a fixed grid of GRID_CELL_DEGREES cells, numbered row by row from (-90, -180). The
+cell number is stored next to the coordinates, so "near this point" becomes an indexed grid_cell IN (...) filter.
+"""
+import math
+from decimal import Decimal
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GRID_CELL_DEGREES = 0.05
+GRID_ROWS = int(round(180 / GRID_CELL_DEGREES))
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES))
+# above this many cells a radius query filters on a latitude/longitude box instead
+MAX_GRID_CELLS = 2500
+
+
+def parse_coordinate(value, limit=180):
+    """Float value of a stored coordinate, or nan for empty, "null" or out of range values."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return value if math.isfinite(value) and -limit <= value <= limit else math.nan
+
+
+def parse_point(latitude, longitude):
+    point = parse_coordinate(latitude, 90), parse_coordinate(longitude)
+    return point if not any(math.isnan(value) for value in point) else (math.nan, math.nan)
+
+
+def to_coordinate(value, limit=180):
+    """Value for a coordinate DecimalField (6 decimal places), None when it cannot be parsed."""
+    value = parse_coordinate(value, limit)
+    return None if math.isnan(value) else Decimal(value).quantize(Decimal("0.000001"))
+
+
+def grid_cell(latitude, longitude):
+    """Grid cell number of a point, None without valid coordinates."""
+    latitude, longitude = parse_point(latitude, longitude)
+    if math.isnan(latitude):
+        return None
+    row = min(int((latitude + 90) // GRID_CELL_DEGREES), GRID_ROWS - 1)
+    column = int((longitude + 180) // GRID_CELL_DEGREES) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min latitude, max latitude, min longitude, max longitude) around a circle, longitudes not wrapped."""
+    latitude_span = radius_km / KM_PER_DEGREE
+    widest = min(abs(latitude) + latitude_span, 90)
+    cosine = math.cos(math.radians(widest))
+    longitude_span = 180 if cosine < 1e-6 else min(radius_km / (KM_PER_DEGREE * cosine), 180)
+    return (
+        max(latitude - latitude_span, -90),
+        min(latitude + latitude_span, 90),
+        longitude - longitude_span,
+        longitude + longitude_span,
+    )
+
+
+def grid_cells_within(latitude, longitude, radius_km):
+    """The grid cells covering a circle, or None when there would be more than MAX_GRID_CELLS of them."""
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_km)
+    first_row = int((min_latitude + 90) // GRID_CELL_DEGREES)
+    last_row = min(int((max_latitude + 90) // GRID_CELL_DEGREES), GRID_ROWS - 1)
+    first_column = int((min_longitude + 180) // GRID_CELL_DEGREES)
+    last_column = int((max_longitude + 180) // GRID_CELL_DEGREES)
+    last_column = min(last_column, first_column + GRID_COLUMNS - 1)
+    columns = {column % GRID_COLUMNS for column in range(first_column, last_column + 1)}
+    if (last_row - first_row + 1) * len(columns) > MAX_GRID_CELLS:
+        return None
+    return [row * GRID_COLUMNS + column for row in range(first_row, last_row + 1) for column in sorted(columns)]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Haversine distance in km between arrays of degrees, broadcasting like any NumPy operation. nan in, nan out."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def distance_matrix_km(origins, destinations):
+    """len(origins) x len(destinations) distances for two sequences of (latitude, longitude)."""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    return haversine_km(
+        origins[:, 0, None], origins[:, 1, None], destinations[None, :, 0], destinations[None, :, 1]
+    )
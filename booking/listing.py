@@ -0,0 +1,125 @@
+"""
+Keeps the BookingListing read model in sync. Callers only say which bookings changed, the rows are rebuilt in a
+fixed number of queries per batch once the surrounding transaction commits. The rows only hold what the list
+endpoints filter, order and paginate on and what the calendar shows, the bookings themselves are serialized from
+Booking.
+"""
+from django.apps import apps as global_apps
+from django.db import transaction
+
+from booking.calendar_events import invalidate_calendar_days
+from booking.models import Booking
+
+LISTING_BATCH_SIZE = 500
+LISTING_FIELDS = [
+    "bod",
+    "user",
+    "status",
+    "appointment_date_time",
+    "booking_created_at",
+    "customer_name",
+    "service",
+    "service_title",
+    "colour",
+    "cleaner",
+    "cleaner_name",
+    "schedule_end",
+    "sale_status",
+]
+
+
+def full_name(first_name, last_name):
+    return " ".join(name for name in (first_name, last_name) if name)
+
+
+def _build_listings(booking_ids, apps):
+    Booking = apps.get_model("booking", "Booking")
+    BookingListing = apps.get_model("booking", "BookingListing")
+    DispatchedAppointment = apps.get_model("booking", "DispatchedAppointment")
+    Sale = apps.get_model("booking", "Sale")
+    Schedule = apps.get_model("booking", "Schedule")
+    bookings = Booking.objects.filter(id__in=booking_ids).select_related(
+        "bod__bod_contact_info", "bod__frequency__service"
+    )
+    sale_statuses = {}
+    for booking, status in Sale.objects.filter(booking__in=booking_ids).order_by("id").values_list("booking", "status"):
+        sale_statuses.setdefault(booking, status)
+    dispatches = {}
+    for dispatch in DispatchedAppointment.objects.filter(booking__in=booking_ids, status="Dispatched").values(
+            "booking",
+            "service_provider",
+            "service_provider__user_in_profile__first_name",
+            "service_provider__user_in_profile__last_name",
+    ).order_by("id"):
+        dispatches[dispatch["booking"]] = dispatch  # the latest active dispatch wins
+    schedule_ends = dict(Schedule.objects.filter(booking__in=booking_ids).values_list("booking", "end_time"))
+
+    listings = []
+    for booking in bookings:
+        contact_info = booking.bod.bod_contact_info
+        service = booking.bod.frequency.service
+        dispatch = dispatches.get(booking.id)
+        cleaner_name = ""
+        if dispatch:
+            cleaner_name = full_name(
+                dispatch["service_provider__user_in_profile__first_name"],
+                dispatch["service_provider__user_in_profile__last_name"],
+            )
+        listings.append(
+            BookingListing(
+                booking_id=booking.id,
+                bod_id=booking.bod_id,
+                user_id=booking.bod.user_id,
+                status=booking.status,
+                appointment_date_time=booking.appointment_date_time,
+                booking_created_at=booking.created_at,
+                customer_name=full_name(contact_info.first_name, contact_info.last_name) if contact_info else "",
+                service_id=service.id,
+                service_title=service.title,
+                colour=booking.bod.colour,
+                cleaner_id=dispatch["service_provider"] if dispatch else None,
+                cleaner_name=cleaner_name,
+                schedule_end=schedule_ends.get(booking.id),
+                sale_status=sale_statuses.get(booking.id),
+            )
+        )
+    return listings
+
+
+def save_booking_listings(booking_ids, apps=global_apps):
+    """
+    Rebuilds the rows of one batch. Returns the appointment times the rows had before and have now. Migrations pass
+    their historical apps.
+    """
+    BookingListing = apps.get_model("booking", "BookingListing")
+    listings = _build_listings(booking_ids, apps)
+    with transaction.atomic():
+        existing = dict(
+            BookingListing.objects.filter(booking__in=booking_ids).values_list("booking", "appointment_date_time")
+        )
+        BookingListing.objects.bulk_update(
+            [listing for listing in listings if listing.booking_id in existing], LISTING_FIELDS
+        )
+        BookingListing.objects.bulk_create([listing for listing in listings if listing.booking_id not in existing])
+    return list(existing.values()) + [listing.appointment_date_time for listing in listings]
+
+
+def refresh_booking_listings(booking_ids):
+    """Rebuilds the BookingListing rows of the given bookings right away, in batches of LISTING_BATCH_SIZE."""
+    booking_ids = sorted(set(booking_ids))
+    for start in range(0, len(booking_ids), LISTING_BATCH_SIZE):
+        invalidate_calendar_days(save_booking_listings(booking_ids[start:start + LISTING_BATCH_SIZE]))
+
+
+def listed_bookings(listings):
+    """The bookings of the given BookingListing rows, in the same order, for the booking list serializers."""
+    listings = list(listings)
+    bookings = Booking.objects.in_bulk([listing.booking_id for listing in listings])
+    return [bookings[listing.booking_id] for listing in listings if listing.booking_id in bookings]
+
+
+def schedule_listing_refresh(booking_ids):
+    """Rebuilds the rows of the given bookings once the current transaction commits (right away outside of one)."""
+    booking_ids = {booking_id for booking_id in booking_ids if booking_id}
+    if booking_ids:
+        transaction.on_commit(lambda: refresh_booking_listings(booking_ids))
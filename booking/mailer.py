@@ -0,0 +1,147 @@
+"""
+Transactional email outbox. enqueue_email only stores a row, so API requests never wait on SMTP. dispatch_outbox,
+run from booking_crons, claims queued rows in batches. It renders each batch grouped by template (a file template
+or an EmailTypes body) and sends every batch of the run over one reused mail connection.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import formats, timezone
+from django.utils.timezone import template_localtime
+
+from booking.email_templates import render_batch
+from booking.models import EmailTypes, OutboundEmail
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 3
+# rows left in "sending" longer than this belong to a worker that died mid-batch
+OUTBOX_STALE_AFTER = datetime.timedelta(minutes=15)
+
+
+def _prepare_context(context):
+    """Dates are stored the way the template would have rendered them, since the context is kept as JSON."""
+    return {
+        key: formats.localize(template_localtime(value))
+        if isinstance(value, (datetime.date, datetime.datetime))
+        else value
+        for key, value in context.items()
+    }
+
+
+def build_outbound_email(to_email, subject, template, context=None):
+    """template is the name of a file template or an EmailTypes row."""
+    email = OutboundEmail(to_email=to_email, subject=subject, context=_prepare_context(context or {}))
+    if isinstance(template, EmailTypes):
+        email.email_type = template
+    else:
+        email.template = template
+    return email
+
+
+def enqueue_email(to_email, subject, template, context=None):
+    email = build_outbound_email(to_email, subject, template, context)
+    email.save()
+    return email
+
+
+def enqueue_emails(emails):
+    """Enqueues several build_outbound_email() rows with one insert."""
+    return OutboundEmail.objects.bulk_create(emails)
+
+
+def _claim_batch(batch_size, retried):
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status="queued")
+            .exclude(id__in=retried)
+            .order_by("id")[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[email.id for email in batch]).update(
+            status="sending", updated_at=timezone.now()
+        )
+    return batch
+
+
+def _render_batch(batch):
+    """Renders the batch one template at a time. A template that fails to render fails only its own rows."""
+    groups = {}
+    for email in batch:
+        groups.setdefault(email.email_type_id or email.template, []).append(email)
+    email_types = EmailTypes.objects.in_bulk([key for key in groups if isinstance(key, int)])
+    rendered = {}
+    for key, emails in groups.items():
+        try:
+            bodies = render_batch(
+                email_types[key] if isinstance(key, int) else key, [email.context for email in emails]
+            )
+        except Exception as e:
+            bodies = [e] * len(emails)
+        rendered.update(zip([email.id for email in emails], bodies))
+    return rendered
+
+
+def _send_batch(batch, connection, max_attempts):
+    rendered = _render_batch(batch)
+    now = timezone.now()
+    for email in batch:
+        email.attempts += 1
+        try:
+            if isinstance(rendered[email.id], Exception):
+                raise rendered[email.id]
+            message = EmailMessage(
+                subject=email.subject,
+                body=rendered[email.id],
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email.to_email],
+                reply_to=[settings.DEFAULT_FROM_EMAIL],
+                connection=connection,
+            )
+            message.content_subtype = "html"
+            connection.send_messages([message])
+            email.status, email.sent_at, email.error = "sent", now, ""
+        except Exception as e:
+            email.status = "failed" if email.attempts >= max_attempts else "queued"
+            email.error = str(e)
+    OutboundEmail.objects.bulk_update(batch, ["status", "attempts", "error", "sent_at"])
+
+
+def requeue_stale_emails():
+    return OutboundEmail.objects.filter(
+        status="sending", updated_at__lt=timezone.now() - OUTBOX_STALE_AFTER
+    ).update(status="queued")
+
+
+def dispatch_outbox(batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """
+    Sends queued emails until the outbox is drained, one mail connection for all batches. Returns the stats of
+    every batch: [{"size", "sent", "failed", "retry", "seconds", "per_second"}].
+    """
+    requeue_stale_emails()
+    stats = []
+    # emails put back in the queue are retried by the next run, not in this one
+    retried = set()
+    with get_connection() as connection:
+        while True:
+            batch = _claim_batch(batch_size, retried)
+            if not batch:
+                break
+            started = time.monotonic()
+            _send_batch(batch, connection, max_attempts)
+            seconds = time.monotonic() - started
+            retried.update(email.id for email in batch if email.status == "queued")
+            sent = sum(email.status == "sent" for email in batch)
+            stats.append(
+                {
+                    "size": len(batch),
+                    "sent": sent,
+                    "failed": sum(email.status == "failed" for email in batch),
+                    "retry": sum(email.status == "queued" for email in batch),
+                    "seconds": round(seconds, 3),
+                    "per_second": round(sent / seconds, 1) if seconds else sent,
+                }
+            )
+    return stats
@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from booking.metrics import metric_day, rebuild_daily_metrics
+
+
+class Command(BaseCommand):
+    help = "Recomputes the DailyMetrics rollup behind the dashboard from the raw tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=2, help="Number of most recent days to recompute (default 2)."
+        )
+        parser.add_argument("--all", action="store_true", help="Recompute every day.")
+
+    def handle(self, *args, **options):
+        since = None if options["all"] else metric_day() - datetime.timedelta(days=options["days"] - 1)
+        rebuild_daily_metrics(since)
+        self.stdout.write(
+            self.style.SUCCESS("Rebuilt daily metrics %s." % ("for all days" if since is None else "since %s" % since))
+        )
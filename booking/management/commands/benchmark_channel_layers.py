@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from cleany.channel_layers import PostgresChannelLayer
+
+
+async def _send_receive(layer, count):
+    channel = await layer.new_channel()
+    started = time.monotonic()
+    for index in range(count):
+        await layer.send(channel, {"type": "chat.message", "message": "message %s" % index})
+        await layer.receive(channel)
+    return count / (time.monotonic() - started)
+
+
+async def _group_fan_out(layer, count, group_size):
+    channels = [await layer.new_channel() for _ in range(group_size)]
+    for channel in channels:
+        await layer.group_add("benchmark", channel)
+    started = time.monotonic()
+    for index in range(count):
+        await layer.group_send("benchmark", {"type": "chat.message", "message": "message %s" % index})
+        await asyncio.gather(*[layer.receive(channel) for channel in channels])
+    rate = count * group_size / (time.monotonic() - started)
+    for channel in channels:
+        await layer.group_discard("benchmark", channel)
+    return rate
+
+
+async def _benchmark(layer, count, group_size):
+    results = {
+        "send/receive": await _send_receive(layer, count),
+        "group_send x%s" % group_size: await _group_fan_out(layer, count, group_size),
+    }
+    await layer.flush()
+    if hasattr(layer, "close"):
+        await layer.close()
+    return results
+
+
+class Command(BaseCommand):
+    help = "Compares the message throughput of the PostgreSQL channel layer with the in-memory one."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000, help="Messages per benchmark (default 1000).")
+        parser.add_argument("--group-size", type=int, default=10, help="Channels in the fan-out group (default 10).")
+
+    def handle(self, *args, **options):
+        layers = {
+            "in-memory": InMemoryChannelLayer(capacity=options["messages"]),
+            "postgres": PostgresChannelLayer(capacity=options["messages"]),
+        }
+        for name, layer in layers.items():
+            results = asyncio.run(_benchmark(layer, options["messages"], options["group_size"]))
+            for benchmark, rate in results.items():
+                self.stdout.write("%-10s %-16s %10.0f msg/s" % (name, benchmark, rate))
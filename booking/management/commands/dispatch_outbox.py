@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from booking.mailer import OUTBOX_BATCH_SIZE, dispatch_outbox
+
+
+class Command(BaseCommand):
+    help = "Sends the queued transactional emails of the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE, help="Emails claimed per batch.")
+
+    def handle(self, *args, **options):
+        for batch in dispatch_outbox(batch_size=options["batch_size"]):
+            self.stdout.write(
+                "%(sent)s/%(size)s sent, %(failed)s failed, %(retry)s retried in %(seconds)ss (%(per_second)s/s)"
+                % batch
+            )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from booking.listing import refresh_booking_listings
+from booking.models import Booking, BookingListing
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the BookingListing read model from the booking tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--missing", action="store_true", help="Only build rows for bookings that have none."
+        )
+
+    def handle(self, *args, **options):
+        bookings = Booking.objects.order_by("id")
+        if options["missing"]:
+            bookings = bookings.exclude(id__in=BookingListing.objects.values("booking"))
+        booking_ids = list(bookings.values_list("id", flat=True))
+        refresh_booking_listings(booking_ids)
+        self.stdout.write(self.style.SUCCESS("Rebuilt %s booking listings." % len(booking_ids)))
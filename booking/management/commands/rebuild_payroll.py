@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from booking.payroll import payroll_day, rebuild_payroll
+
+
+class Command(BaseCommand):
+    help = "Recomputes the per-period payrolls from the completed bookings and charged tips."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since", type=parse_date, help="Recompute the periods from the one holding this date (YYYY-MM-DD)."
+        )
+        parser.add_argument(
+            "--days", type=int, default=2, help="Recompute the periods of the most recent days (default 2)."
+        )
+
+    def handle(self, *args, **options):
+        today = payroll_day()
+        since = options["since"] or today - datetime.timedelta(days=options["days"] - 1)
+        count = rebuild_payroll(since, today)
+        self.stdout.write(self.style.SUCCESS("Rebuilt %s payrolls since %s." % (count, since)))
@@ -0,0 +1,123 @@
+"""
+DailyMetrics rollup behind the admin dashboard. Every metric keeps one row per (UTC) day. Rows are moved by signal
+handlers once the write commits and reconciled from the raw tables by the backfill_daily_metrics command, so a dashboard
+window only has to sum a handful of small rows.
+"""
+import datetime
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from booking.models import DailyMetrics
+
+# metric: (model, filters, aggregate over the day's rows)
+METRIC_SOURCES = {
+    "services": ("booking.Service", {}, Count("id")),
+    "customers": ("user_module.UserProfile", {"role": "Customer"}, Count("id")),
+    "cleaners": ("user_module.UserProfile", {"role": "Cleaner"}, Count("id")),
+    "page_views": ("booking.PageViewsCount", {}, Count("id")),
+    "bookings": ("booking.Booking", {}, Count("id")),
+    "gross": ("booking.PaymentSale", {}, Sum("amount")),
+    "hours": ("booking.BookingOrderDetails", {}, Sum("total_hours")),
+}
+COUNT_METRICS = {"services", "customers", "cleaners", "page_views", "bookings"}
+
+
+def metric_day(value=None):
+    value = value or timezone.now()
+    return value.astimezone(datetime.timezone.utc).date()
+
+
+def record_metric(metric, day, delta):
+    """
+    Adds delta to the metric's row of that day, creating it when needed. The row is written once the current
+    transaction commits, so a hot day row is never held locked for the rest of a request's transaction.
+    """
+    if delta:
+        transaction.on_commit(lambda: _add_to_metric(metric, day, delta))
+
+
+def _add_to_metric(metric, day, delta):
+    rows = DailyMetrics.objects.filter(day=day, metric=metric)
+    if rows.update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            DailyMetrics.objects.create(day=day, metric=metric, value=delta)
+    except IntegrityError:  # created by a concurrent writer in the meantime
+        rows.update(value=F("value") + delta)
+
+
+def rebuild_daily_metrics(since=None, apps=global_apps):
+    """
+    Recomputes the rows of every metric from the raw tables, for the days on or after `since` (all days if None).
+    Migrations pass their historical apps.
+    """
+    DailyMetrics = apps.get_model("booking", "DailyMetrics")
+    for metric, (model, filters, aggregate) in METRIC_SOURCES.items():
+        queryset = apps.get_model(model).objects.filter(**filters)
+        if since:
+            queryset = queryset.filter(
+                created_at__gte=datetime.datetime.combine(since, datetime.time.min, datetime.timezone.utc)
+            )
+        totals = {
+            row["day"]: row["value"] or 0
+            for row in queryset.annotate(day=TruncDate("created_at", tzinfo=datetime.timezone.utc))
+            .values("day")
+            .annotate(value=aggregate)
+            .order_by()
+        }
+        with transaction.atomic():
+            stale = DailyMetrics.objects.filter(metric=metric)
+            if since:
+                stale = stale.filter(day__gte=since)
+            stale.exclude(day__in=totals.keys()).delete()
+            existing = {
+                row.day: row for row in DailyMetrics.objects.filter(metric=metric, day__in=totals.keys())
+            }
+            for row in existing.values():
+                row.value = totals[row.day]
+            DailyMetrics.objects.bulk_update(existing.values(), ["value"])
+            DailyMetrics.objects.bulk_create(
+                [
+                    DailyMetrics(day=day, metric=metric, value=value)
+                    for day, value in totals.items()
+                    if day not in existing
+                ]
+            )
+
+
+def get_metric_totals(windows):
+    """
+    windows maps a metric to a start date, or None for all time. Returns {metric: total}, where a sum metric with
+    no rows in its window is None, like an empty aggregate.
+    """
+    totals = {metric: 0 for metric in windows}
+    seen = set()
+    starts = [start for start in windows.values() if start]
+    all_time = [metric for metric, start in windows.items() if not start]
+    if starts:
+        for metric, day, value in DailyMetrics.objects.filter(
+                metric__in=[metric for metric in windows if windows[metric]], day__gte=min(starts)
+        ).values_list("metric", "day", "value"):
+            if day >= windows[metric]:
+                totals[metric] += value
+                seen.add(metric)
+    if all_time:
+        for row in (
+                DailyMetrics.objects.filter(metric__in=all_time)
+                .values("metric")
+                .annotate(total=Sum("value"))
+                .order_by()
+        ):
+            totals[row["metric"]] = row["total"]
+            seen.add(row["metric"])
+    for metric in totals:
+        if metric in COUNT_METRICS:
+            totals[metric] = int(totals[metric])
+        elif metric not in seen:
+            totals[metric] = None
+    return totals
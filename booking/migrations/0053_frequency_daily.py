@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0052_package_image_12pack'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='frequency',
+            name='type',
+            field=models.CharField(choices=[('once', 'Once'), ('daily', 'Daily'), ('weekly', 'Weekly'), ('biweekly', 'Biweekly'), ('monthly', 'Monthly')], max_length=48),
+        ),
+    ]
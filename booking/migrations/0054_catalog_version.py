@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:58
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_total_booking(apps, schema_editor):
+    Service = apps.get_model("booking", "Service")
+    BookingItemDetails = apps.get_model("booking", "BookingItemDetails")
+    totals = (
+        BookingItemDetails.objects.values("item__package__service")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    for row in totals:
+        Service.objects.filter(id=row["item__package__service"]).update(total_booking=row["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0053_frequency_daily'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='total_booking',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_total_booking, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from booking.listing import LISTING_BATCH_SIZE, save_booking_listings
+
+
+def backfill_booking_listings(apps, schema_editor):
+    """Builds the listing row of every existing booking, so the list endpoints keep showing them after deploy."""
+    Booking = apps.get_model("booking", "Booking")
+    booking_ids = list(Booking.objects.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(booking_ids), LISTING_BATCH_SIZE):
+        save_booking_listings(booking_ids[start:start + LISTING_BATCH_SIZE], apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('booking', '0054_catalog_version'),
+        ('user_module', '0012_userreview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingListing',
+            fields=[
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='booking.booking')),
+                ('status', models.CharField(max_length=48)),
+                ('appointment_date_time', models.DateTimeField(blank=True, null=True)),
+                ('booking_created_at', models.DateTimeField()),
+                ('customer_name', models.CharField(blank=True, max_length=256)),
+                ('customer_email', models.CharField(blank=True, max_length=256)),
+                ('service_title', models.CharField(blank=True, max_length=128)),
+                ('colour', models.CharField(blank=True, max_length=124)),
+                ('cleaner_name', models.CharField(blank=True, max_length=128)),
+                ('dispatch_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('collection_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('schedule_start', models.DateTimeField(blank=True, null=True)),
+                ('schedule_end', models.DateTimeField(blank=True, null=True)),
+                ('sale_status', models.CharField(blank=True, max_length=24, null=True)),
+                ('total_amount', models.FloatField(default=0.0)),
+                ('paid_amount', models.FloatField(default=0.0)),
+                ('outstanding_amount', models.FloatField(default=0.0)),
+                ('items', models.JSONField(default=list)),
+                ('extras', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bod', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='booking.bookingorderdetails')),
+                ('cleaner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cleaner_in_booking_listing', to=settings.AUTH_USER_MODEL)),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='booking.service')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='user_in_booking_listing', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookinglisting',
+            index=models.Index(fields=['status', 'appointment_date_time'], name='booking_boo_status_4cd211_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinglisting',
+            index=models.Index(fields=['user', 'status', 'appointment_date_time'], name='booking_boo_user_id_fad96d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinglisting',
+            index=models.Index(fields=['cleaner', 'status', 'appointment_date_time'], name='booking_boo_cleaner_98796c_idx'),
+        ),
+        migrations.RunPython(backfill_booking_listings, migrations.RunPython.noop),
+    ]
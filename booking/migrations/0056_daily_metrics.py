@@ -0,0 +1,35 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+from booking.metrics import rebuild_daily_metrics
+
+
+def backfill_daily_metrics(apps, schema_editor):
+    """Rolls up the existing rows, so the dashboard shows the history right after deploy."""
+    rebuild_daily_metrics(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0055_booking_listing'),
+        ('user_module', '0012_userreview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('metric', models.CharField(choices=[('services', 'Services Count'), ('customers', 'Customer Count'), ('cleaners', 'Cleaner Count'), ('page_views', 'Page Views'), ('bookings', 'Booking Count'), ('gross', 'Total Gross'), ('hours', 'Clocked Hours')], max_length=24)),
+                ('value', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('metric', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_metrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0056_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status__in', ['scheduled', 'dispatched']), ('three_hour_reminder', False)), fields=['appointment_date_time'], name='booking_reminder_due_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0058_outbound_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='email_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='booking.emailtypes'),
+        ),
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='template',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0059_outbound_email_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customersupportchat',
+            index=models.Index(fields=['collection', '-created_at', '-id'], name='booking_cus_collect_b0822a_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0060_chat_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLayerGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('channel', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChannelLayerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('message', models.BinaryField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='channellayermessage',
+            index=models.Index(fields=['channel', 'id'], name='booking_cha_channel_da409d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='channellayermessage',
+            index=models.Index(fields=['expires_at'], name='booking_cha_expires_d9a63a_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='channellayergroup',
+            unique_together={('group', 'channel')},
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+from booking.geo import grid_cell, to_coordinate
+
+
+def clean_coordinates(apps, schema_editor):
+    """Replaces the "null" placeholders and other non numbers with NULL, so the columns can become numeric."""
+    Booking = apps.get_model("booking", "Booking")
+    Booking.objects.filter(latitude="null").update(latitude=None)
+    Booking.objects.filter(longitude="null").update(longitude=None)
+    bookings = []
+    for booking in Booking.objects.exclude(latitude=None, longitude=None).only("latitude", "longitude").iterator():
+        latitude, longitude = to_coordinate(booking.latitude, 90), to_coordinate(booking.longitude)
+        if latitude is None or longitude is None:
+            latitude = longitude = None
+        booking.latitude, booking.longitude = latitude, longitude
+        booking.grid_cell = grid_cell(latitude, longitude)
+        bookings.append(booking)
+    Booking.objects.bulk_update(bookings, ["latitude", "longitude", "grid_cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0061_channel_layer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='latitude',
+            field=models.CharField(blank=True, max_length=124, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='longitude',
+            field=models.CharField(blank=True, max_length=124, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='grid_cell',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(clean_coordinates, migrations.RunPython.noop),
+    ]
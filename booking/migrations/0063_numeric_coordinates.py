@@ -0,0 +1,27 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0062_clean_coordinates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['grid_cell', 'appointment_date_time'], name='booking_grid_cell_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from booking.calendar_events import get_company_timezone
+from booking.payroll import get_period
+
+
+def assign_periods(apps, schema_editor):
+    """
+    Files the payrolls written before pay periods under the period of their booking, or of their creation when they
+    have none. sp was one-to-one until now, so no two rows land on the same cleaner and period.
+    """
+    Payroll = apps.get_model("booking", "Payroll")
+    tz = get_company_timezone(apps)
+    payrolls = list(Payroll.objects.select_related("booking"))
+    for payroll in payrolls:
+        moment = payroll.booking.appointment_date_time if payroll.booking else payroll.created_at
+        payroll.period_start, payroll.period_end = get_period(moment, tz)
+    Payroll.objects.bulk_update(payrolls, ["period_start", "period_end"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('booking', '0063_numeric_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payroll',
+            name='period_end',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payroll',
+            name='period_start',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(assign_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payroll',
+            name='sp',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_provider_in_payroll', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='payroll',
+            unique_together={('sp', 'period_start')},
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0064_payroll_periods'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_reminder_due_idx',
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='reminder_failures',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('reminder_failures__lt', 3), ('status__in', ['scheduled', 'dispatched']), ('three_hour_reminder', False)), fields=['appointment_date_time'], name='booking_reminder_due_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0065_reminder_failures'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='collection_id',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='customer_email',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='dispatch_id',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='extras',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='items',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='outstanding_amount',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='paid_amount',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='schedule_start',
+        ),
+        migrations.RemoveField(
+            model_name='bookinglisting',
+            name='total_amount',
+        ),
+    ]
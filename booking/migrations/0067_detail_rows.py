@@ -0,0 +1,54 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0066_booking_listing_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BODExtraDetailsRow',
+            fields=[
+                ('bookingextradetailsabstract_ptr', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='booking.bookingextradetailsabstract')),
+            ],
+            options={
+                'db_table': 'booking_bodextradetails',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BODItemDetailsRow',
+            fields=[
+                ('bookingitemdetailsabstract_ptr', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='booking.bookingitemdetailsabstract')),
+            ],
+            options={
+                'db_table': 'booking_boditemdetails',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BookingExtraDetailsRow',
+            fields=[
+                ('bookingextradetailsabstract_ptr', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='booking.bookingextradetailsabstract')),
+            ],
+            options={
+                'db_table': 'booking_bookingextradetails',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BookingItemDetailsRow',
+            fields=[
+                ('bookingitemdetailsabstract_ptr', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='booking.bookingitemdetailsabstract')),
+            ],
+            options={
+                'db_table': 'booking_bookingitemdetails',
+                'managed': False,
+            },
+        ),
+    ]
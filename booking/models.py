@@ -3,6 +3,7 @@ import datetime
 from django.db import models
 from django.http import Http404
 
+from booking.geo import grid_cell
 from user_module.models import User, UserProfile
 
 
@@ -79,6 +80,8 @@ class Service(models.Model):
     ]
     type = models.CharField(max_length=24, choices=type_choices, default="Regular")
     colour = models.CharField(max_length=128, default="#FFA500")
+    # BookingItemDetails rows of this service's items, kept up to date by materialize_bookings and a post_delete signal.
+    total_booking = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -213,6 +216,7 @@ class Frequency(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     type_choices = [
         ("once", "Once"),
+        ("daily", "Daily"),
         ("weekly", "Weekly"),
         ("biweekly", "Biweekly"),
         ("monthly", "Monthly"),
@@ -331,15 +335,39 @@ class Booking(BookingAbstract):
     three_day_reminder = models.BooleanField(default=False)
     one_day_reminder = models.BooleanField(default=False)
     three_hour_reminder = models.BooleanField(default=False)
+    # reminder sends that failed, see booking.reminders.MAX_REMINDER_FAILURES
+    reminder_failures = models.PositiveSmallIntegerField(default=0)
     is_cancelled = models.BooleanField(default=False)
-    latitude = models.CharField(max_length=124, default="null")
-    longitude = models.CharField(max_length=124, default="null")
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    grid_cell = models.PositiveIntegerField(null=True, blank=True)  # see booking.geo.grid_cell
     appointment_date_time = (
         models.DateTimeField()
     )  # when the appointment will be scheduled if scheduled.
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        self.grid_cell = grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"grid_cell"}
+        return super(Booking, self).save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # bookings within a radius, see booking.proximity
+            models.Index(fields=["grid_cell", "appointment_date_time"], name="booking_grid_cell_idx"),
+            # bookings that still have a reminder to send, see booking.reminders
+            models.Index(
+                fields=["appointment_date_time"],
+                name="booking_reminder_due_idx",
+                condition=models.Q(
+                    status__in=["scheduled", "dispatched"], three_hour_reminder=False, reminder_failures__lt=3
+                ),
+            ),
+        ]
+
 
 class BookingItemDetailsAbstract(models.Model):
     """
@@ -430,6 +458,62 @@ class BookingExtraDetails(BookingExtraDetailsAbstract):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE)
 
 
+# The child tables of the detail models on their own. Django refuses bulk_create with multi-table inheritance, so
+# booking.utils.bulk_create_details bulk creates the parent rows, then the child rows through these.
+
+
+class BODItemDetailsRow(models.Model):
+    bookingitemdetailsabstract_ptr = models.OneToOneField(
+        BookingItemDetailsAbstract, on_delete=models.DO_NOTHING, primary_key=True, related_name="+"
+    )
+    bod = models.ForeignKey(BookingOrderDetails, on_delete=models.DO_NOTHING, related_name="+")
+
+    class Meta:
+        managed = False
+        db_table = BODItemDetails._meta.db_table
+
+
+class BODExtraDetailsRow(models.Model):
+    bookingextradetailsabstract_ptr = models.OneToOneField(
+        BookingExtraDetailsAbstract, on_delete=models.DO_NOTHING, primary_key=True, related_name="+"
+    )
+    bod = models.ForeignKey(BookingOrderDetails, on_delete=models.DO_NOTHING, related_name="+")
+
+    class Meta:
+        managed = False
+        db_table = BODExtraDetails._meta.db_table
+
+
+class BookingItemDetailsRow(models.Model):
+    bookingitemdetailsabstract_ptr = models.OneToOneField(
+        BookingItemDetailsAbstract, on_delete=models.DO_NOTHING, primary_key=True, related_name="+"
+    )
+    booking = models.ForeignKey(Booking, on_delete=models.DO_NOTHING, related_name="+")
+
+    class Meta:
+        managed = False
+        db_table = BookingItemDetails._meta.db_table
+
+
+class BookingExtraDetailsRow(models.Model):
+    bookingextradetailsabstract_ptr = models.OneToOneField(
+        BookingExtraDetailsAbstract, on_delete=models.DO_NOTHING, primary_key=True, related_name="+"
+    )
+    booking = models.ForeignKey(Booking, on_delete=models.DO_NOTHING, related_name="+")
+
+    class Meta:
+        managed = False
+        db_table = BookingExtraDetails._meta.db_table
+
+
+DETAIL_ROW_MODELS = {
+    BODItemDetails: BODItemDetailsRow,
+    BODExtraDetails: BODExtraDetailsRow,
+    BookingItemDetails: BookingItemDetailsRow,
+    BookingExtraDetails: BookingExtraDetailsRow,
+}
+
+
 class Schedule(models.Model):
     """
     Booking Schedule model for cleaners/service providers. A month of schedule should get created at once for recurring booking for the cleaners.
@@ -619,6 +703,9 @@ class CustomerSupportChat(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["collection", "-created_at", "-id"])]
+
 
 class CleanyBranches(models.Model):
     """Totally not related with the app. This is is an additional service. Helps route mobile app remote server."""
@@ -785,13 +872,18 @@ class BookingNotifications(models.Model):
 
 
 class Payroll(models.Model):
-    """Payroll."""
+    """
+    Payroll of a service provider for one pay period (PAYROLL_PERIOD), accrued by booking.payroll. total_amount is
+    the wages (total_hours at the hourly rate) plus tip_amount, due_amount what is left after paid_amount.
+    """
 
-    sp = models.OneToOneField(
+    sp = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="service_provider_in_payroll"
     )
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name="booking_in_payroll",
                                 null=True, blank=True)
+    period_start = models.DateField(null=True, blank=True)
+    period_end = models.DateField(null=True, blank=True)
     hourly_wage = models.FloatField(default=0.00)
     total_hours = models.FloatField(default=0.00)
     total_amount = models.FloatField(default=0.00)
@@ -801,6 +893,9 @@ class Payroll(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        unique_together = ("sp", "period_start")
+
 
 class Invoice(models.Model):
     """Invoice"""
@@ -872,6 +967,33 @@ class EmailLogs(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
+class OutboundEmail(models.Model):
+    """
+    Outbox of transactional emails. Views only enqueue rows, booking.mailer renders and sends them in batches.
+    """
+
+    status_choices = [
+        ("queued", "Queued"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=256)
+    template = models.CharField(max_length=128, blank=True, default="")
+    email_type = models.ForeignKey(EmailTypes, on_delete=models.SET_NULL, null=True, blank=True)
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=status_choices, default="queued")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"])]
+
+
 class PayrollLedger(models.Model):
     """Payroll ledger."""
 
@@ -889,3 +1011,104 @@ class Banners(models.Model):
     description = models.TextField(default = 'null', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class CatalogVersion(models.Model):
+    """
+    Single row counter bumped on every save or delete of the service catalog (Service, Package, Item, Extra, Tax,
+    Banners). Every process compares it with the version of its in-memory catalog snapshot.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class BookingListing(models.Model):
+    """
+    Flat, indexed projection of a Booking that the booking list endpoints filter, order and paginate on instead of
+    joining BOD, contact info, service, sale, dispatch and schedule, and that the calendar reads its events from.
+    Rows are rebuilt by booking.listing whenever one of those changes, never edit them directly.
+    """
+
+    booking = models.OneToOneField(
+        Booking, on_delete=models.CASCADE, primary_key=True, related_name="listing"
+    )
+    bod = models.ForeignKey(BookingOrderDetails, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="user_in_booking_listing",
+    )  # customer
+    status = models.CharField(max_length=48)
+    appointment_date_time = models.DateTimeField(null=True, blank=True)
+    booking_created_at = models.DateTimeField()
+    customer_name = models.CharField(max_length=256, blank=True)
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True)
+    service_title = models.CharField(max_length=128, blank=True)
+    colour = models.CharField(max_length=124, blank=True)
+    cleaner = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="cleaner_in_booking_listing",
+    )
+    cleaner_name = models.CharField(max_length=128, blank=True)
+    schedule_end = models.DateTimeField(null=True, blank=True)
+    sale_status = models.CharField(max_length=24, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "appointment_date_time"]),
+            models.Index(fields=["user", "status", "appointment_date_time"]),
+            models.Index(fields=["cleaner", "status", "appointment_date_time"]),
+        ]
+
+
+class DailyMetrics(models.Model):
+    """
+    One row per (UTC) day and dashboard metric. Maintained at write time by booking.metrics and reconciled nightly
+    by the backfill_daily_metrics command.
+    """
+
+    metric_choices = [
+        ("services", "Services Count"),
+        ("customers", "Customer Count"),
+        ("cleaners", "Cleaner Count"),
+        ("page_views", "Page Views"),
+        ("bookings", "Booking Count"),
+        ("gross", "Total Gross"),
+        ("hours", "Clocked Hours"),
+    ]
+    day = models.DateField()
+    metric = models.CharField(max_length=24, choices=metric_choices)
+    value = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("metric", "day")
+
+
+class ChannelLayerMessage(models.Model):
+    """Message buffered by cleany.channel_layers.PostgresChannelLayer until it is received or expires."""
+
+    channel = models.CharField(max_length=100)
+    message = models.BinaryField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["channel", "id"]), models.Index(fields=["expires_at"])]
+
+
+class ChannelLayerGroup(models.Model):
+    """Group membership of a channel in cleany.channel_layers.PostgresChannelLayer."""
+
+    group = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("group", "channel")
@@ -0,0 +1,202 @@
+"""
+Payroll accruals. Every cleaner has one Payroll row per pay period (PAYROLL_PERIOD, in the company timezone).
+
+Work is accrued when a booking completes. Each cleaner dispatched to it gets their checked-in hours (the booking's
+total_hours when they never checked in) at their hourly rate, plus an even share of the tip recorded on the schedule.
+Charged tips are accrued on the day they are charged, shared the same way. Both post with F() increments, so
+concurrent accruals add up. rebuild_payroll recomputes whole periods from the source rows with one grouped query.
+"""
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from booking.calendar_events import get_company_timezone
+from booking.models import Booking, ChargeTip, DispatchedAppointment, Payroll, Schedule
+from service_provider.models import ServiceProviderLocation
+from user_module.models import UserProfile
+
+PERIOD_STEPS = {"week": relativedelta(weeks=1), "month": relativedelta(months=1)}
+
+
+def get_period(value, tz=None):
+    """(first day, last day) of the pay period a datetime falls in."""
+    day = value.astimezone(tz or get_company_timezone()).date()
+    if settings.PAYROLL_PERIOD == "month":
+        start = day.replace(day=1)
+    else:
+        start = day - datetime.timedelta(days=day.weekday())
+    return start, start + PERIOD_STEPS[settings.PAYROLL_PERIOD] - datetime.timedelta(days=1)
+
+
+def payroll_day(value=None):
+    """Company-local date of a datetime, today by default."""
+    return (value or timezone.now()).astimezone(get_company_timezone()).date()
+
+
+def post_accrual(cleaner_id, period, hours=0, wages=0, tips=0, hourly_wage=None):
+    """Adds to a cleaner's payroll of a period, creating the row when needed."""
+    amount = wages + tips
+    if not (hours or amount):
+        return
+    changes = {
+        "total_hours": F("total_hours") + hours,
+        "total_amount": F("total_amount") + amount,
+        "tip_amount": F("tip_amount") + tips,
+        "due_amount": F("due_amount") + amount,
+    }
+    if hourly_wage is not None:
+        changes["hourly_wage"] = hourly_wage
+    rows = Payroll.objects.filter(sp_id=cleaner_id, period_start=period[0])
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            Payroll.objects.create(
+                sp_id=cleaner_id,
+                period_start=period[0],
+                period_end=period[1],
+                hourly_wage=hourly_wage or 0,
+                total_hours=hours,
+                total_amount=amount,
+                tip_amount=tips,
+                due_amount=amount,
+            )
+    except IntegrityError:  # created by a concurrent accrual in the meantime
+        rows.update(**changes)
+
+
+def accrue_booking(booking):
+    """Posts the hours, wages and schedule tip of a completed booking to its dispatched cleaners."""
+    checked_hours = (
+        ServiceProviderLocation.objects.filter(
+            booking=booking.id, service_provider=OuterRef("service_provider"), total_hours__isnull=False
+        )
+        .values("service_provider")
+        .annotate(hours=Sum("total_hours"))
+        .values("hours")
+    )
+    cleaners = list(
+        DispatchedAppointment.objects.filter(booking=booking.id, status="Dispatched")
+        .annotate(
+            hours=Subquery(checked_hours),
+            rate=Subquery(
+                UserProfile.objects.filter(user=OuterRef("service_provider")).values("hourly_rate")[:1]
+            ),
+        )
+        .values_list("service_provider", "hours", "rate")
+    )
+    if not cleaners:
+        return
+    tip = Schedule.objects.filter(booking=booking.id).values_list("tip_amount", flat=True).first() or 0
+    period = get_period(booking.appointment_date_time)
+    with transaction.atomic():
+        for cleaner_id, hours, rate in cleaners:
+            hours = hours if hours is not None else booking.total_hours or 0
+            rate = float(rate or 0)
+            post_accrual(cleaner_id, period, hours, hours * rate, tip / len(cleaners), hourly_wage=rate)
+
+
+def accrue_tip(tip):
+    """Posts a charged tip to the cleaners dispatched to its booking, evenly."""
+    cleaners = list(
+        DispatchedAppointment.objects.filter(booking=tip.booking_id, status="Dispatched").values_list(
+            "service_provider", flat=True
+        )
+    )
+    period = get_period(tip.created_at)
+    with transaction.atomic():
+        for cleaner_id in cleaners:
+            post_accrual(cleaner_id, period, tips=float(tip.tip_amount or 0) / len(cleaners))
+
+
+REBUILD_SQL = """
+WITH work AS (
+    SELECT d.service_provider_id AS sp_id,
+           date_trunc(%(unit)s, b.appointment_date_time AT TIME ZONE %(tz)s)::date AS period_start,
+           COALESCE(
+               (SELECT SUM(l.total_hours) FROM {location} l
+                WHERE l.booking_id = b.id AND l.service_provider_id = d.service_provider_id),
+               b.total_hours, 0
+           ) AS hours,
+           COALESCE(p.hourly_rate, 0)::float AS rate,
+           COALESCE(s.tip_amount, 0) / COUNT(*) OVER (PARTITION BY b.id) AS tip
+    FROM {booking} b
+    JOIN {dispatch} d ON d.booking_id = b.id AND d.status = 'Dispatched'
+    LEFT JOIN {profile} p ON p.user_id = d.service_provider_id
+    LEFT JOIN {schedule} s ON s.booking_id = b.id
+    WHERE b.status = 'complete' AND b.appointment_date_time >= %(start)s AND b.appointment_date_time < %(end)s
+), charged AS (
+    SELECT d.service_provider_id AS sp_id,
+           date_trunc(%(unit)s, t.created_at AT TIME ZONE %(tz)s)::date AS period_start,
+           0 AS hours,
+           NULL::float AS rate,
+           t.tip_amount / COUNT(*) OVER (PARTITION BY t.id) AS tip
+    FROM {tip} t
+    JOIN {dispatch} d ON d.booking_id = t.booking_id AND d.status = 'Dispatched'
+    WHERE t.created_at >= %(start)s AND t.created_at < %(end)s
+)
+SELECT sp_id, period_start, SUM(hours), SUM(hours * COALESCE(rate, 0)), SUM(tip), MAX(rate)
+FROM (SELECT * FROM work UNION ALL SELECT * FROM charged) accruals
+GROUP BY sp_id, period_start
+"""
+
+
+def rebuild_payroll(first_day, last_day=None):
+    """
+    Recomputes the payrolls of every period from the one holding first_day to the one holding last_day (default
+    first_day) from the completed bookings and tips, with one grouped query. Paid amounts are kept, periods without
+    any accrual left are zeroed. Returns the number of payroll rows written.
+    """
+    tz = get_company_timezone()
+    first = get_period(tz.localize(datetime.datetime.combine(first_day, datetime.time.min)), tz)[0]
+    last = get_period(tz.localize(datetime.datetime.combine(last_day or first_day, datetime.time.min)), tz)[1]
+    start = tz.localize(datetime.datetime.combine(first, datetime.time.min))
+    end = tz.localize(datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time.min))
+    sql = REBUILD_SQL.format(
+        booking=Booking._meta.db_table,
+        dispatch=DispatchedAppointment._meta.db_table,
+        profile=UserProfile._meta.db_table,
+        schedule=Schedule._meta.db_table,
+        tip=ChargeTip._meta.db_table,
+        location=ServiceProviderLocation._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {"unit": settings.PAYROLL_PERIOD, "tz": tz.zone, "start": start, "end": end})
+        totals = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+    with transaction.atomic():
+        existing = {
+            (payroll.sp_id, payroll.period_start): payroll
+            for payroll in Payroll.objects.select_for_update().filter(period_start__range=(first, last))
+        }
+        for key, payroll in existing.items():
+            hours, wages, tips, rate = totals.get(key, (0, 0, 0, None))
+            payroll.total_hours, payroll.tip_amount = hours or 0, tips or 0
+            payroll.total_amount = (wages or 0) + (tips or 0)
+            payroll.due_amount = payroll.total_amount - payroll.paid_amount
+            if rate is not None:
+                payroll.hourly_wage = rate
+        Payroll.objects.bulk_update(
+            existing.values(), ["total_hours", "tip_amount", "total_amount", "due_amount", "hourly_wage"]
+        )
+        created = []
+        for (cleaner_id, period_start), (hours, wages, tips, rate) in totals.items():
+            if (cleaner_id, period_start) not in existing:
+                amount = (wages or 0) + (tips or 0)
+                created.append(
+                    Payroll(
+                        sp_id=cleaner_id,
+                        period_start=period_start,
+                        period_end=period_start + PERIOD_STEPS[settings.PAYROLL_PERIOD] - datetime.timedelta(days=1),
+                        hourly_wage=rate or 0,
+                        total_hours=hours or 0,
+                        total_amount=amount,
+                        tip_amount=tips or 0,
+                        due_amount=amount,
+                    )
+                )
+        Payroll.objects.bulk_create(created)
+    return len(existing) + len(created)
@@ -0,0 +1,101 @@
+"""
+Proximity queries. SQL narrows the rows down to the grid cells around a point (see booking.geo), then the exact
+haversine distances of the candidates are computed in one NumPy call and the ones outside the radius dropped.
+"""
+import math
+
+import numpy as np
+from django.db.models import Q
+
+from booking.availability import booking_slot, get_availability_index
+from booking.geo import bounding_box, grid_cells_within, haversine_km, parse_point
+from booking.models import Booking
+from user_module.models import UserProfile
+
+NEAREST_START_RADIUS_KM = 5
+NEAREST_MAX_RADIUS_KM = 160
+
+
+def near_filter(latitude, longitude, radius_km):
+    """Q matching the rows in the grid cells around a point, or in its bounding box for large radii."""
+    cells = grid_cells_within(latitude, longitude, radius_km)
+    if cells is not None:
+        return Q(grid_cell__in=cells)
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_km)
+    near = Q(latitude__gte=min_latitude, latitude__lte=max_latitude)
+    if max_longitude - min_longitude >= 360:
+        return near
+    if min_longitude < -180:
+        return near & (Q(longitude__gte=min_longitude + 360) | Q(longitude__lte=max_longitude))
+    if max_longitude > 180:
+        return near & (Q(longitude__gte=min_longitude) | Q(longitude__lte=max_longitude - 360))
+    return near & Q(longitude__gte=min_longitude, longitude__lte=max_longitude)
+
+
+def _within(rows, latitude, longitude, radius_km):
+    """[(distance km, row)] of the rows (ending in latitude, longitude) inside the radius, nearest first."""
+    if not rows:
+        return []
+    points = np.array([row[-2:] for row in rows], dtype=float)
+    distances = haversine_km(latitude, longitude, points[:, 0], points[:, 1])
+    order = np.argsort(distances, kind="stable")
+    return [(float(distances[i]), rows[i]) for i in order if distances[i] <= radius_km]
+
+
+def nearest_available_cleaners(booking, limit=5, max_radius_km=NEAREST_MAX_RADIUS_KM):
+    """
+    Up to `limit` cleaners free for the booking's slot, nearest first: [{"cleaner_id", "first_name", "last_name",
+    "distance_km"}]. The search radius doubles from NEAREST_START_RADIUS_KM until enough are found.
+    """
+    latitude, longitude = parse_point(booking.latitude, booking.longitude)
+    if math.isnan(latitude):
+        raise ValueError("Booking has no coordinates")
+    start, end = booking_slot(booking)
+    free = set(get_availability_index(start, end).free_cleaners(start, end, exclude_booking=booking.id))
+    radius = min(NEAREST_START_RADIUS_KM, max_radius_km)
+    while True:
+        rows = list(
+            UserProfile.objects.filter(
+                near_filter(latitude, longitude, radius), role="Cleaner", user__in=free
+            ).values_list("user", "first_name", "last_name", "latitude", "longitude")
+        ) if free else []
+        found = _within(rows, latitude, longitude, radius)
+        if len(found) >= limit or radius >= max_radius_km:
+            break
+        radius = min(radius * 2, max_radius_km)
+    return [
+        {
+            "cleaner_id": user,
+            "first_name": first_name,
+            "last_name": last_name,
+            "distance_km": round(distance, 3),
+        }
+        for distance, (user, first_name, last_name, cleaner_latitude, cleaner_longitude) in found[:limit]
+    ]
+
+
+def bookings_within_radius(latitude, longitude, radius_km, start=None, end=None, status=None):
+    """
+    Bookings within radius_km of a point, nearest first: [{"booking_id", "status", "appointment_date_time",
+    "latitude", "longitude", "distance_km"}]. start/end bound appointment_date_time, status narrows it down.
+    """
+    bookings = Booking.objects.filter(near_filter(latitude, longitude, radius_km))
+    if start:
+        bookings = bookings.filter(appointment_date_time__gte=start)
+    if end:
+        bookings = bookings.filter(appointment_date_time__lt=end)
+    if status:
+        bookings = bookings.filter(status=status)
+    rows = list(bookings.values_list("id", "status", "appointment_date_time", "latitude", "longitude"))
+    return [
+        {
+            "booking_id": booking_id,
+            "status": booking_status,
+            "appointment_date_time": appointment_date_time,
+            "latitude": booking_latitude,
+            "longitude": booking_longitude,
+            "distance_km": round(distance, 3),
+        }
+        for distance, (booking_id, booking_status, appointment_date_time, booking_latitude, booking_longitude)
+        in _within(rows, latitude, longitude, radius_km)
+    ]
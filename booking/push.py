@@ -0,0 +1,124 @@
+"""
+Push notification delivery. Callers only enqueue. Pushes to the same device token within PUSH_COALESCE_SECONDS
+collapse into the latest one. Tokens that receive the same message are then sent as one multicast call on a small
+worker pool sharing one long-lived client, so a slow gateway never blocks a request thread or the chat event loop.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# FCM accepts at most this many registration ids per multicast request
+MULTICAST_LIMIT = 1000
+
+
+class FCMPushBackend:
+    def __init__(self):
+        from pyfcm import FCMNotification
+
+        # without a key every send fails and is logged by the dispatcher, the callers are not affected
+        self.client = FCMNotification(api_key=settings.FCM_API_KEY) if settings.FCM_API_KEY else None
+
+    def send_multicast(self, tokens, title, body, data):
+        if self.client is None:
+            raise ImproperlyConfigured("FCM_API_KEY is not set")
+        if len(tokens) == 1:
+            return self.client.notify_single_device(
+                registration_id=tokens[0], message_title=title, message_body=body, data_message=data
+            )
+        return self.client.notify_multiple_devices(
+            registration_ids=tokens, message_title=title, message_body=body, data_message=data
+        )
+
+
+class StubPushBackend:
+    """Keeps the pushes in memory instead of sending them, for tests and local development."""
+
+    def __init__(self):
+        self.outbox = []
+
+    def send_multicast(self, tokens, title, body, data):
+        self.outbox.append({"tokens": list(tokens), "title": title, "body": body, "data": data})
+
+
+class PushDispatcher:
+    def __init__(self, backend, workers, window, max_pending):
+        self.backend = backend
+        self.window = window
+        self.max_pending = max_pending
+        self._pending = {}  # token: (title, body, data as json)
+        self._timer = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="push")
+
+    def push(self, tokens, title, body, data=None):
+        message = (title, body, json.dumps(data or {}, sort_keys=True, default=str))
+        with self._lock:
+            for token in tokens:
+                if token:
+                    self._pending[token] = message
+            flush_now = len(self._pending) >= self.max_pending
+            if not flush_now and self._pending and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Hands the pending pushes to the pool, one multicast per message. Returns the futures."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        by_message = {}
+        for token, message in pending.items():
+            by_message.setdefault(message, []).append(token)
+        futures = []
+        for (title, body, data), tokens in by_message.items():
+            for start in range(0, len(tokens), MULTICAST_LIMIT):
+                futures.append(
+                    self._executor.submit(
+                        self._send, tokens[start:start + MULTICAST_LIMIT], title, body, json.loads(data)
+                    )
+                )
+        return futures
+
+    def _send(self, tokens, title, body, data):
+        try:
+            self.backend.send_multicast(tokens, title, body, data)
+        except Exception:
+            logger.exception("Push to %s devices failed", len(tokens))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_push_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = PushDispatcher(
+                    import_string(settings.PUSH_BACKEND)(),
+                    workers=settings.PUSH_WORKERS,
+                    window=settings.PUSH_COALESCE_SECONDS,
+                    max_pending=settings.PUSH_MAX_PENDING,
+                )
+    return _dispatcher
+
+
+def push_to_tokens(tokens, title, body, data=None):
+    get_push_dispatcher().push(tokens, title, body, data)
+
+
+def push_to_users(users, title, body, data=None):
+    push_to_tokens([user.device_token for user in users], title, body, data)
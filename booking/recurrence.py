@@ -0,0 +1,170 @@
+"""
+Recurrence rules for BookingOrderDetails. A Frequency describes the whole series, but only the occurrences inside
+the rolling horizon are materialized as Booking rows. Everything past the last materialized Booking is computed on
+the fly and returned as a virtual occurrence.
+"""
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from booking.models import Booking, BookingOrderDetails
+
+RECURRENCE_STEPS = {
+    "daily": relativedelta(days=1),
+    "weekly": relativedelta(weeks=1),
+    "biweekly": relativedelta(weeks=2),
+    "monthly": relativedelta(months=1),
+}
+
+
+def to_naive(value):
+    """Bookings are scheduled with naive datetimes, so aware values read back from the db are made naive first."""
+    if value is not None and timezone.is_aware(value):
+        return timezone.make_naive(value)
+    return value
+
+
+def get_horizon_end(now=None):
+    """Last datetime that should be materialized as a Booking row."""
+    now = to_naive(now or timezone.now())
+    return now + datetime.timedelta(days=settings.BOOKING_HORIZON_DAYS)
+
+
+def get_series_start(frequency, start_time):
+    """First appointment of a series, e.g.: 2023-05-01 + '10:30' -> datetime(2023, 5, 1, 10, 30)."""
+    return datetime.datetime.strptime(
+        str(frequency.start_date) + " " + str(start_time)[:5], "%Y-%m-%d %H:%M"
+    )
+
+
+def _first_index(frequency, series_start, after):
+    """Index of the first occurrence that can be later than `after`, so long series are not walked from the start."""
+    if after is None or after <= series_start:
+        return 0
+    if frequency.type == "monthly":
+        return max(
+            (after.year - series_start.year) * 12 + after.month - series_start.month - 1,
+            0,
+        )
+    step_days = RECURRENCE_STEPS[frequency.type].days
+    return max((after - series_start).days // step_days, 0)
+
+
+def iter_occurrences(frequency, start_time, after=None, until=None):
+    """
+    Yields the appointment datetimes of a series in order. `after` is exclusive, `until` inclusive. The series ends
+    on frequency.recur_end_date (the whole day is included), or runs forever when it is not set.
+    """
+    series_start = get_series_start(frequency, start_time)
+    step = RECURRENCE_STEPS.get(frequency.type)
+    recur_end_date = to_naive(frequency.recur_end_date)
+    if step is None:  # once
+        if (after is None or series_start > after) and (
+                until is None or series_start <= until
+        ):
+            yield series_start
+        return
+    index = _first_index(frequency, series_start, after)
+    while True:
+        occurrence = series_start + step * index
+        if until is not None and occurrence > until:
+            return
+        if recur_end_date is not None and occurrence.date() > recur_end_date.date():
+            return
+        if after is None or occurrence > after:
+            yield occurrence
+        index += 1
+
+
+def get_recurring_orders(start=None):
+    """Active recurring orders that still have occurrences on or after `start`, annotated with the last Booking."""
+    orders = (
+        BookingOrderDetails.objects.select_related(
+            "frequency__service", "bod_contact_info", "bod_service_location", "user"
+        )
+        .filter(status="scheduled")
+        .exclude(frequency__type="once")
+        .annotate(last_materialized=Max("booking__appointment_date_time"))
+    )
+    if start is not None:
+        orders = orders.filter(
+            Q(frequency__recur_end_date__isnull=True)
+            | Q(frequency__recur_end_date__date__gte=start.date())
+        )
+    return orders
+
+
+def get_virtual_occurrences(start, end, bod=None):
+    """
+    Occurrences between start and end (naive, inclusive) that are not materialized yet. Costs one query no matter
+    how many orders or occurrences fall in the range.
+    """
+    orders = get_recurring_orders(start)
+    if bod:
+        orders = orders.filter(id=bod)
+    occurrences = []
+    for order in orders:
+        after = start - datetime.timedelta(microseconds=1)
+        last_materialized = to_naive(order.last_materialized)
+        if last_materialized is not None and last_materialized > after:
+            after = last_materialized
+        for appointment_date_time in iter_occurrences(
+                order.frequency, order.start_time, after=after, until=end
+        ):
+            occurrences.append(
+                {
+                    "id": None,
+                    "bod": order.id,
+                    "virtual": True,
+                    "status": "scheduled",
+                    "appointment_date_time": appointment_date_time,
+                    "end_time": appointment_date_time
+                                + datetime.timedelta(hours=order.total_hours or 0),
+                    "service": order.frequency.service.title,
+                    "customer": order.bod_contact_info.get_full_name(),
+                    "colour": order.colour,
+                }
+            )
+    return occurrences
+
+
+def get_occurrences(start, end, bod=None):
+    """Materialized bookings and virtual occurrences between start and end, ordered by appointment time."""
+    bookings = Booking.objects.filter(
+        appointment_date_time__gte=start, appointment_date_time__lte=end
+    )
+    if bod:
+        bookings = bookings.filter(bod__id=bod)
+    occurrences = [
+        {
+            "id": booking["id"],
+            "bod": booking["bod"],
+            "virtual": False,
+            "status": booking["status"],
+            "appointment_date_time": to_naive(booking["appointment_date_time"]),
+            "end_time": to_naive(booking["appointment_date_time"])
+                        + datetime.timedelta(hours=booking["bod__total_hours"] or 0),
+            "service": booking["bod__frequency__service__title"],
+            "customer": booking["bod__bod_contact_info__first_name"]
+                        + " "
+                        + booking["bod__bod_contact_info__last_name"],
+            "colour": booking["bod__colour"],
+        }
+        for booking in bookings.values(
+            "id",
+            "bod",
+            "status",
+            "appointment_date_time",
+            "bod__total_hours",
+            "bod__frequency__service__title",
+            "bod__bod_contact_info__first_name",
+            "bod__bod_contact_info__last_name",
+            "bod__colour",
+        )
+    ]
+    occurrences += get_virtual_occurrences(start, end, bod)
+    occurrences.sort(key=lambda occurrence: occurrence["appointment_date_time"])
+    return occurrences
@@ -0,0 +1,135 @@
+"""
+Booking reminder engine. All three reminder tiers are computed from one indexed query. Mail goes out in batches
+over a single connection, and only the bookings whose mail was accepted get their EmailLogs row and reminder flags.
+Bookings whose mail keeps failing, or that have no customer to mail, are given up after MAX_REMINDER_FAILURES.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from booking.email_templates import render_batch
+from booking.models import Booking, EmailLogs
+
+REMINDER_STATUSES = ["scheduled", "dispatched"]
+# flag: how long before the appointment the reminder is due
+REMINDER_TIERS = {
+    "three_day_reminder": datetime.timedelta(days=3),
+    "one_day_reminder": datetime.timedelta(days=1),
+    "three_hour_reminder": datetime.timedelta(hours=3),
+}
+REMINDER_BATCH_SIZE = 100
+REMINDER_TITLE = "Booking Reminder"
+# a booking stops being reminded after this many failed sends, the partial index on Booking filters on it too
+MAX_REMINDER_FAILURES = 3
+
+logger = logging.getLogger(__name__)
+
+
+def get_due_reminders(now=None):
+    """
+    Returns [(booking, [flags due])]. The tiers are due in order, so every booking with a reminder left still has
+    three_hour_reminder unset, which is what the partial index on Booking covers along with the failure count.
+    """
+    now = now or timezone.now()
+    bookings = (
+        Booking.objects.filter(
+            status__in=REMINDER_STATUSES,
+            three_hour_reminder=False,
+            reminder_failures__lt=MAX_REMINDER_FAILURES,
+            appointment_date_time__lte=now + max(REMINDER_TIERS.values()),
+        )
+        .select_related("bod__frequency__service", "bod__user")
+        .order_by("appointment_date_time", "id")
+    )
+    due = []
+    for booking in bookings:
+        flags = [
+            flag
+            for flag, ahead in REMINDER_TIERS.items()
+            if not getattr(booking, flag) and booking.appointment_date_time <= now + ahead
+        ]
+        if flags:
+            due.append((booking, flags))
+    return due
+
+
+def build_reminder_email(booking, body, connection):
+    message = EmailMessage(
+        subject=REMINDER_TITLE,
+        body=body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[booking.bod.user.email],
+        reply_to=[settings.DEFAULT_FROM_EMAIL],
+        connection=connection,
+    )
+    message.content_subtype = "html"
+    return message
+
+
+def _record_sent(sent):
+    """One EmailLogs insert and at most one update per tier for a batch of sent reminders."""
+    with transaction.atomic():
+        EmailLogs.objects.bulk_create(
+            [EmailLogs(customer=booking.bod.user, title=REMINDER_TITLE) for booking, flags in sent]
+        )
+        for flag in REMINDER_TIERS:
+            booking_ids = [booking.id for booking, flags in sent if flag in flags]
+            if booking_ids:
+                Booking.objects.filter(id__in=booking_ids).update(**{flag: True})
+
+
+def _record_failed(failed, skipped):
+    """Counts a failed send for each booking in failed, and gives up on the bookings in skipped right away."""
+    if failed:
+        Booking.objects.filter(id__in=failed).update(reminder_failures=F("reminder_failures") + 1)
+    if skipped:
+        Booking.objects.filter(id__in=skipped).update(reminder_failures=MAX_REMINDER_FAILURES)
+
+
+def send_booking_reminders(now=None, batch_size=REMINDER_BATCH_SIZE):
+    """
+    Sends one reminder per booking that has a tier due, covering every tier it is due for at once.
+    Returns {"due": ..., "sent": ..., "failed": ...}. A booking without a customer email is given up at once.
+    """
+    due = get_due_reminders(now)
+    stats = {"due": len(due), "sent": 0, "failed": 0}
+    if not due:
+        return stats
+    with get_connection() as connection:
+        for start in range(0, len(due), batch_size):
+            batch = due[start:start + batch_size]
+            bodies = render_batch(
+                "three_days.html",
+                [
+                    {
+                        "event_name": booking.bod.frequency.service.title,
+                        "event_date": booking.appointment_date_time,
+                    }
+                    for booking, flags in batch
+                ],
+            )
+            sent, failed, skipped = [], [], []
+            for (booking, flags), body in zip(batch, bodies):
+                if not (booking.bod.user and booking.bod.user.email):
+                    logger.warning("Booking %s has no customer email, skipping its reminders", booking.id)
+                    skipped.append(booking.id)
+                    continue
+                try:
+                    if connection.send_messages([build_reminder_email(booking, body, connection)]):
+                        sent.append((booking, flags))
+                        continue
+                    logger.warning("Reminder for booking %s was not accepted", booking.id)
+                except Exception:
+                    logger.exception("Reminder for booking %s failed", booking.id)
+                failed.append(booking.id)
+            if sent:
+                _record_sent(sent)
+            _record_failed(failed, skipped)
+            stats["sent"] += len(sent)
+            stats["failed"] += len(failed) + len(skipped)
+    return stats
@@ -0,0 +1,153 @@
+"""
+Reschedule engine. The new times of a whole series are computed from its frequency rule in one pass. They are
+checked against the other schedules of the dispatched cleaners and written with bulk_update in one transaction,
+unless it is a dry run or a cleaner would be double booked and the caller did not force it.
+"""
+import bisect
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from booking.availability import booking_slot, bump_availability_version, lock_cleaners
+from booking.listing import schedule_listing_refresh
+from booking.models import Booking, BookingOrderDetails, DispatchedAppointment, Frequency, Schedule
+from booking.recurrence import RECURRENCE_STEPS
+
+
+def plan_reschedule(booking, new_start, whole_series=False):
+    """
+    Returns [(booking, new start, new end)]. For a whole series the earliest booking moves to new_start and the
+    others follow the frequency rule from there, each lasting its own total_hours.
+    """
+    if timezone.is_naive(new_start):
+        new_start = timezone.make_aware(new_start)
+    bookings = [booking]
+    if whole_series:
+        bookings = list(
+            Booking.objects.filter(bod_id=booking.bod_id)
+            .select_related("booking_in_schedule")
+            .order_by("appointment_date_time", "id")
+        )
+    step = RECURRENCE_STEPS.get(booking.bod.frequency.type) if whole_series else None
+    plan = []
+    for index, series_booking in enumerate(bookings):
+        start = new_start + step * index if step else new_start
+        plan.append((series_booking, start, start + datetime.timedelta(hours=series_booking.total_hours or 0)))
+    return plan
+
+
+def find_cleaner_conflicts(plan):
+    """
+    Overlaps between the planned times and the other schedules of the cleaners dispatched to the planned bookings,
+    read with two queries whatever the size of the series.
+    """
+    if not plan:
+        return []
+    booking_ids = [booking.id for booking, start, end in plan]
+    cleaners = {}
+    for booking_id, cleaner_id in DispatchedAppointment.objects.filter(
+            booking__in=booking_ids, status="Dispatched"
+    ).values_list("booking", "service_provider"):
+        cleaners.setdefault(booking_id, set()).add(cleaner_id)
+    if not cleaners:
+        return []
+    busy = {}  # cleaner: sorted [(start, end, booking id)]
+    for cleaner_id, booking_id, start, end in (
+            Schedule.objects.filter(
+                booking__booking_in_dispatched_appointment__service_provider__in=set().union(*cleaners.values()),
+                booking__booking_in_dispatched_appointment__status="Dispatched",
+                start_time__lt=max(end for booking, start, end in plan),
+                end_time__gt=min(start for booking, start, end in plan),
+            )
+            .exclude(booking__in=booking_ids)
+            .exclude(booking__status="cancelled")
+            .values_list(
+                "booking__booking_in_dispatched_appointment__service_provider", "booking", "start_time", "end_time"
+            )
+    ):
+        busy.setdefault(cleaner_id, []).append((start, end, booking_id))
+    for intervals in busy.values():
+        intervals.sort()
+    conflicts = []
+    for booking, start, end in plan:
+        for cleaner_id in sorted(cleaners.get(booking.id, ())):
+            intervals = busy.get(cleaner_id, [])
+            # intervals starting before `end`; the ones that also end after `start` overlap
+            for busy_start, busy_end, busy_booking in intervals[:bisect.bisect_left(intervals, (end,))]:
+                if busy_end > start:
+                    conflicts.append(
+                        {
+                            "booking_id": booking.id,
+                            "cleaner_id": cleaner_id,
+                            "start": start,
+                            "end": end,
+                            "conflicting_booking_id": busy_booking,
+                            "conflicting_start": busy_start,
+                            "conflicting_end": busy_end,
+                        }
+                    )
+    return conflicts
+
+
+@transaction.atomic
+def apply_reschedule(plan, whole_series=False):
+    """Writes the plan with one bulk_update per table. A moved series is re-anchored on its new first occurrence."""
+    now = timezone.now()
+    bookings, schedules = [], []
+    slots = [booking_slot(booking) for booking, start, end in plan] + [(start, end) for booking, start, end in plan]
+    for booking, start, end in plan:
+        booking.appointment_date_time, booking.updated_at = start, now
+        bookings.append(booking)
+        schedule = getattr(booking, "booking_in_schedule", None)
+        if schedule is not None:
+            schedule.start_time, schedule.end_time, schedule.updated_at = start, end, now
+            schedules.append(schedule)
+    Booking.objects.bulk_update(bookings, ["appointment_date_time", "updated_at"])
+    Schedule.objects.bulk_update(schedules, ["start_time", "end_time", "updated_at"])
+    # bulk writes send no signals
+    bump_availability_version(slots)
+    if whole_series and plan:
+        booking, first_start, first_end = plan[0]
+        # Only materialized rows were moved, re-anchor the rule so later occurrences follow them.
+        Frequency.objects.filter(id=booking.bod.frequency_id).update(start_date=first_start.date())
+        BookingOrderDetails.objects.filter(id=booking.bod_id).update(start_time=first_start.strftime("%H:%M"))
+    schedule_listing_refresh([booking.id for booking in bookings])
+
+
+def reschedule_booking(booking, new_start, whole_series=False, dry_run=False, force=False):
+    """
+    Plans, checks and applies a reschedule, unless dry_run or there are cleaner conflicts and it is not forced.
+    Returns the plan, the cleaner conflicts and whether it was applied.
+    """
+    plan = plan_reschedule(booking, new_start, whole_series)
+    with transaction.atomic():
+        if not dry_run:
+            # the cleaners stay locked until the new times are written, so no dispatch can take them meanwhile
+            lock_cleaners(
+                list(
+                    DispatchedAppointment.objects.filter(
+                        booking__in=[booking.id for booking, start, end in plan], status="Dispatched"
+                    ).values_list("service_provider", flat=True)
+                )
+            )
+        conflicts = find_cleaner_conflicts(plan)
+        applied = not dry_run and (force or not conflicts)
+        if applied:
+            apply_reschedule(plan, whole_series)
+    return {
+        "dry_run": dry_run,
+        "applied": applied,
+        "bookings": [
+            {"booking_id": booking.id, "start": start, "end": end} for booking, start, end in plan
+        ],
+        "conflicts": conflicts,
+    }
+
+
+def describe_reschedule_conflicts(conflicts):
+    return "Cleaners are not available: " + ", ".join(
+        "cleaner #{cleaner_id} is booked for booking #{conflicting_booking_id} from {conflicting_start:%Y-%m-%d %H:%M}"
+        " to {conflicting_end:%Y-%m-%d %H:%M}".format(**conflict)
+        for conflict in conflicts
+    )
@@ -1,7 +1,9 @@
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
 from rest_framework import serializers
 from django.utils.translation import ugettext_lazy as _
+from booking.catalog import get_catalog
+from cleany.base.batch_serializers import BatchListSerializer, BatchSerializerMixin, group_by
 from booking.models import *
 from booking.utils import (
     calculate_booking_bills,
@@ -25,8 +27,19 @@ class TaxSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class ServicesSerializer(serializers.ModelSerializer):
-    service_total_booking = serializers.SerializerMethodField("get_total_booking")
+class CatalogSerializerMixin:
+    """Gives every serializer in a tree the same catalog snapshot, so the version is checked once per response."""
+
+    @property
+    def catalog(self):
+        root = self.root
+        if not hasattr(root, "_catalog"):
+            root._catalog = self.context.get("catalog") or get_catalog()
+        return root._catalog
+
+
+class ServicesSerializer(CatalogSerializerMixin, serializers.ModelSerializer):
+    service_total_booking = serializers.IntegerField(source="total_booking", read_only=True)
     banner = serializers.SerializerMethodField('get_banner')
     packages = serializers.SerializerMethodField("get_packages")
     extras = serializers.SerializerMethodField("get_extras")
@@ -34,37 +47,41 @@ class ServicesSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Service
-        fields = "__all__"
-
-    def get_total_booking(self, obj):
-        return BookingItemDetails.objects.filter(item__package__service=obj).count()
+        exclude = ["total_booking"]
 
     def get_banner(self, obj):
-        banner = Banners.objects.filter(service=obj)
-        return BannerSerializer(banner, many=True).data
+        return self.catalog.memoize(
+            ("banner", obj.id),
+            lambda: BannerSerializer(self.catalog.banners_by_service[obj.id], many=True).data,
+        )
 
     def get_packages(self, obj):
-        packages = Package.objects.filter(service=obj.id)
-        return PackagesSerializer(packages, many=True).data
+        return self.catalog.memoize(
+            ("packages", obj.id),
+            lambda: PackagesSerializer(
+                self.catalog.packages_by_service[obj.id],
+                many=True,
+                context={"catalog": self.catalog},
+            ).data,
+        )
 
     def get_extras(self, obj):
-        extras = Extra.objects.filter(service=obj.id)
-        return ExtrasSerializer(extras, many=True).data
+        return self.catalog.memoize(
+            ("extras", obj.id),
+            lambda: ExtrasSerializer(self.catalog.extras_by_service[obj.id], many=True).data,
+        )
 
     def get_tax(self, obj):
-        tax = Tax.objects.filter(service=obj.id)
-        return TaxSerializer(tax, many=True).data
+        tax = self.catalog.get_tax(obj.id)
+        return TaxSerializer([tax] if tax else [], many=True).data
 
 
 class ServicesSerializerCustomer(serializers.ModelSerializer):
-    service_total_booking = serializers.SerializerMethodField("get_total_booking")
+    service_total_booking = serializers.IntegerField(source="total_booking", read_only=True)
 
     class Meta:
         model = Service
-        fields = "__all__"
-
-    def get_total_booking(self, obj):
-        return BookingItemDetails.objects.filter(item__package__service=obj).count()
+        exclude = ["total_booking"]
 
 
 class ServicesSerializerNew(serializers.ModelSerializer):
@@ -111,7 +128,7 @@ class PackageItemSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class PackagesSerializer(serializers.ModelSerializer):
+class PackagesSerializer(CatalogSerializerMixin, serializers.ModelSerializer):
     items = ItemSerializer(many=True, write_only=True)
     item = serializers.SerializerMethodField("get_items")
 
@@ -127,8 +144,7 @@ class PackagesSerializer(serializers.ModelSerializer):
         return package
 
     def get_items(self, obj):
-        items = Item.objects.filter(package=obj)
-        return ItemSerializer(items, many=True).data
+        return ItemSerializer(self.catalog.items_by_package[obj.id], many=True).data
 
 
 class PackageListSerializer(serializers.ModelSerializer):
@@ -617,84 +633,131 @@ class ScheduleSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class BookingSerializerList(serializers.ModelSerializer):
-    payment_status = serializers.SerializerMethodField("get_payments")
-    dispatch_id = serializers.SerializerMethodField("get_dispatch_id")
-    service_provider = serializers.SerializerMethodField("get_service_provider")
-    schedule = serializers.SerializerMethodField("get_schedule")
-    bod = BodSerializer()
-    outstanding = serializers.SerializerMethodField("get_outstanding_amount")
-    collection = serializers.SerializerMethodField('get_collection')
-    dispatch = serializers.SerializerMethodField('get_dispatch')
+def load_booking_sales(bookings):
+    sales = Sale.objects.filter(booking__in=bookings).prefetch_related(
+        Prefetch("paymentsale_set", queryset=PaymentSale.objects.order_by("id"))
+    ).order_by("id")
+    return group_by(sales, "booking_id")
 
-    class Meta:
-        model = Booking
-        fields = "__all__"
+
+def load_booking_dispatches(bookings):
+    dispatches = list(
+        DispatchedAppointment.objects.filter(booking__in=bookings)
+        .select_related("service_provider")
+        .order_by("id")
+    )
+    user_profiles = {}
+    for profile in UserProfile.objects.filter(
+            user__in={dispatch.service_provider_id for dispatch in dispatches}
+    ).order_by("-id"):
+        user_profiles[profile.user_id] = profile
+    for dispatch in dispatches:
+        dispatch.serialized_data = DispatchBookingSerializer(
+            dispatch, context={"user_profiles": user_profiles}
+        ).data
+    return group_by(dispatches, "booking_id")
+
+
+def load_booking_schedules(bookings):
+    return {schedule.booking_id: schedule for schedule in Schedule.objects.filter(booking__in=bookings)}
+
+
+def load_booking_collections(bookings):
+    return group_by(
+        CustomerSupportCollection.objects.filter(booking__in=bookings).order_by("id"), "booking_id"
+    )
+
+
+def load_booking_item_details(bookings):
+    return group_by(
+        BookingItemDetails.objects.filter(booking__in=bookings).select_related("item").order_by("id"),
+        "booking_id",
+    )
+
+
+def load_booking_extra_details(bookings):
+    return group_by(
+        BookingExtraDetails.objects.filter(booking__in=bookings).select_related("extra").order_by("id"),
+        "booking_id",
+    )
+
+
+class BookingListBatchMixin(BatchSerializerMixin):
+    """Fields shared by the booking list serializers, read from per-page batches. See BatchSerializerMixin."""
+
+    batch_loaders = {
+        "sales": load_booking_sales,
+        "dispatches": load_booking_dispatches,
+        "schedules": load_booking_schedules,
+        "collections": load_booking_collections,
+    }
+    batch_prefetch = (
+        "bod__frequency__service__tax",
+        "bod__bod_contact_info",
+        "bod__bod_service_location",
+    )
+
+    def get_single(self, name, obj):
+        """Mirrors Model.objects.get(booking=obj): the row if there is exactly one, None otherwise."""
+        rows = self.batch(name, obj, [])
+        return rows[0] if len(rows) == 1 else None
 
     def get_payments(self, obj):
-        try:
-            sale = Sale.objects.get(booking=obj)
-            return sale.status
-        except Exception as e:
-            return None
+        sale = self.get_single("sales", obj)
+        return sale.status if sale else None
 
     def get_service_provider(self, obj):
-        try:
-            dispatcher = DispatchedAppointment.objects.get(booking=obj)
-            return dispatcher.service_provider.id
-        except:
-            return None
+        dispatch = self.get_single("dispatches", obj)
+        return dispatch.service_provider_id if dispatch else None
 
     def get_dispatch_id(self, obj):
-        try:
-            dispatcher = DispatchedAppointment.objects.get(booking=obj)
-            return dispatcher.id
-        except:
-            return None
+        dispatch = self.get_single("dispatches", obj)
+        return dispatch.id if dispatch else None
 
     def get_schedule(self, obj):
-        try:
-            schedule = Schedule.objects.get(booking=obj)
-            return ScheduleSerializer(schedule).data
-        except:
-            return None
+        schedule = self.batch("schedules", obj)
+        return ScheduleSerializer(schedule).data if schedule else None
 
     def get_outstanding_amount(self, obj):
-        try:
-            sale = Sale.objects.filter(booking=obj).first()
-            if sale:
-                payment_sale = PaymentSale.objects.filter(sale=sale)
-                captured_amount = payment_sale.filter(is_captured=True).aggregate(
-                    Sum("amount")
-                )["amount__sum"]
-                is_first = False
-                if captured_amount:
-                    is_first = captured_amount == payment_sale.first().is_first
-                if not captured_amount:
-                    captured_amount = 0
-                data_dict = {
-                    "total_amount": sale.amount,
-                    "status": sale.status,
-                    "paid_amount": captured_amount,
-                    "is_first": is_first,
-                }
-                return data_dict
-        except Exception as e:
+        sales = self.batch("sales", obj, [])
+        if not sales:
             return None
+        sale = sales[0]
+        payment_sale = list(sale.paymentsale_set.all())
+        captured_amount = sum(payment.amount for payment in payment_sale if payment.is_captured)
+        is_first = False
+        if captured_amount:
+            is_first = captured_amount == payment_sale[0].is_first
+        return {
+            "total_amount": sale.amount,
+            "status": sale.status,
+            "paid_amount": captured_amount,
+            "is_first": is_first,
+        }
 
     def get_collection(self, obj):
-        try:
-            collection = CustomerSupportCollection.objects.get(booking=obj)
-            return collection.id
-        except Exception as e:
-            return None
+        collection = self.get_single("collections", obj)
+        return collection.id if collection else None
 
     def get_dispatch(self, obj):
-        try:
-            dispatch = DispatchedAppointment.objects.get(booking=obj)
-            return DispatchBookingSerializer(dispatch).data
-        except Exception as e:
-            return None
+        dispatch = self.get_single("dispatches", obj)
+        return dispatch.serialized_data if dispatch else None
+
+
+class BookingSerializerList(BookingListBatchMixin, serializers.ModelSerializer):
+    payment_status = serializers.SerializerMethodField("get_payments")
+    dispatch_id = serializers.SerializerMethodField("get_dispatch_id")
+    service_provider = serializers.SerializerMethodField("get_service_provider")
+    schedule = serializers.SerializerMethodField("get_schedule")
+    bod = BodSerializer()
+    outstanding = serializers.SerializerMethodField("get_outstanding_amount")
+    collection = serializers.SerializerMethodField('get_collection')
+    dispatch = serializers.SerializerMethodField('get_dispatch')
+
+    class Meta:
+        model = Booking
+        fields = "__all__"
+        list_serializer_class = BatchListSerializer
 
 
 class ExtraSerializer(serializers.ModelSerializer):
@@ -725,9 +788,10 @@ class BookingPackageDetailsSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class BookingSerializerListCleaner(serializers.ModelSerializer):
+class BookingSerializerListCleaner(BookingListBatchMixin, serializers.ModelSerializer):
     packages = serializers.SerializerMethodField("get_packages")
     extras = serializers.SerializerMethodField("get_extras")
+    # The cleaner app reads the whole dispatch under dispatch_id as well.
     dispatch_id = serializers.SerializerMethodField("get_dispatch")
     service_provider = serializers.SerializerMethodField("get_service_provider")
     schedule = serializers.SerializerMethodField("get_schedule")
@@ -736,81 +800,22 @@ class BookingSerializerListCleaner(serializers.ModelSerializer):
     collection = serializers.SerializerMethodField('get_collection')
     dispatch = serializers.SerializerMethodField('get_dispatch')
 
+    batch_loaders = {
+        **BookingListBatchMixin.batch_loaders,
+        "item_details": load_booking_item_details,
+        "extra_details": load_booking_extra_details,
+    }
+
     class Meta:
         model = Booking
         fields = "__all__"
+        list_serializer_class = BatchListSerializer
 
     def get_extras(self, obj):
-        try:
-            extras = BookingExtraDetails.objects.filter(booking=obj)
-            return BookingExtraDetailsSerializer(extras, many=True).data
-        except Exception as e:
-            return None
+        return BookingExtraDetailsSerializer(self.batch("extra_details", obj, []), many=True).data
 
     def get_packages(self, obj):
-        try:
-            packages = BookingItemDetails.objects.filter(booking=obj)
-            return BookingPackageDetailsSerializer(packages, many=True).data
-        except Exception as e:
-            return None
-
-    def get_service_provider(self, obj):
-        try:
-            dispatcher = DispatchedAppointment.objects.get(booking=obj)
-            return dispatcher.service_provider.id
-        except:
-            return None
-
-    def get_dispatch(self, obj):
-        try:
-            dispatcher = DispatchedAppointment.objects.get(booking=obj)
-            return dispatcher.id
-        except:
-            return None
-
-    def get_schedule(self, obj):
-        try:
-            schedule = Schedule.objects.get(booking=obj)
-            return ScheduleSerializer(schedule).data
-        except:
-            return None
-
-    def get_outstanding_amount(self, obj):
-        try:
-            sale = Sale.objects.filter(booking=obj).first()
-            if sale:
-                payment_sale = PaymentSale.objects.filter(sale=sale)
-                captured_amount = payment_sale.filter(is_captured=True).aggregate(
-                    Sum("amount")
-                )["amount__sum"]
-                is_first = False
-                if captured_amount:
-                    is_first = captured_amount == payment_sale.first().is_first
-                if not captured_amount:
-                    captured_amount = 0
-                data_dict = {
-                    "total_amount": sale.amount,
-                    "status": sale.status,
-                    "paid_amount": captured_amount,
-                    "is_first": is_first,
-                }
-                return data_dict
-        except Exception as e:
-            return None
-
-    def get_collection(self, obj):
-        try:
-            collection = CustomerSupportCollection.objects.get(booking=obj)
-            return collection.id
-        except Exception as e:
-            return None
-
-    def get_dispatch(self, obj):
-        try:
-            dispatch = DispatchedAppointment.objects.get(booking=obj)
-            return DispatchBookingSerializer(dispatch).data
-        except Exception as e:
-            return None
+        return BookingPackageDetailsSerializer(self.batch("item_details", obj, []), many=True).data
 
 
 class BookingSerializerListNew(serializers.ModelSerializer):
@@ -957,7 +962,10 @@ class ServiceProviderSerializer(serializers.ModelSerializer):
 
     def get_user_profile(self, obj):
         try:
-            profile = UserProfile.objects.filter(user=obj).first()
+            if "user_profiles" in self.context:  # batched by load_booking_dispatches
+                profile = self.context["user_profiles"].get(obj.id)
+            else:
+                profile = UserProfile.objects.filter(user=obj).first()
             return UserProfileSerializer(profile).data
         except:
             return None
@@ -984,7 +992,7 @@ class DispatchBookingSerializer(serializers.ModelSerializer):
 
     def get_service_provider(self, obj):
         try:
-            return ServiceProviderSerializer(obj.service_provider).data
+            return ServiceProviderSerializer(obj.service_provider, context=self.context).data
         except:
             return None
 
@@ -0,0 +1,247 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from booking.availability import bump_availability_version
+from booking.calendar_events import invalidate_calendar_days
+from booking.catalog import bump_catalog_version
+from booking.email_templates import invalidate_email_type
+from booking.listing import schedule_listing_refresh
+from booking.metrics import metric_day, record_metric
+from booking.models import (
+    Banners,
+    BODContactInfo,
+    Booking,
+    BookingItemDetails,
+    BookingListing,
+    BookingOrderDetails,
+    DispatchedAppointment,
+    EmailTypes,
+    Extra,
+    Item,
+    Package,
+    PageViewsCount,
+    PaymentSale,
+    Sale,
+    Schedule,
+    Service,
+    SpOperatingHour,
+    Tax,
+)
+from service_provider.models import LeaveTime
+from user_module.models import UserProfile
+
+for catalog_model in (Service, Package, Item, Extra, Tax, Banners):
+    post_save.connect(bump_catalog_version, sender=catalog_model)
+    post_delete.connect(bump_catalog_version, sender=catalog_model)
+
+post_save.connect(invalidate_email_type, sender=EmailTypes)
+post_delete.connect(invalidate_email_type, sender=EmailTypes)
+
+# fields the cleaner availability index is built from, see booking.availability
+AVAILABILITY_FIELDS = {
+    DispatchedAppointment: ("booking", "service_provider", "status"),
+    Schedule: ("start_time", "end_time"),
+    Booking: ("id", "status"),
+    LeaveTime: ("service_provider", "start", "end"),
+    SpOperatingHour: ("service_provider", "day", "is_available", "start_hour", "end_hour"),
+    UserProfile: ("user", "role", "status"),
+}
+
+
+def _availability_values(sender, instance):
+    """{field: value} of the instance's availability fields, without the deferred ones."""
+    values = {}
+    for name in AVAILABILITY_FIELDS[sender]:
+        attname = sender._meta.get_field(name).attname
+        if attname in instance.__dict__:
+            values[name] = instance.__dict__[attname]
+    return values
+
+
+def remember_availability_values(sender, instance, **kwargs):
+    """post_init/post_save: keeps the availability fields as the row holds them, so a save can tell what changed."""
+    instance._availability_previous = _availability_values(sender, instance)
+
+
+def _bump_availability(sender, rows):
+    """Bumps the days the given {field: value} rows of sender occupy in the index."""
+    if sender in (SpOperatingHour, UserProfile):
+        bump_availability_version()  # the working hours or the cleaners of every day
+    elif sender is Schedule:
+        bump_availability_version([(values.get("start_time"), values.get("end_time")) for values in rows])
+    elif sender is LeaveTime:
+        bump_availability_version([(values.get("start"), values.get("end")) for values in rows])
+    else:
+        field = "booking" if sender is DispatchedAppointment else "id"
+        bump_availability_version(
+            Schedule.objects.filter(booking__in={values.get(field) for values in rows}).values_list(
+                "start_time", "end_time"
+            )
+        )
+
+
+def availability_on_save(sender, instance, created, update_fields=None, **kwargs):
+    previous = getattr(instance, "_availability_previous", {})
+    current = _availability_values(sender, instance)
+    instance._availability_previous = current
+    if update_fields is not None and not set(update_fields) & set(AVAILABILITY_FIELDS[sender]):
+        return
+    if not created and previous == current:
+        return
+    if sender is Booking and (created or (previous.get("status") == "cancelled") == (current["status"] == "cancelled")):
+        return  # only cancelled bookings leave the index, a new one has no dispatch yet
+    if sender is UserProfile and "Cleaner" not in (previous.get("role"), current.get("role")):
+        return
+    _bump_availability(sender, [previous, current])
+
+
+def availability_on_delete(sender, instance, **kwargs):
+    values = _availability_values(sender, instance)
+    if sender is Booking:
+        return  # its schedule and dispatches are deleted with it
+    if sender is UserProfile and values.get("role") != "Cleaner":
+        return
+    _bump_availability(sender, [values])
+
+
+for availability_model in AVAILABILITY_FIELDS:
+    post_init.connect(remember_availability_values, sender=availability_model)
+    post_save.connect(availability_on_save, sender=availability_model)
+    post_delete.connect(availability_on_delete, sender=availability_model)
+
+
+@receiver(post_delete, sender=BookingItemDetails)
+def decrement_service_total_booking(sender, instance, **kwargs):
+    item_id = instance.item_id
+    transaction.on_commit(
+        lambda: Service.objects.filter(
+            package__item__id=item_id, total_booking__gt=0
+        ).update(total_booking=F("total_booking") - 1)
+    )
+
+
+def refresh_booking_listing(sender, instance, **kwargs):
+    schedule_listing_refresh([instance.booking_id])
+
+
+for booking_model in (Sale, DispatchedAppointment, Schedule):
+    post_save.connect(refresh_booking_listing, sender=booking_model)
+    post_delete.connect(refresh_booking_listing, sender=booking_model)
+
+
+@receiver(post_save, sender=Booking)
+def refresh_booking_listing_on_booking(sender, instance, **kwargs):
+    schedule_listing_refresh([instance.id])
+
+
+@receiver(post_save, sender=BODContactInfo)
+def refresh_booking_listing_on_contact_info(sender, instance, **kwargs):
+    schedule_listing_refresh(
+        Booking.objects.filter(bod__bod_contact_info=instance).values_list("id", flat=True)
+    )
+
+
+@receiver(post_save, sender=Service)
+def update_booking_listing_service(sender, instance, **kwargs):
+    BookingListing.objects.filter(service=instance).update(service_title=instance.title)
+
+
+@receiver(post_save, sender=UserProfile)
+def update_booking_listing_cleaner(sender, instance, **kwargs):
+    if instance.user_id:
+        BookingListing.objects.filter(cleaner=instance.user_id).update(
+            cleaner_name=" ".join(name for name in (instance.first_name, instance.last_name) if name)
+        )
+
+
+@receiver(post_delete, sender=BookingListing)
+def invalidate_booking_calendar(sender, instance, **kwargs):
+    invalidate_calendar_days([instance.appointment_date_time])
+
+
+COUNT_METRIC_MODELS = {Service: "services", PageViewsCount: "page_views", Booking: "bookings"}
+SUM_METRIC_MODELS = {PaymentSale: ("gross", "amount"), BookingOrderDetails: ("hours", "total_hours")}
+PROFILE_METRICS = {"Customer": "customers", "Cleaner": "cleaners"}
+METRIC_FIELDS = {**{model: field for model, (metric, field) in SUM_METRIC_MODELS.items()}, UserProfile: "role"}
+
+
+def count_metric_on_save(sender, instance, created, **kwargs):
+    if created:
+        record_metric(COUNT_METRIC_MODELS[sender], metric_day(instance.created_at), 1)
+
+
+def count_metric_on_delete(sender, instance, **kwargs):
+    record_metric(COUNT_METRIC_MODELS[sender], metric_day(instance.created_at), -1)
+
+
+for metric_model in COUNT_METRIC_MODELS:
+    post_save.connect(count_metric_on_save, sender=metric_model)
+    post_delete.connect(count_metric_on_delete, sender=metric_model)
+
+
+def remember_metric_value(sender, instance, **kwargs):
+    """
+    post_init/post_save: keeps the value the row holds in the database on the instance, so the next save can record
+    the difference without reading the row again. Missing when the field was deferred.
+    """
+    field = METRIC_FIELDS[sender]
+    if field in instance.__dict__:
+        instance._metric_previous = instance.__dict__[field]
+    else:
+        instance.__dict__.pop("_metric_previous", None)
+
+
+def changed_metric_value(sender, instance, created, update_fields):
+    """(previous, current) of the instance's metric field for a save, None when the field was not saved."""
+    field = METRIC_FIELDS[sender]
+    if created:
+        return None, getattr(instance, field)
+    if update_fields is not None and field not in update_fields:
+        return None
+    if not hasattr(instance, "_metric_previous"):
+        return None  # loaded without the field, left to the nightly reconcile
+    return instance._metric_previous, getattr(instance, field)
+
+
+def sum_metric_on_save(sender, instance, created, update_fields=None, **kwargs):
+    values = changed_metric_value(sender, instance, created, update_fields)
+    if values:
+        metric = SUM_METRIC_MODELS[sender][0]
+        record_metric(metric, metric_day(instance.created_at), (values[1] or 0) - (values[0] or 0))
+    remember_metric_value(sender, instance)
+
+
+def sum_metric_on_delete(sender, instance, **kwargs):
+    metric, field = SUM_METRIC_MODELS[sender]
+    record_metric(metric, metric_day(instance.created_at), -(getattr(instance, field) or 0))
+
+
+for metric_model in SUM_METRIC_MODELS:
+    post_init.connect(remember_metric_value, sender=metric_model)
+    post_save.connect(sum_metric_on_save, sender=metric_model)
+    post_delete.connect(sum_metric_on_delete, sender=metric_model)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_metric_on_save(sender, instance, created, update_fields=None, **kwargs):
+    values = changed_metric_value(sender, instance, created, update_fields)
+    remember_metric_value(sender, instance)
+    if not values or values[0] == values[1]:
+        return
+    previous, role = values
+    day = metric_day(instance.created_at)
+    if previous in PROFILE_METRICS:
+        record_metric(PROFILE_METRICS[previous], day, -1)
+    if role in PROFILE_METRICS:
+        record_metric(PROFILE_METRICS[role], day, 1)
+
+
+post_init.connect(remember_metric_value, sender=UserProfile)
+
+
+@receiver(post_delete, sender=UserProfile)
+def profile_metric_on_delete(sender, instance, **kwargs):
+    if instance.role in PROFILE_METRICS:
+        record_metric(PROFILE_METRICS[instance.role], metric_day(instance.created_at), -1)
@@ -1,3 +1,1094 @@
-from django.test import TestCase
+import csv
+import datetime
+import math
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from booking import calendar_events, catalog, email_templates, mailer, push, reminders
+from booking.availability import CleanerAvailabilityIndex, CleanerIntervals, get_availability_index
+from booking.dispatch_optimizer import commit_dispatch, plan_dispatch
+from booking.exports import csv_response, customer_lines, payroll_lines
+from booking.geo import grid_cell, grid_cells_within, haversine_km, parse_coordinate, to_coordinate
+from booking.models import (
+    BODContactInfo,
+    BODExtraDetails,
+    BODItemDetails,
+    BODServiceLocation,
+    Booking,
+    BookingExtraDetails,
+    BookingItemDetails,
+    BookingItemDetailsAbstract,
+    BookingListing,
+    BookingOrderDetails,
+    ChargeTip,
+    Company,
+    DailyMetrics,
+    DispatchedAppointment,
+    EmailLogs,
+    EmailTypes,
+    Extra,
+    Frequency,
+    Item,
+    OutboundEmail,
+    Package,
+    PaymentSale,
+    Payroll,
+    Sale,
+    Schedule,
+    Service,
+    SpOperatingHour,
+    Tax,
+)
+from booking.listing import listed_bookings, refresh_booking_listings
+from booking.metrics import get_metric_totals, rebuild_daily_metrics
+from booking.payroll import accrue_booking, accrue_tip, payroll_day, rebuild_payroll
+from booking.proximity import bookings_within_radius, nearest_available_cleaners
+from booking.reschedule import find_cleaner_conflicts, plan_reschedule, reschedule_booking
+from booking.utils import (
+    CustomPagination,
+    bulk_create_details,
+    extend_booking_horizons,
+    quote_booking,
+    schedule_booking,
+)
+from booking.views import QuoteViewSet
+from service_provider.models import LeaveTime, ServiceProviderLocation
+from user_module.models import User, UserProfile
+
+COMPANY_TIMEZONE = "America/New_York"
+
+
+def create_service():
+    company = Company.objects.create(
+        title="Cleany", street_address="1 Main St", city="New York", zip_code=10001, state="NY", phone="1",
+        email="company@example.com", company_timezone=COMPANY_TIMEZONE,
+    )
+    tax = Tax.objects.create(company=company, tax_code="NY", tax_code_short="NY", tax_rate=5)
+    service = Service.objects.create(
+        company=company, name="deep", slug="deep-clean", title="Deep clean", tax=tax, status="Published"
+    )
+    package = Package.objects.create(service=service, title="Rooms")
+    Item.objects.create(package=package, title="Bedroom", time_hrs=2, price=100)
+    return service
+
+
+def create_order(service, frequency_type="once", start_date="2030-01-07", start_time="10:00", total_hours=2):
+    """A booking order of a new customer with one item, not scheduled yet."""
+    user = User.objects.create(email="customer%s@example.com" % User.objects.count())
+    UserProfile.objects.create(user=user, role="Customer", first_name="Jane", last_name="Doe")
+    order = BookingOrderDetails.objects.create(
+        user=user,
+        bod_contact_info=BODContactInfo.objects.create(
+            first_name="Jane", last_name="Doe", email=user.email, phone="1"
+        ),
+        bod_service_location=BODServiceLocation.objects.create(
+            street_address="2 Main St", apt_suite="1", city="New York", state="NY", zip_code=10001
+        ),
+        frequency=Frequency.objects.create(service=service, type=frequency_type, title="t", start_date=start_date),
+        start_time=start_time,
+        total_hours=total_hours,
+        total_amount=105,
+    )
+    BODItemDetails.objects.create(item=Item.objects.get(package__service=service), bod=order, price=100)
+    return order
+
+
+def create_booking(service, start_date="2030-01-07", start_time="10:00", total_hours=2, point=("40.75", "-73.99")):
+    order = create_order(service, start_date=start_date, start_time=start_time, total_hours=total_hours)
+    schedule_booking(order.id, {"latitude": point[0], "longitude": point[1]})
+    return Booking.objects.select_related("booking_in_schedule").get(bod=order)
+
+
+def create_cleaner(name="Sam", **profile):
+    user = User.objects.create(email="%s%s@example.com" % (name.lower(), User.objects.count()))
+    UserProfile.objects.create(user=user, role="Cleaner", first_name=name, **profile)
+    return user
+
+
+class CleanerAvailabilityIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.booking = create_booking(cls.service, "2030-01-07", "10:00", total_hours=2)
+        cls.cleaner = create_cleaner()
+        DispatchedAppointment.objects.create(service_provider=cls.cleaner, booking=cls.booking)
+        cls.day = cls.booking.booking_in_schedule.start_time.date()
+
+    def load(self):
+        return CleanerAvailabilityIndex.load(self.day, self.day)
+
+    def slot(self, hour, hours=1):
+        start = datetime.datetime(2030, 1, 7, hour, tzinfo=datetime.timezone.utc)
+        return start, start + datetime.timedelta(hours=hours)
+
+    def test_free_slot(self):
+        self.assertEqual(self.load().conflicts(self.cleaner.id, *self.slot(13)), [])
+
+    def test_overlapping_dispatch(self):
+        conflicts = self.load().conflicts(self.cleaner.id, *self.slot(11))
+        self.assertEqual([(conflict["type"], conflict["id"]) for conflict in conflicts], [("booking", self.booking.id)])
+
+    def test_back_to_back_slots_do_not_conflict(self):
+        index = self.load()
+        self.assertEqual(index.conflicts(self.cleaner.id, *self.slot(12)), [])
+        self.assertEqual(index.conflicts(self.cleaner.id, *self.slot(9)), [])
+
+    def test_own_dispatch_is_excluded(self):
+        start, end = self.slot(10, hours=2)
+        self.assertEqual(self.load().conflicts(self.cleaner.id, start, end, exclude_booking=self.booking.id), [])
+
+    def test_cancelled_dispatch_is_free(self):
+        DispatchedAppointment.objects.filter(booking=self.booking).update(status="Cancelled")
+        self.assertEqual(self.load().conflicts(self.cleaner.id, *self.slot(11)), [])
+
+    def test_leave(self):
+        start, end = self.slot(14, hours=3)
+        leave = LeaveTime.objects.create(service_provider=self.cleaner, start=start, end=end)
+        conflicts = self.load().conflicts(self.cleaner.id, *self.slot(15))
+        self.assertEqual([(conflict["type"], conflict["id"]) for conflict in conflicts], [("leave", leave.id)])
+
+    def test_operating_hours(self):
+        # 08:00-17:00 in New York is 13:00-22:00 UTC
+        SpOperatingHour.objects.create(
+            service_provider=self.cleaner, day="Monday", start_hour="08:00", end_hour="17:00"
+        )
+        index = self.load()
+        self.assertEqual(index.conflicts(self.cleaner.id, *self.slot(14)), [])
+        self.assertEqual([conflict["type"] for conflict in index.conflicts(self.cleaner.id, *self.slot(21, 2))],
+                         ["off_hours"])
+
+    def test_inactive_cleaner(self):
+        UserProfile.objects.filter(user=self.cleaner).update(status="Inactive")
+        self.assertEqual([conflict["type"] for conflict in self.load().conflicts(self.cleaner.id, *self.slot(13))],
+                         ["inactive"])
+
+    def test_free_cleaners(self):
+        other = create_cleaner("Alex")
+        index = self.load()
+        self.assertEqual(index.free_cleaners(*self.slot(11)), [other.id])
+        self.assertEqual(index.free_cleaners(*self.slot(13)), sorted([self.cleaner.id, other.id]))
+
+    def test_unsorted_busy_intervals(self):
+        intervals = CleanerIntervals()
+        intervals.set_busy(
+            [self.slot(15) + ("booking", 3), self.slot(9, 4) + ("leave", 1), self.slot(10) + ("booking", 2)]
+        )
+        self.assertEqual(intervals.max_ends, [self.slot(9, 4)[1]] * 2 + [self.slot(15)[1]])
+        # the long leave still shows up behind the shorter booking starting after it
+        self.assertEqual([reference for start, end, kind, reference in intervals.overlapping(*self.slot(12))], [1])
+
+    def test_cached_index_is_dropped_for_the_changed_days_only(self):
+        cache.clear()
+        other_day = datetime.datetime(2030, 1, 20, 13, tzinfo=datetime.timezone.utc)
+        with mock.patch.object(CleanerAvailabilityIndex, "load", side_effect=CleanerAvailabilityIndex.load) as load:
+            get_availability_index(*self.slot(13))
+            get_availability_index(other_day, other_day + datetime.timedelta(hours=1))
+            with self.captureOnCommitCallbacks(execute=True):
+                LeaveTime.objects.create(service_provider=self.cleaner, start=self.slot(14)[0], end=self.slot(14)[1])
+            index = get_availability_index(*self.slot(13))
+            get_availability_index(other_day, other_day + datetime.timedelta(hours=1))
+        self.assertEqual(load.call_count, 3)
+        self.assertEqual(index.conflicts(self.cleaner.id, *self.slot(14))[0]["type"], "leave")
+
+    @mock.patch("booking.signals.bump_availability_version")
+    def test_only_writes_the_index_reads_bump(self, bump):
+        profile = UserProfile.objects.get(user=self.cleaner)
+        profile.first_name = "Samuel"
+        profile.save()
+        Booking.objects.get(id=self.booking.id).save()
+        bump.assert_not_called()
+        profile.status = "Inactive"
+        profile.save()
+        bump.assert_called_once_with()
+
+    @mock.patch("booking.signals.bump_availability_version")
+    def test_moved_schedule_bumps_both_slots(self, bump):
+        schedule = Schedule.objects.get(booking=self.booking)
+        before = (schedule.start_time, schedule.end_time)
+        schedule.start_time, schedule.end_time = self.slot(15, 2)
+        schedule.save()
+        bump.assert_called_once_with([before, self.slot(15, 2)])
+
+    @mock.patch("booking.signals.bump_availability_version")
+    def test_cancelling_a_booking_bumps_its_slot(self, bump):
+        booking = Booking.objects.get(id=self.booking.id)
+        booking.status = "dispatched"
+        booking.save()
+        bump.assert_not_called()
+        booking.status = "cancelled"
+        booking.save()
+        self.assertEqual(list(bump.call_args[0][0]), [self.slot(10, 2)])
+
+
+class PlanDispatchTests(TestCase):
+    day = datetime.date(2030, 1, 7)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        # Midtown and Brooklyn, about 10 km apart
+        cls.midtown = create_cleaner("Midtown", latitude="40.7500", longitude="-73.9900")
+        cls.brooklyn = create_cleaner("Brooklyn", latitude="40.6800", longitude="-73.9400")
+
+    def book(self, start_time, point, total_hours=2):
+        return create_booking(self.service, str(self.day), start_time, total_hours, point)
+
+    def planned(self, plan):
+        return {assignment["booking_id"]: assignment["cleaner_id"] for assignment in plan["assignments"]}
+
+    def test_nearest_cleaner_takes_each_booking(self):
+        midtown = self.book("10:00", ("40.7510", "-73.9910"))
+        brooklyn = self.book("10:00", ("40.6810", "-73.9410"))
+        plan = plan_dispatch(self.day)
+        self.assertEqual(self.planned(plan), {midtown.id: self.midtown.id, brooklyn.id: self.brooklyn.id})
+        self.assertEqual(plan["unassigned"], [])
+        self.assertLess(plan["total_distance_km"], 1)
+
+    def test_consecutive_bookings_are_chained(self):
+        first = self.book("10:00", ("40.7510", "-73.9910"))
+        second = self.book("13:00", ("40.7520", "-73.9920"))
+        plan = plan_dispatch(self.day)
+        self.assertEqual(self.planned(plan), {first.id: self.midtown.id, second.id: self.midtown.id})
+
+    def test_busy_cleaners_leave_bookings_unassigned(self):
+        LeaveTime.objects.create(
+            service_provider=self.brooklyn,
+            start=datetime.datetime(2030, 1, 7, tzinfo=datetime.timezone.utc),
+            end=datetime.datetime(2030, 1, 8, tzinfo=datetime.timezone.utc),
+        )
+        first = self.book("10:00", ("40.7510", "-73.9910"))
+        second = self.book("11:00", ("40.6810", "-73.9410"))
+        plan = plan_dispatch(self.day)
+        self.assertEqual(self.planned(plan), {first.id: self.midtown.id})
+        self.assertEqual(plan["unassigned"], [second.id])
+
+    def test_dispatched_bookings_are_left_out(self):
+        booking = self.book("10:00", ("40.7510", "-73.9910"))
+        DispatchedAppointment.objects.create(service_provider=self.brooklyn, booking=booking)
+        self.assertEqual(plan_dispatch(self.day)["assignments"], [])
+
+    def test_commit_dispatch(self):
+        first = self.book("10:00", ("40.7510", "-73.9910"))
+        second = self.book("10:00", ("40.6810", "-73.9410"))
+        self.assertEqual(commit_dispatch(self.day)["dispatched"], 2)
+        self.assertEqual(
+            set(DispatchedAppointment.objects.values_list("booking", "service_provider")),
+            {(first.id, self.midtown.id), (second.id, self.brooklyn.id)},
+        )
+        self.assertEqual(set(Booking.objects.values_list("status", flat=True)), {"dispatched"})
+
+    def test_commit_dispatch_rejects_a_busy_cleaner(self):
+        first = self.book("10:00", ("40.7510", "-73.9910"))
+        second = self.book("11:00", ("40.7520", "-73.9920"))
+        with self.assertRaises(ValueError):
+            commit_dispatch(self.day, [(first.id, self.midtown.id), (second.id, self.midtown.id)])
+        self.assertFalse(DispatchedAppointment.objects.exists())
+
+
+@override_settings(BOOKING_HORIZON_DAYS=28)
+class MaterializeBookingsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.today = timezone.now().date()
+
+    def schedule(self, frequency_type, start_date):
+        order = create_order(self.service, frequency_type, str(start_date))
+        schedule_booking(order.id, {"latitude": "40.75", "longitude": "-73.99"})
+        return order
+
+    def appointments(self, order):
+        return [
+            timezone.make_naive(value)
+            for value in Booking.objects.filter(bod=order).order_by("appointment_date_time")
+            .values_list("appointment_date_time", flat=True)
+        ]
+
+    def test_weekly_order_is_materialized_up_to_the_horizon(self):
+        start = self.today + datetime.timedelta(days=1)
+        order = self.schedule("weekly", start)
+        first = datetime.datetime.combine(start, datetime.time(10))
+        self.assertEqual(self.appointments(order), [first + datetime.timedelta(weeks=week) for week in range(4)])
+
+    def test_every_booking_gets_its_rows(self):
+        order = self.schedule("weekly", self.today + datetime.timedelta(days=1))
+        bookings = Booking.objects.filter(bod=order)
+        self.assertEqual(BookingItemDetails.objects.filter(booking__in=bookings).count(), 4)
+        self.assertEqual(Schedule.objects.filter(booking__in=bookings).count(), 4)
+        self.assertEqual(Sale.objects.filter(booking__in=bookings).count(), 4)
+        # only the first booking carries the first payment
+        payment = PaymentSale.objects.get(sale__booking__bod=order)
+        self.assertEqual(payment.sale.booking, bookings.order_by("appointment_date_time").first())
+        self.assertTrue(payment.is_first)
+
+    def test_once_order(self):
+        order = self.schedule("once", self.today + datetime.timedelta(days=60))
+        self.assertEqual(len(self.appointments(order)), 1)
+
+    def test_series_starting_after_the_horizon_gets_its_first_booking(self):
+        start = self.today + datetime.timedelta(days=60)
+        order = self.schedule("weekly", start)
+        self.assertEqual(self.appointments(order), [datetime.datetime.combine(start, datetime.time(10))])
+
+    def test_extend_booking_horizons(self):
+        order = self.schedule("weekly", self.today + datetime.timedelta(days=1))
+        self.assertEqual(extend_booking_horizons(), 0)
+        with override_settings(BOOKING_HORIZON_DAYS=56):
+            self.assertEqual(extend_booking_horizons(), 4)
+            self.assertEqual(extend_booking_horizons(), 0)
+        appointments = self.appointments(order)
+        self.assertEqual(len(appointments), 8)
+        self.assertEqual({later - earlier for earlier, later in zip(appointments, appointments[1:])},
+                         {datetime.timedelta(weeks=1)})
+        self.assertEqual(PaymentSale.objects.filter(sale__booking__bod=order).count(), 1)
+
+    def test_extend_stops_at_the_recurrence_end(self):
+        order = self.schedule("daily", self.today + datetime.timedelta(days=1))
+        Frequency.objects.filter(id=order.frequency_id).update(
+            recur_end_date=timezone.make_aware(
+                datetime.datetime.combine(self.today + datetime.timedelta(days=40), datetime.time())
+            )
+        )
+        with override_settings(BOOKING_HORIZON_DAYS=56):
+            extend_booking_horizons()
+        self.assertEqual(self.appointments(order)[-1].date(), self.today + datetime.timedelta(days=40))
+
+
+class RescheduleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.cleaner = create_cleaner()
+        order = create_order(cls.service, "weekly", "2030-01-07")
+        with override_settings(BOOKING_HORIZON_DAYS=0):
+            schedule_booking(order.id, {"latitude": "40.75", "longitude": "-73.99"})
+        cls.series = order
+        # another booking of the cleaner, on Tuesday 2030-01-08 10:00-12:00
+        cls.other = create_booking(cls.service, "2030-01-08", "10:00")
+        DispatchedAppointment.objects.create(service_provider=cls.cleaner, booking=cls.other)
+
+    def setUp(self):
+        self.booking = Booking.objects.select_related("bod__frequency", "booking_in_schedule").get(bod=self.series)
+
+    def at(self, day, hour):
+        return datetime.datetime(2030, 1, day, hour, tzinfo=datetime.timezone.utc)
+
+    def dispatch(self):
+        DispatchedAppointment.objects.create(service_provider=self.cleaner, booking=self.booking)
+
+    def test_plan_single_booking(self):
+        plan = plan_reschedule(self.booking, datetime.datetime(2030, 1, 9, 14))
+        self.assertEqual(plan, [(self.booking, self.at(9, 14), self.at(9, 16))])
+
+    def test_plan_whole_series_follows_the_rule(self):
+        second = create_booking(self.service, "2030-01-14", "10:00")
+        Booking.objects.filter(id=second.id).update(bod=self.series)
+        plan = plan_reschedule(self.booking, self.at(9, 14), whole_series=True)
+        self.assertEqual(
+            [(booking.id, start, end) for booking, start, end in plan],
+            [(self.booking.id, self.at(9, 14), self.at(9, 16)), (second.id, self.at(16, 14), self.at(16, 16))],
+        )
+
+    def test_undispatched_booking_has_no_conflicts(self):
+        self.assertEqual(find_cleaner_conflicts(plan_reschedule(self.booking, self.at(8, 11))), [])
+
+    def test_overlap_with_another_booking_of_the_cleaner(self):
+        self.dispatch()
+        conflicts = find_cleaner_conflicts(plan_reschedule(self.booking, self.at(8, 11)))
+        self.assertEqual(
+            [(conflict["booking_id"], conflict["cleaner_id"], conflict["conflicting_booking_id"])
+             for conflict in conflicts],
+            [(self.booking.id, self.cleaner.id, self.other.id)],
+        )
+
+    def test_adjacent_and_cancelled_bookings_do_not_conflict(self):
+        self.dispatch()
+        self.assertEqual(find_cleaner_conflicts(plan_reschedule(self.booking, self.at(8, 12))), [])
+        Booking.objects.filter(id=self.other.id).update(status="cancelled")
+        self.assertEqual(find_cleaner_conflicts(plan_reschedule(self.booking, self.at(8, 11))), [])
+
+    def test_conflicts_block_unless_forced(self):
+        self.dispatch()
+        original = self.booking.appointment_date_time
+        result = reschedule_booking(self.booking, self.at(8, 11))
+        self.assertFalse(result["applied"])
+        self.assertEqual(len(result["conflicts"]), 1)
+        self.assertEqual(Booking.objects.get(id=self.booking.id).appointment_date_time, original)
+        self.assertTrue(reschedule_booking(self.booking, self.at(8, 11), force=True)["applied"])
+        self.assertEqual(Schedule.objects.get(booking=self.booking).start_time, self.at(8, 11))
+
+    def test_dry_run_writes_nothing(self):
+        original = self.booking.appointment_date_time
+        result = reschedule_booking(self.booking, self.at(9, 14), dry_run=True)
+        self.assertFalse(result["applied"])
+        self.assertEqual(Booking.objects.get(id=self.booking.id).appointment_date_time, original)
+
+    def test_whole_series_reanchors_the_rule(self):
+        reschedule_booking(self.booking, self.at(9, 14), whole_series=True)
+        order = BookingOrderDetails.objects.select_related("frequency").get(id=self.series.id)
+        self.assertEqual((order.frequency.start_date, str(order.start_time)[:5]), (datetime.date(2030, 1, 9), "14:00"))
+
+
+@override_settings(PAYROLL_PERIOD="week")
+class PayrollTests(TestCase):
+    week = (datetime.date(2030, 1, 7), datetime.date(2030, 1, 13))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.booking = create_booking(cls.service, "2030-01-09", "10:00", total_hours=2)
+        Schedule.objects.filter(booking=cls.booking).update(tip_amount=10)
+        cls.checked_in = create_cleaner("Sam", hourly_rate=20)
+        cls.unchecked = create_cleaner("Alex", hourly_rate=30)
+        for cleaner in (cls.checked_in, cls.unchecked):
+            DispatchedAppointment.objects.create(service_provider=cleaner, booking=cls.booking)
+        ServiceProviderLocation.objects.create(
+            service_provider=cls.checked_in, booking=cls.booking, latitude="40.75", longitude="-73.99", total_hours=3
+        )
+        Booking.objects.filter(id=cls.booking.id).update(status="complete")
+
+    def payrolls(self):
+        return {
+            payroll.sp_id: (payroll.total_hours, payroll.total_amount, payroll.tip_amount, payroll.due_amount)
+            for payroll in Payroll.objects.filter(period_start=self.week[0])
+        }
+
+    def test_rebuild(self):
+        self.assertEqual(rebuild_payroll(self.week[0]), 2)
+        # checked-in hours win over the booking's hours, the schedule tip is split evenly
+        self.assertEqual(
+            self.payrolls(),
+            {self.checked_in.id: (3, 65, 5, 65), self.unchecked.id: (2, 65, 5, 65)},
+        )
+        self.assertEqual(set(Payroll.objects.values_list("period_start", "period_end")), {self.week})
+
+    def test_rebuild_matches_the_accruals(self):
+        accrue_booking(Booking.objects.get(id=self.booking.id))
+        accrued = self.payrolls()
+        rebuild_payroll(self.week[0])
+        self.assertEqual(self.payrolls(), accrued)
+
+    def test_rebuild_keeps_paid_amounts(self):
+        rebuild_payroll(self.week[0])
+        Payroll.objects.filter(sp=self.checked_in).update(paid_amount=50, due_amount=15)
+        rebuild_payroll(self.week[0])
+        self.assertEqual(self.payrolls()[self.checked_in.id], (3, 65, 5, 15))
+
+    def test_rebuild_zeroes_periods_without_completed_bookings(self):
+        rebuild_payroll(self.week[0])
+        Booking.objects.filter(id=self.booking.id).update(status="scheduled")
+        rebuild_payroll(self.week[0])
+        self.assertEqual(set(self.payrolls().values()), {(0, 0, 0, 0)})
+
+    def test_rebuild_counts_charged_tips(self):
+        tip = ChargeTip.objects.create(booking=self.booking, tip_amount=8)
+        accrue_tip(tip)
+        accrued = sorted(Payroll.objects.values_list("sp", "tip_amount", "total_amount"))
+        self.assertEqual(accrued, sorted([(self.checked_in.id, 4, 4), (self.unchecked.id, 4, 4)]))
+        Payroll.objects.all().delete()
+        rebuild_payroll(payroll_day())
+        self.assertEqual(sorted(Payroll.objects.values_list("sp", "tip_amount", "total_amount")), accrued)
+
+
+class BookingListingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.booking = create_booking(cls.service, "2030-01-07", "10:00")
+        cls.cleaner = create_cleaner("Sam", last_name="Lee")
+
+    def listing(self):
+        return BookingListing.objects.get(booking=self.booking)
+
+    def test_rebuild(self):
+        BookingListing.objects.all().delete()
+        refresh_booking_listings([self.booking.id])
+        listing = self.listing()
+        self.assertEqual(
+            (listing.status, listing.customer_name, listing.service_title, listing.cleaner_id, listing.sale_status),
+            ("scheduled", "Jane Doe", "Deep clean", None, "pending"),
+        )
+        self.assertEqual(listing.appointment_date_time, self.booking.appointment_date_time)
+        self.assertEqual(listing.schedule_end, self.booking.booking_in_schedule.end_time)
+
+    def test_dispatch_names_the_cleaner_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch = DispatchedAppointment.objects.create(service_provider=self.cleaner, booking=self.booking)
+        self.assertEqual((self.listing().cleaner_id, self.listing().cleaner_name), (self.cleaner.id, "Sam Lee"))
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.status = "Cancelled"
+            dispatch.save()
+        self.assertEqual((self.listing().cleaner_id, self.listing().cleaner_name), (None, ""))
+
+    def test_listed_bookings_keep_the_listing_order(self):
+        other = create_booking(self.service, "2030-01-08", "10:00")
+        refresh_booking_listings([self.booking.id, other.id])
+        listings = BookingListing.objects.order_by("-appointment_date_time")
+        self.assertEqual([booking.id for booking in listed_bookings(listings)], [other.id, self.booking.id])
+
+
+class DailyMetricsTests(TestCase):
+    def totals(self):
+        return get_metric_totals(dict.fromkeys(["services", "customers", "cleaners", "bookings", "gross", "hours"]))
+
+    def test_writes_are_rolled_up_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_booking(create_service(), "2030-01-07", "10:00", total_hours=2)
+        self.assertEqual(
+            self.totals(),
+            {"services": 1, "customers": 1, "cleaners": 0, "bookings": 1, "gross": 105, "hours": 2},
+        )
+
+    def test_rebuild_matches_the_incremental_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_booking(create_service(), "2030-01-07", "10:00", total_hours=2)
+            profile = UserProfile.objects.get(role="Customer")
+            profile.role = "Cleaner"
+            profile.save()
+        incremental = self.totals()
+        self.assertEqual((incremental["customers"], incremental["cleaners"]), (0, 1))
+        DailyMetrics.objects.all().delete()
+        rebuild_daily_metrics()
+        self.assertEqual(self.totals(), incremental)
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        service = create_service()
+        # ties on the appointment time, broken by pk
+        for start_date, start_time in [("2030-01-07", "10:00")] * 3 + [("2030-01-08", "09:00")] * 2:
+            create_booking(service, start_date, start_time)
+        cls.ordered = list(Booking.objects.order_by("appointment_date_time", "pk").values_list("id", flat=True))
+
+    def page(self, cursor="", ordering=("appointment_date_time", "pk"), **params):
+        paginator = CustomPagination(cursor_ordering=ordering)
+        paginator.page_size = 2
+        request = RequestFactory().get("/", {"cursor": cursor, **params})
+        rows = paginator.paginate_queryset(Booking.objects.all(), request)
+        return [row.id for row in rows], paginator
+
+    def test_forward_and_back_over_ties(self):
+        pages, cursors, cursor = [], [], ""
+        while cursor is not None:
+            ids, paginator = self.page(cursor)
+            pages.append(ids)
+            cursors.append(paginator.prev_cursor)
+            cursor = paginator.next_cursor
+        self.assertEqual(pages, [self.ordered[0:2], self.ordered[2:4], self.ordered[4:]])
+        self.assertIsNone(cursors[0])
+        back = [self.page(cursor)[0] for cursor in cursors[:0:-1]]
+        self.assertEqual(back, [self.ordered[2:4], self.ordered[0:2]])
+
+    def test_first_page_of_a_backward_walk_has_no_previous(self):
+        ids, paginator = self.page()
+        ids, paginator = self.page(paginator.next_cursor)
+        ids, paginator = self.page(paginator.prev_cursor)
+        self.assertEqual(ids, self.ordered[0:2])
+        self.assertIsNone(paginator.prev_cursor)
+        self.assertIsNotNone(paginator.next_cursor)
+
+    def test_descending(self):
+        ids, paginator = self.page(ordering=("-appointment_date_time", "-pk"))
+        ids += self.page(paginator.next_cursor, ordering=("-appointment_date_time", "-pk"))[0]
+        self.assertEqual(ids, self.ordered[::-1][:4])
+
+    def test_invalid_cursor(self):
+        with self.assertRaisesMessage(ValueError, "Invalid cursor"):
+            self.page("not-a-cursor")
+
+    def test_mixed_directions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            CustomPagination(cursor_ordering=("-created_at", "pk"))
+
+    def test_estimate(self):
+        ids, paginator = self.page(estimate="true")
+        self.assertIsInstance(paginator.estimated_count, int)
+
+
+class BulkCreateDetailsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.order = create_order(cls.service)
+        cls.item = Item.objects.get(package__service=cls.service)
+        cls.extra = Extra.objects.create(service=cls.service, title="Oven", time_hrs=1, price=20)
+
+    def test_parent_and_child_rows(self):
+        details = bulk_create_details(
+            BODItemDetails, [BODItemDetails(item=self.item, bod=self.order, price=price) for price in (10, 20)]
+        )
+        self.assertTrue(all(detail.pk for detail in details))
+        self.assertEqual([detail.pk for detail in details],
+                         [detail.bookingitemdetailsabstract_ptr_id for detail in details])
+        self.assertEqual(
+            set(BODItemDetails.objects.filter(price__in=(10, 20)).values_list("pk", "bod", "item", "price")),
+            {(detail.pk, self.order.id, self.item.id, detail.price) for detail in details},
+        )
+        self.assertEqual(BookingItemDetailsAbstract.objects.filter(pk__in=[detail.pk for detail in details]).count(), 2)
+        self.assertIsNotNone(details[0].created_at)
+
+    def test_extras_of_bookings(self):
+        booking = create_booking(self.service)
+        details = bulk_create_details(
+            BookingExtraDetails, [BookingExtraDetails(extra=self.extra, booking=booking, price=20, quantity=2)]
+        )
+        self.assertEqual(
+            list(BookingExtraDetails.objects.filter(booking=booking).values_list("pk", "extra", "quantity")),
+            [(details[0].pk, self.extra.id, 2)],
+        )
+        booking.delete()
+        self.assertFalse(BookingExtraDetails.objects.filter(pk=details[0].pk).exists())
+
+    def test_order_details_are_copied_to_every_booking(self):
+        booking = create_booking(self.service)
+        self.assertEqual(
+            list(BookingItemDetails.objects.filter(booking=booking).values_list("item", "price")),
+            [(self.item.id, 100)],
+        )
+
+    def test_nothing_to_create(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(bulk_create_details(BODExtraDetails, []), [])
+
+
+class QuoteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.item = Item.objects.get(package__service=cls.service)
+        cls.discounted = Item.objects.create(
+            package=cls.item.package, title="Kitchen", time_hrs=1, price=50, discount_percent=10
+        )
+        cls.extra = Extra.objects.create(service=cls.service, title="Oven", time_hrs=0.5, price=20)
+
+    def setUp(self):
+        # the snapshot outlives the test transactions, and versions repeat between test classes
+        catalog._snapshot = None
+
+    def test_totals(self):
+        quote = quote_booking(
+            self.service.id,
+            items=[{"item_id": self.item.id}, {"item_id": self.discounted.id}],
+            extras=[{"extra_id": self.extra.id, "quantity": 2}],
+        )
+        self.assertEqual([line["price"] for line in quote["items"]], [100, 45])
+        self.assertEqual(quote["extras"][0]["price"], 40)
+        self.assertEqual(
+            {key: quote[key] for key in ("sub_total", "discount", "tax_amount", "total_hours", "total_amount")},
+            {"sub_total": 185, "discount": 5, "tax_amount": 9.25, "total_hours": 4, "total_amount": 194.25},
+        )
+
+    def test_warm_quote_reads_only_the_catalog_version(self):
+        quote_booking(self.service.id, items=[{"item_id": self.item.id}], extras=[])
+        with self.assertNumQueries(1):
+            quote_booking(self.service.id, items=[{"item_id": self.item.id}], extras=[])
+
+    def test_unknown_selection(self):
+        with self.assertRaisesMessage(ValueError, "Service not exist"):
+            quote_booking(0, items=[], extras=[])
+        with self.assertRaisesMessage(ValueError, "Item 0 not exist"):
+            quote_booking(self.service.id, items=[{"item_id": 0}], extras=[])
+
+    def test_endpoint_saves_nothing(self):
+        orders = BookingOrderDetails.objects.count()
+        request = APIRequestFactory().post(
+            "/quote", {"service_id": self.service.id, "items": [{"item_id": self.item.id}]}, format="json"
+        )
+        response = QuoteViewSet.as_view({"post": "create"})(request)
+        self.assertEqual(response.data["data"]["total_amount"], 105)
+        self.assertEqual(BookingOrderDetails.objects.count(), orders)
+
+
+class CatalogSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.item = Item.objects.get(package__service=cls.service)
+
+    def setUp(self):
+        catalog._snapshot = None
+
+    def test_unchanged_catalog_is_reused(self):
+        snapshot = catalog.get_catalog()
+        with self.assertNumQueries(1):
+            self.assertIs(catalog.get_catalog(), snapshot)
+        self.assertEqual(snapshot.items_by_package[self.item.package_id], [self.item])
+        self.assertEqual(snapshot.get_tax(self.service.id).tax_rate, 5)
+
+    def test_save_and_delete_bump_the_version(self):
+        snapshot = catalog.get_catalog()
+        self.item.price = 120
+        self.item.save()
+        self.assertEqual(catalog.get_catalog_version(), snapshot.version + 1)
+        self.assertEqual(float(catalog.get_catalog().items[self.item.id].price), 120)
+        self.item.delete()
+        self.assertNotIn(self.item.id, catalog.get_catalog().items)
+
+    def test_memoized_data_lives_as_long_as_the_snapshot(self):
+        build = mock.Mock(return_value="data")
+        snapshot = catalog.get_catalog()
+        self.assertEqual([snapshot.memoize("key", build), snapshot.memoize("key", build)], ["data", "data"])
+        self.assertEqual(build.call_count, 1)
+        self.service.save()
+        catalog.get_catalog().memoize("key", build)
+        self.assertEqual(build.call_count, 2)
+
+    def test_booking_counter_moves_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_booking(self.service)
+            self.assertEqual(Service.objects.get(id=self.service.id).total_booking, 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Service.objects.get(id=self.service.id).total_booking, 1)
+
+
+class CalendarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        # 03:00 UTC is still the evening before in the company timezone
+        cls.past = create_booking(cls.service, "2020-01-08", "03:00")
+        cls.future = create_booking(cls.service, "2030-01-07", "10:00")
+        refresh_booking_listings([cls.past.id, cls.future.id])
+
+    def setUp(self):
+        cache.clear()
+        self.query_events = mock.patch.object(
+            calendar_events, "_query_events", wraps=calendar_events._query_events
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def event_ids(self, calendar):
+        return {day["date"].isoformat(): [event["id"] for event in day["events"]] for day in calendar}
+
+    def test_events_fall_on_their_local_day(self):
+        calendar = calendar_events.get_calendar(datetime.date(2020, 1, 6), datetime.date(2020, 1, 8))
+        self.assertEqual(self.event_ids(calendar), {"2020-01-06": [], "2020-01-07": [self.past.id], "2020-01-08": []})
+        self.assertEqual(self.query_events.call_count, 1)
+
+    def test_past_days_are_cached_until_a_booking_changes(self):
+        day = datetime.date(2020, 1, 7)
+        calendar_events.get_calendar(day, day)
+        self.assertEqual(self.event_ids(calendar_events.get_calendar(day, day)), {"2020-01-07": [self.past.id]})
+        self.assertEqual(self.query_events.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Schedule.objects.filter(booking=self.past).update(status="cancelled")
+            refresh_booking_listings([self.past.id])
+        calendar = calendar_events.get_calendar(day, day)
+        self.assertEqual(self.query_events.call_count, 2)
+        self.assertEqual(calendar[0]["events"][0]["id"], self.past.id)
+
+    def test_days_from_today_are_not_cached(self):
+        day = datetime.date(2030, 1, 7)
+        calendar_events.get_calendar(day, day)
+        calendar = calendar_events.get_calendar(day, day)
+        self.assertEqual(self.query_events.call_count, 2)
+        self.assertEqual(self.event_ids(calendar), {"2030-01-07": [self.future.id]})
+
+    def test_filters(self):
+        day = datetime.date(2030, 1, 7)
+        self.assertEqual(self.event_ids(calendar_events.get_calendar(day, day, status="scheduled")),
+                         {"2030-01-07": [self.future.id]})
+        self.assertEqual(self.event_ids(calendar_events.get_calendar(day, day, status="completed")),
+                         {"2030-01-07": []})
+        self.assertEqual(self.event_ids(calendar_events.get_calendar(day, day, cleaner=1)), {"2030-01-07": []})
+
+
+class ReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.soon = create_booking(cls.service, "2030-01-07", "10:00")
+        cls.later = create_booking(cls.service, "2030-01-09", "09:00")
+        cls.now = cls.soon.appointment_date_time - datetime.timedelta(hours=2)
+
+    def flags(self, booking):
+        booking.refresh_from_db()
+        return [flag for flag in reminders.REMINDER_TIERS if getattr(booking, flag)]
+
+    def test_due_tiers(self):
+        due = [(booking.id, flags) for booking, flags in reminders.get_due_reminders(self.now)]
+        self.assertEqual(due, [
+            (self.soon.id, ["three_day_reminder", "one_day_reminder", "three_hour_reminder"]),
+            (self.later.id, ["three_day_reminder"]),
+        ])
+
+    def test_one_mail_per_booking_in_batches(self):
+        with mock.patch.object(reminders, "render_batch", wraps=reminders.render_batch) as render_batch:
+            stats = reminders.send_booking_reminders(self.now, batch_size=1)
+        self.assertEqual(stats, {"due": 2, "sent": 2, "failed": 0})
+        self.assertEqual(render_batch.call_count, 2)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[self.soon.bod.user.email], [self.later.bod.user.email]])
+        self.assertEqual(self.flags(self.soon), list(reminders.REMINDER_TIERS))
+        self.assertEqual(self.flags(self.later), ["three_day_reminder"])
+        self.assertEqual(EmailLogs.objects.filter(title=reminders.REMINDER_TITLE).count(), 2)
+        self.assertEqual(reminders.send_booking_reminders(self.now)["due"], 0)
+
+    def test_failing_booking_is_given_up(self):
+        failing = mock.patch.object(reminders, "build_reminder_email", side_effect=OSError("connection refused"))
+        with failing, self.assertLogs(reminders.logger, "ERROR"):
+            for _ in range(reminders.MAX_REMINDER_FAILURES):
+                self.assertEqual(reminders.send_booking_reminders(self.now)["failed"], 2)
+        self.assertEqual(reminders.get_due_reminders(self.now), [])
+        self.assertEqual(self.flags(self.soon), [])
+
+    def test_booking_without_customer_email_is_given_up_at_once(self):
+        User.objects.filter(id=self.soon.bod.user_id).update(email="")
+        with self.assertLogs(reminders.logger, "WARNING"):
+            self.assertEqual(reminders.send_booking_reminders(self.now), {"due": 2, "sent": 1, "failed": 1})
+        self.assertEqual([booking.id for booking, flags in reminders.get_due_reminders(self.now)], [])
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.email_type = EmailTypes.objects.create(subject="Hi", body="Hi {{ name }}", email_type="Confirmation")
+
+    def enqueue(self, name, template=None):
+        return mailer.enqueue_email("%s@example.com" % name, "Hi", template or self.email_type, {"name": name})
+
+    def test_enqueue_sends_nothing(self):
+        email = self.enqueue("ann")
+        self.assertEqual((email.status, email.attempts), ("queued", 0))
+        self.assertEqual(mail.outbox, [])
+
+    def test_outbox_is_drained_in_batches(self):
+        for name in ("ann", "bob", "eve"):
+            self.enqueue(name)
+        with mock.patch.object(mailer, "get_connection", wraps=mailer.get_connection) as get_connection:
+            stats = mailer.dispatch_outbox(batch_size=2)
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual([(batch["size"], batch["sent"]) for batch in stats], [(2, 2), (1, 1)])
+        self.assertEqual([(message.to, message.body) for message in mail.outbox], [
+            (["ann@example.com"], "Hi ann"), (["bob@example.com"], "Hi bob"), (["eve@example.com"], "Hi eve"),
+        ])
+        self.assertEqual(set(OutboundEmail.objects.values_list("status", flat=True)), {"sent"})
+
+    def test_dates_are_stored_rendered(self):
+        email = mailer.enqueue_email("ann@example.com", "Hi", self.email_type, {"name": datetime.date(2030, 1, 7)})
+        email.refresh_from_db()
+        self.assertIsInstance(email.context["name"], str)
+
+    def test_failing_template_is_retried_by_the_next_runs(self):
+        broken = self.enqueue("ann", template="no_such_template.html")
+        self.enqueue("bob")
+        stats = mailer.dispatch_outbox()
+        self.assertEqual([(batch["sent"], batch["retry"]) for batch in stats], [(1, 1)])
+        for _ in range(mailer.OUTBOX_MAX_ATTEMPTS - 1):
+            mailer.dispatch_outbox()
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts), ("failed", mailer.OUTBOX_MAX_ATTEMPTS))
+        self.assertIn("no_such_template.html", broken.error)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_stale_claims_are_requeued(self):
+        stale, fresh = self.enqueue("ann"), self.enqueue("bob")
+        OutboundEmail.objects.filter(id=stale.id).update(
+            status="sending", updated_at=timezone.now() - mailer.OUTBOX_STALE_AFTER * 2
+        )
+        OutboundEmail.objects.filter(id=fresh.id).update(status="sending")
+        mailer.dispatch_outbox()
+        self.assertEqual([message.to for message in mail.outbox], [["ann@example.com"]])
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, "sending")
+
+
+class EmailTemplateCacheTests(TestCase):
+    def setUp(self):
+        self.email_type = EmailTypes.objects.create(subject="Hi", body="Hi {{ name }}", email_type="Reminder")
+
+    def render(self, *names):
+        return email_templates.render_batch(self.email_type, [{"name": name} for name in names])
+
+    def test_body_is_compiled_once(self):
+        with mock.patch.object(email_templates, "Template", wraps=email_templates.Template) as template:
+            self.assertEqual(self.render("ann", "bob"), ["Hi ann", "Hi bob"])
+            self.assertEqual(self.render("eve"), ["Hi eve"])
+        self.assertEqual(template.call_count, 1)
+
+    def test_saved_body_is_compiled_again(self):
+        self.render("ann")
+        self.email_type.body = "Hello {{ name }}"
+        self.email_type.save()
+        self.assertNotIn(self.email_type.id, email_templates._email_type_templates)
+        self.assertEqual(self.render("ann"), ["Hello ann"])
+
+    def test_body_changed_in_another_process_is_compiled_again(self):
+        self.render("ann")
+        # only the row's change time tells this process about it
+        EmailTypes.objects.filter(id=self.email_type.id).update(
+            body="Hello {{ name }}", created_at=timezone.now() + datetime.timedelta(seconds=1)
+        )
+        self.email_type.refresh_from_db()
+        self.assertEqual(self.render("ann"), ["Hello ann"])
+
+    def test_delete_drops_the_template(self):
+        self.render("ann")
+        email_type_id = self.email_type.id
+        self.email_type.delete()
+        self.assertNotIn(email_type_id, email_templates._email_type_templates)
+
+    def test_file_template_is_loaded_once(self):
+        email_templates._file_templates.pop("three_days.html", None)
+        with mock.patch.object(email_templates, "get_template", wraps=email_templates.get_template) as get_template:
+            bodies = email_templates.render_batch("three_days.html", [{"event_name": "Deep clean"}] * 2)
+            email_templates.render_batch("three_days.html", [{"event_name": "Deep clean"}])
+        self.assertEqual(get_template.call_count, 1)
+        self.assertEqual(len(bodies), 2)
+        self.assertIn("Deep clean", bodies[0])
+
+
+class PushDispatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = push.StubPushBackend()
+        self.dispatcher = push.PushDispatcher(self.backend, workers=2, window=60, max_pending=100)
+        self.addCleanup(self.dispatcher._executor.shutdown)
+
+    def flush(self):
+        for future in self.dispatcher.flush():
+            future.result()
+        return sorted((sorted(sent["tokens"]), sent["body"]) for sent in self.backend.outbox)
+
+    def test_pushes_to_a_device_coalesce_into_the_latest(self):
+        self.dispatcher.push(["a", "b"], "Chat", "first")
+        self.dispatcher.push(["a"], "Chat", "second")
+        self.assertEqual(self.flush(), [(["a"], "second"), (["b"], "first")])
+
+    def test_devices_of_one_message_share_a_multicast(self):
+        self.dispatcher.push(["a", "b", ""], "Chat", "hi", {"booking": 1})
+        self.dispatcher.push(["c"], "Chat", "hi", {"booking": 1})
+        self.assertEqual(self.flush(), [(["a", "b", "c"], "hi")])
+        self.assertEqual(self.backend.outbox[0]["data"], {"booking": 1})
+
+    def test_multicasts_are_split_at_the_limit(self):
+        with mock.patch.object(push, "MULTICAST_LIMIT", 2):
+            self.dispatcher.push(["a", "b", "c"], "Chat", "hi")
+            self.assertEqual(self.flush(), [(["a", "b"], "hi"), (["c"], "hi")])
+
+    def test_full_queue_is_sent_right_away(self):
+        dispatcher = push.PushDispatcher(self.backend, workers=1, window=60, max_pending=2)
+        self.addCleanup(dispatcher._executor.shutdown)
+        dispatcher.push(["a"], "Chat", "hi")
+        self.assertIsNotNone(dispatcher._timer)
+        dispatcher.push(["b"], "Chat", "hi")
+        dispatcher._executor.shutdown(wait=True)
+        self.assertEqual(len(self.backend.outbox), 1)
+        self.assertIsNone(dispatcher._timer)
+
+    def test_window_timer_sends(self):
+        dispatcher = push.PushDispatcher(self.backend, workers=1, window=0.01, max_pending=100)
+        self.addCleanup(dispatcher._executor.shutdown)
+        sent = threading.Event()
+        with mock.patch.object(self.backend, "send_multicast", side_effect=lambda *args: sent.set()):
+            dispatcher.push(["a"], "Chat", "hi")
+            self.assertTrue(sent.wait(5))
+
+    def test_failed_send_is_logged(self):
+        self.dispatcher.push(["a"], "Chat", "hi")
+        with mock.patch.object(self.backend, "send_multicast", side_effect=OSError("gateway down")), \
+                self.assertLogs(push.logger, "ERROR"):
+            self.flush()
+
+
+class GeoTests(SimpleTestCase):
+    def test_coordinates(self):
+        self.assertTrue(all(math.isnan(parse_coordinate(value)) for value in ("", "null", None, "181", "nan")))
+        self.assertEqual(parse_coordinate("-73.99"), -73.99)
+        self.assertEqual(str(to_coordinate("40.7500004", 90)), "40.750000")
+        self.assertIsNone(to_coordinate("95", 90))
+        self.assertIsNone(grid_cell("40.75", ""))
+
+    def test_haversine(self):
+        # New York to Los Angeles
+        self.assertAlmostEqual(float(haversine_km(40.7128, -74.0060, 34.0522, -118.2437)), 3936, delta=5)
+        self.assertTrue(math.isnan(haversine_km(math.nan, 0, 0, 0)))
+
+    def test_cells_around_a_point_cover_its_neighbours(self):
+        cells = grid_cells_within(40.75, -73.99, 5)
+        self.assertIn(grid_cell(40.75, -73.99), cells)
+        self.assertIn(grid_cell(40.79, -73.95), cells)
+        self.assertNotIn(grid_cell(41.75, -73.99), cells)
+        self.assertIsNone(grid_cells_within(40.75, -73.99, 1000))
+
+    def test_cells_wrap_around_the_antimeridian(self):
+        cells = grid_cells_within(0, 179.99, 10)
+        self.assertIn(grid_cell(0, -179.99), cells)
+
+
+class ProximityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = create_service()
+        cls.booking = create_booking(cls.service, point=("40.75", "-73.99"))
+        cls.three_km = create_booking(cls.service, "2030-01-08", point=("40.777", "-73.99"))
+        cls.thirty_km = create_booking(cls.service, "2030-01-09", point=("41.02", "-73.99"))
+        cls.near = create_cleaner("Near", latitude="40.76", longitude="-73.99")
+        cls.far = create_cleaner("Far", latitude="40.95", longitude="-73.99")
+        cls.busy = create_cleaner("Busy", latitude="40.751", longitude="-73.99")
+        create_cleaner("Nowhere")
+        other = create_booking(cls.service, point=("40.70", "-73.90"))
+        DispatchedAppointment.objects.create(service_provider=cls.busy, booking=other)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bookings_within_radius(self):
+        found = bookings_within_radius(40.75, -73.99, 10)
+        self.assertEqual([row["booking_id"] for row in found][:2], [self.booking.id, self.three_km.id])
+        self.assertNotIn(self.thirty_km.id, [row["booking_id"] for row in found])
+        self.assertAlmostEqual(found[1]["distance_km"], 3, delta=0.1)
+        found = bookings_within_radius(40.75, -73.99, 1000, start=self.three_km.appointment_date_time)
+        self.assertEqual([row["booking_id"] for row in found], [self.three_km.id, self.thirty_km.id])
+
+    def test_nearest_available_cleaners_widen_the_radius(self):
+        cleaners = nearest_available_cleaners(self.booking, limit=2)
+        self.assertEqual([cleaner["cleaner_id"] for cleaner in cleaners], [self.near.id, self.far.id])
+        self.assertEqual(cleaners[0]["first_name"], "Near")
+
+    def test_nearest_available_cleaners_stop_at_the_max_radius(self):
+        cleaners = nearest_available_cleaners(self.booking, max_radius_km=10)
+        self.assertEqual([cleaner["cleaner_id"] for cleaner in cleaners], [self.near.id])
+
+
+class CsvExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        sam, ann = create_cleaner("Sam", last_name="Lee"), create_cleaner("Ann")
+        cls.customer = create_order(create_service()).user
+        Payroll.objects.create(sp=sam, period_start=datetime.date(2030, 1, 7), hourly_wage=20, total_hours=2,
+                               total_amount=45, paid_amount=40, tip_amount=5)
+        Payroll.objects.create(sp=ann, period_start=datetime.date(2030, 1, 14), hourly_wage=20, total_hours=1.5,
+                               total_amount=30)
+
+    def read(self, response):
+        return list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+
+    def test_payroll_rows_and_totals(self):
+        rows = self.read(csv_response(payroll_lines(Payroll.objects.all()), "payroll.csv"))
+        self.assertEqual(rows, [
+            ["service provider", "hourly wage", "hours worked", "amount", "paid", "total tips"],
+            ["Sam Lee", "20.0", "2.0", "45.0", "40.0", "5.0"],
+            ["Ann", "20.0", "1.5", "30.0", "0.0", "0.0"],
+            ["total_amount", "75.0"],
+            ["total_paid", "40.0"],
+        ])
+
+    def test_lines_are_produced_lazily(self):
+        lines = payroll_lines(Payroll.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(next(lines)[0], "service provider")
+
+    def test_customers(self):
+        response = csv_response(customer_lines(), "customers.csv")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="customers.csv"')
+        rows = self.read(response)
+        self.assertEqual(rows[1][:4], [self.customer.email, "Customer", "Jane", "Doe"])
+        self.assertEqual(len(rows), 2)
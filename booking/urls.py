@@ -117,8 +117,10 @@ urlpatterns = [
         ServiceBookingViewSet.as_view({"get": "retrieve"}),
         name="service_booking",
     ),
+    path("quote", QuoteViewSet.as_view({"post": "create"}), name="quote"),
     path("booking_list", BookingViewSet.as_view({"get": "list"}), name="booking_list"),
     path("get_booking/<int:pk>", BookingViewSet.as_view({"get": "retrieve"}), name="get_booking"),
+    path("booking_occurrences", BookingViewSet.as_view({"get": "occurrences"}), name="booking_occurrences"),
     path("booking_by_created", BookingViewSet.as_view({"get": "booking_created_at"}), name="booking_created_at"),
     path(
         "update_booking",
@@ -189,6 +191,26 @@ urlpatterns = [
         BookingUpdateViewSet.as_view({"get": "dispatch_list"}),
         name="dispatch_list",
     ),
+    path(
+        "available_cleaners/<int:pk>",
+        BookingUpdateViewSet.as_view({"get": "available_cleaners"}),
+        name="available_cleaners",
+    ),
+    path(
+        "dispatch_optimizer",
+        DispatchOptimizerViewSet.as_view({"get": "list", "post": "create"}),
+        name="dispatch_optimizer",
+    ),
+    path(
+        "nearest_cleaners/<int:pk>",
+        ProximityViewSet.as_view({"get": "nearest_cleaners"}),
+        name="nearest_cleaners",
+    ),
+    path(
+        "bookings_within_radius",
+        ProximityViewSet.as_view({"get": "bookings_within_radius"}),
+        name="bookings_within_radius",
+    ),
     path(
         "delete_dispatch/<int:pk>",
         BookingUpdateViewSet.as_view({"delete": "destroy"}),
@@ -221,6 +243,11 @@ urlpatterns = [
         BookingDashboardViewSet.as_view({"get": "list"}),
         name="booking_dashboard",
     ),
+    path(
+        "booking_calendar",
+        BookingCalendarViewSet.as_view({"get": "list"}),
+        name="booking_calendar",
+    ),
     # Charge
     path(
         "charge_booking",
@@ -1,12 +1,27 @@
-from pyfcm import FCMNotification
-from dateutil.relativedelta import relativedelta
+import base64
+import json
+
 from django.core.mail import EmailMessage
-from django.template.loader import get_template
+from django.db import connections, router, transaction
+from django.db.models import F, Q
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
-from django import template
 
+from booking.catalog import get_catalog
+from booking.email_templates import render_batch
+from booking.geo import grid_cell, to_coordinate
+from booking.listing import schedule_listing_refresh
+from booking.mailer import build_outbound_email, enqueue_email, enqueue_emails
+from booking.push import push_to_users
+from booking.metrics import metric_day, record_metric
 from booking.models import *
+from booking.recurrence import (
+    get_horizon_end,
+    get_recurring_orders,
+    get_series_start,
+    iter_occurrences,
+    to_naive,
+)
 from django.utils import timezone as datetime, timezone
 import stripe
 
@@ -16,153 +31,315 @@ stripe.api_key = "sk_test_51LuzvBImI0pxinz8a54b3xfox3caY1xrR1sk\
                          r5rmmwNDFeJ32tuPbKp4wPOxynTP9xMcQ5GqeCiNysxI2HEzMbOh00ejP1f3IM"
 
 
-def calculate_booking_bills(
-        order_details: BookingOrderDetails, extras: list, items: list, service_id: int
-):
+def quote_booking(service_id: int, items: list, extras: list):
+    """
+    Prices a selection of items and extras without writing anything. Service, tax, items and extras are resolved
+    from the catalog snapshot, so the booking page can call it on every selection change. Returns the line totals
+    plus hours, discount and tax.
+    """
+    catalog = get_catalog()
+    service = catalog.services.get(int(service_id or 0))
+    if not service:
+        raise ValueError("Service not exist")
+    tax = catalog.get_tax(service.id)
+    item_objs = catalog.items
+    extra_objs = catalog.extras
     total_hours = 0
-    total_amount = 0
-    service = Service.objects.filter(id=service_id).first()
-    tax = service.tax.tax_rate
+    sub_total = 0
+    discount_total = 0
+    extra_lines = []
     for extra in extras:
-        extras_bill = 0
-        extra_obj = Extra.objects.filter(id=extra["extra_id"]).first()
-        extras_bill += extra_obj.price * extra["quantity"]
-        total_hours += extra_obj.time_hrs * extra["quantity"]
-        total_amount += extras_bill
-        BODExtraDetails.objects.create(
-            extra=extra_obj,
-            bod=order_details,
-            price=extras_bill,
-            quantity=extra["quantity"],
+        extra_obj = extra_objs.get(int(extra["extra_id"]))
+        if not extra_obj:
+            raise ValueError("Extra %s not exist" % extra["extra_id"])
+        quantity = int(extra["quantity"])
+        extras_bill = float(extra_obj.price) * quantity
+        total_hours += float(extra_obj.time_hrs) * quantity
+        sub_total += extras_bill
+        extra_lines.append(
+            {
+                "extra_id": extra_obj.id,
+                "title": extra_obj.title,
+                "quantity": quantity,
+                "price": extras_bill,
+            }
         )
+    item_lines = []
     for obj in items:
-        package_bill = 0
-        item = Item.objects.filter(id=obj["item_id"]).first()
-        package_bill += item.price
-        discount = (package_bill * item.discount_percent / 100)
-        package_bill = float(package_bill) - float(discount)
-        total_hours += item.time_hrs
-        BODItemDetails.objects.create(item=item, bod=order_details, price=package_bill)
-        total_amount = float(total_amount) + package_bill
-    tax_amount = (total_amount * tax) / 100
-    order_details.total_hours = total_hours
-    order_details.total_amount = total_amount + tax_amount
-    order_details.save()
-    return True
+        item = item_objs.get(int(obj["item_id"]))
+        if not item:
+            raise ValueError("Item %s not exist" % obj["item_id"])
+        discount = float(item.price) * item.discount_percent / 100
+        package_bill = float(item.price) - discount
+        total_hours += float(item.time_hrs)
+        sub_total += package_bill
+        discount_total += discount
+        item_lines.append(
+            {
+                "item_id": item.id,
+                "title": item.title,
+                "discount": discount,
+                "price": package_bill,
+            }
+        )
+    tax_rate = tax.tax_rate if tax else 0
+    tax_amount = (sub_total * tax_rate) / 100
+    return {
+        "service_id": service.id,
+        "items": item_lines,
+        "extras": extra_lines,
+        "sub_total": sub_total,
+        "discount": discount_total,
+        "tax_rate": tax_rate,
+        "tax_amount": tax_amount,
+        "total_hours": total_hours,
+        "total_amount": sub_total + tax_amount,
+    }
+
+
+def bulk_create_details(model, objs):
+    """
+    bulk_create for the item/extra detail models, which inherit from the concrete *DetailsAbstract tables. The
+    parent rows are bulk created first, then the child rows through the DETAIL_ROW_MODELS mapping their table.
+    The objs get the pks and creation times of their rows.
+    """
+    if not objs:
+        return objs
+    parent_model = model._meta.get_parent_list()[0]
+    parent_fields = parent_model._meta.concrete_fields
+    parent_link = model._meta.get_ancestor_link(parent_model).attname
+    row_model = DETAIL_ROW_MODELS[model]
+    with transaction.atomic(using=router.db_for_write(model)):
+        parents = parent_model.objects.bulk_create(
+            [parent_model(**{field.attname: getattr(obj, field.attname) for field in parent_fields}) for obj in objs]
+        )
+        for obj, parent in zip(objs, parents):
+            for field in parent_fields:
+                setattr(obj, field.attname, getattr(parent, field.attname))
+            setattr(obj, parent_link, parent.pk)
+        row_fields = row_model._meta.concrete_fields
+        row_model.objects.bulk_create(
+            [row_model(**{field.attname: getattr(obj, field.attname) for field in row_fields}) for obj in objs]
+        )
+    return objs
 
 
-def schedule_booking(order_detail: int, data):
-    instance = BookingOrderDetails.objects.get(id=order_detail)
-    days = 0
-    count = 0
-    s = 0
-    payment = None
-    if instance.frequency.type == "weekly":
-        days = 24
-    if instance.frequency.type == "biweekly":
-        days = 12
-    if instance.frequency.type == "monthly":
-        days = 6
-    if instance.frequency.type == "daily":
-        days = 1
-
-    appointment_date_time = (
-            str(instance.frequency.start_date) + " " + str(instance.start_time)
+def calculate_booking_bills(
+        order_details: BookingOrderDetails, extras: list, items: list, service_id: int
+):
+    quote = quote_booking(service_id, items=items, extras=extras)
+    bulk_create_details(
+        BODExtraDetails,
+        [
+            BODExtraDetails(
+                extra_id=line["extra_id"],
+                bod=order_details,
+                price=line["price"],
+                quantity=line["quantity"],
+            )
+            for line in quote["extras"]
+        ]
     )
-    appointment_date_time = datetime.datetime.strptime(
-        appointment_date_time, "%Y-%m-%d %H:%M"
+    bulk_create_details(
+        BODItemDetails,
+        [
+            BODItemDetails(item_id=line["item_id"], bod=order_details, price=line["price"])
+            for line in quote["items"]
+        ]
     )
-    for i in range(0, days):
-        new_booking_service_location = ServiceLocation(
-            street_address=instance.bod_service_location.street_address,
-            apt_suite=instance.bod_service_location.apt_suite,
-            city=instance.bod_service_location.city,
-            state=instance.bod_service_location.state,
-            zip_code=instance.bod_service_location.zip_code,
-        )
+    order_details.total_hours = quote["total_hours"]
+    order_details.total_amount = quote["total_amount"]
+    order_details.save()
+    return quote
 
-        new_booking = Booking(
-            type=instance.type,
-            start_time=instance.start_time,
-            total_hours=instance.total_hours,
-            appointment_date_time=appointment_date_time,
-            latest_reschedule=instance.latest_reschedule,
-            latest_cancel=instance.latest_cancel,
-            additional_info=instance.additional_info,
-            bod=instance,  # FK
-            service_location=new_booking_service_location,  # FK
-            status="scheduled",
-            total_amount=instance.total_amount,
-            latitude=data["latitude"],
-            longitude=data["longitude"],
-        )
-        new_booking_service_location.save()
-
-        new_booking.save()
-        if s == 0:
-            sale = Sale.objects.create(
-                booking=new_booking,
-                amount=instance.total_amount,
-                paid=instance.total_amount,
-                status="pending",
-            )
-            sale.save()
-            payment = PaymentSale(
-                sale=sale, amount=instance.total_amount, is_first=True
-            )
-            payment.save()
 
-        else:
-            sale = Sale(
-                booking=new_booking, amount=instance.total_amount, status="pending"
+def materialize_bookings(
+        instance: BookingOrderDetails,
+        appointment_dates: list,
+        latitude=None,
+        longitude=None,
+        first_payment=True,
+):
+    """
+    Creates the Booking rows of an order for the given appointment datetimes. Every table (ServiceLocation,
+    Booking, Sale, PaymentSale, BookingItemDetails, BookingExtraDetails and Schedule) is written with one
+    bulk_create inside a single transaction. Returns the first-payment PaymentSale, if one was created.
+    """
+    payment = None
+    if not appointment_dates:
+        return payment
+    latitude, longitude = to_coordinate(latitude, 90), to_coordinate(longitude)
+    cell = grid_cell(latitude, longitude)
+    location = instance.bod_service_location
+    bod_items = list(instance.boditemdetails_set.all())
+    bod_extras = list(instance.bodextradetails_set.all())
+    with transaction.atomic():
+        locations = ServiceLocation.objects.bulk_create(
+            [
+                ServiceLocation(
+                    street_address=location.street_address,
+                    apt_suite=location.apt_suite,
+                    city=location.city,
+                    state=location.state,
+                    zip_code=location.zip_code,
+                )
+                for _ in appointment_dates
+            ]
+        )
+        bookings = Booking.objects.bulk_create(
+            [
+                Booking(
+                    type=instance.type,
+                    start_time=instance.start_time,
+                    total_hours=instance.total_hours,
+                    appointment_date_time=appointment_date_time,
+                    latest_reschedule=instance.latest_reschedule,
+                    latest_cancel=instance.latest_cancel,
+                    additional_info=instance.additional_info,
+                    bod=instance,  # FK
+                    service_location=service_location,  # FK
+                    status="scheduled",
+                    total_amount=instance.total_amount,
+                    latitude=latitude,
+                    longitude=longitude,
+                    grid_cell=cell,
+                )
+                for appointment_date_time, service_location in zip(
+                    appointment_dates, locations
+                )
+            ]
+        )
+        sales = Sale.objects.bulk_create(
+            [
+                Sale(
+                    booking=booking,
+                    amount=instance.total_amount,
+                    paid=instance.total_amount if first_payment and i == 0 else 0.0,
+                    status="pending",
+                )
+                for i, booking in enumerate(bookings)
+            ]
+        )
+        if first_payment:
+            payment = PaymentSale.objects.create(
+                sale=sales[0], amount=instance.total_amount, is_first=True
             )
-            sale.save()
-        s = 1
-        count += 1
-
-        if instance.frequency.type == "weekly":
-            appointment_date_time = appointment_date_time + datetime.timedelta(days=7)
-        if instance.frequency.type == "biweekly":
-            appointment_date_time = appointment_date_time + datetime.timedelta(days=14)
-        if instance.frequency.type == "monthly":
-            appointment_date_time = appointment_date_time + relativedelta(months=+1)
-    for booking in instance.booking_set.all().order_by(
-            "id"
-    ):  # creating packs detail for all booking instance
-        for bod_item in instance.boditemdetails_set.all():
-            new_booking_item_detail = BookingItemDetails(
-                item=bod_item.item, booking=booking, price=bod_item.price
+        bulk_create_details(
+            BookingItemDetails,
+            [
+                BookingItemDetails(
+                    item_id=bod_item.item_id, booking=booking, price=bod_item.price
+                )
+                for booking in bookings
+                for bod_item in bod_items
+            ]
+        )
+        if bod_items:
+            # once committed, so the service row is not held locked while the caller charges the card
+            service_id, added = instance.frequency.service_id, len(bookings) * len(bod_items)
+            transaction.on_commit(
+                lambda: Service.objects.filter(id=service_id).update(total_booking=F("total_booking") + added)
             )
-            new_booking_item_detail.save()
-
-            for bod_extra in instance.bodextradetails_set.all():
-                new_booking_extra_detail = BookingExtraDetails(
-                    extra=bod_extra.extra,
+        bulk_create_details(
+            BookingExtraDetails,
+            [
+                BookingExtraDetails(
+                    extra_id=bod_extra.extra_id,
                     booking=booking,
                     price=bod_extra.price,
                     quantity=bod_extra.quantity,
                 )
-                new_booking_extra_detail.save()
-        new_schedule = Schedule(
-            booking=booking,
-            start_time=booking.appointment_date_time,
-            colour=instance.colour,
-            end_time=booking.appointment_date_time
-                     + timezone.timedelta(hours=instance.total_hours)
-            # change this to calculated hour.
+                for booking in bookings
+                for bod_extra in bod_extras
+            ]
+        )
+        Schedule.objects.bulk_create(
+            [
+                Schedule(
+                    booking=booking,
+                    user=instance.user,  # cleaner will be added when dispatched.
+                    start_time=booking.appointment_date_time,
+                    colour=instance.colour,
+                    end_time=booking.appointment_date_time
+                             + timezone.timedelta(hours=instance.total_hours),
+                    count=1,  # first and only schedule of a freshly created booking.
+                )
+                for booking in bookings
+            ]
+        )
+        # bulk_create skips the post_save signals that keep BookingListing and DailyMetrics current.
+        schedule_listing_refresh([booking.id for booking in bookings])
+        record_metric("bookings", metric_day(), len(bookings))
+    return payment
+
+
+def schedule_booking(order_detail: int, data):
+    instance = BookingOrderDetails.objects.select_related(
+        "frequency", "bod_service_location", "user"
+    ).get(id=order_detail)
+    # Only the occurrences within the rolling horizon are created, extend_booking_horizons picks up the rest. The
+    # first occurrence is always created as it carries the first payment.
+    until = max(
+        get_horizon_end(), get_series_start(instance.frequency, instance.start_time)
+    )
+    appointment_dates = list(
+        iter_occurrences(instance.frequency, instance.start_time, until=until)
+    )
+    with transaction.atomic():
+        payment = materialize_bookings(
+            instance,
+            appointment_dates,
+            latitude=data["latitude"],
+            longitude=data["longitude"],
         )
-        new_schedule.save()
-        if (
-                instance.user
-        ):  # if no user exist and the order is anonymous then write code to handle this:
-            new_schedule.user = instance.user  # cleaner will be added when dispatched.
-        new_schedule.save()
-
-    instance.status = "scheduled"
-    instance.save()
+        instance.status = "scheduled"
+        instance.save()
     return payment
 
 
+def extend_booking_horizon(instance: BookingOrderDetails, until=None):
+    """
+    Materializes the occurrences of a recurring order between its last Booking and the horizon. instance should come
+    from get_recurring_orders so frequency and last_materialized are already loaded.
+    """
+    last_booking = (
+        Booking.objects.filter(bod=instance)
+        .order_by("-appointment_date_time")
+        .only("appointment_date_time", "latitude", "longitude")
+        .first()
+    )
+    if last_booking is None:
+        return []
+    appointment_dates = list(
+        iter_occurrences(
+            instance.frequency,
+            instance.start_time,
+            after=to_naive(last_booking.appointment_date_time),
+            until=until or get_horizon_end(),
+        )
+    )
+    if appointment_dates:
+        materialize_bookings(
+            instance,
+            appointment_dates,
+            latitude=last_booking.latitude,
+            longitude=last_booking.longitude,
+            first_payment=False,
+        )
+    return appointment_dates
+
+
+def extend_booking_horizons():
+    """Rolls the horizon forward for every active recurring order. Run periodically from booking_crons."""
+    until = get_horizon_end()
+    total = 0
+    # until is naive like the occurrences, the stored appointments are aware
+    orders = get_recurring_orders(timezone.now()).filter(last_materialized__lt=timezone.make_aware(until))
+    for instance in orders:
+        total += len(extend_booking_horizon(instance, until))
+    return total
+
+
 def stripe_payment(
         card_token,
         email: str,
@@ -253,6 +430,123 @@ def stripe_payment_user(
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Page number pagination by default. Sending ?cursor= (empty for the first page) switches to keyset pagination on
+    cursor_ordering, e.g.: ("appointment_date_time", "pk") or ("-created_at", "-pk"), which skips the COUNT(*) and
+    the OFFSET scan. Its fields must all sort in the same direction and end with a unique one. next_page/prev_page then carry opaque cursors and total_count is only filled, with the planner's
+    estimate, when ?estimate=true is sent. Views return get_response(data), which keeps the same envelope.
+    """
+
+    cursor_query_param = "cursor"
+
+    def __init__(self, cursor_ordering=("appointment_date_time", "pk")):
+        # the row comparison in paginate_queryset only holds when every field sorts the same way
+        if len({field.startswith("-") for field in cursor_ordering}) != 1:
+            raise ValueError("cursor_ordering fields must all sort in the same direction")
+        self.cursor_ordering = cursor_ordering
+        self.cursor_mode = False
+
+    @classmethod
+    def is_requested(cls, request):
+        return bool(request.GET.get("page")) or cls.cursor_query_param in request.GET
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.GET:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_mode = True
+        self.request = request
+        self.estimated_count = None
+        if request.GET.get("estimate") == "true":
+            self.estimated_count = self.estimate_count(queryset)
+
+        fields = [field.lstrip("-") for field in self.cursor_ordering]
+        descending = self.cursor_ordering[0].startswith("-")
+        position = self.decode_cursor(queryset.model, fields, request.GET.get(self.cursor_query_param))
+        reverse = position["reverse"] if position else False
+        if reverse:
+            ordering = [field[1:] if field.startswith("-") else "-" + field for field in self.cursor_ordering]
+        else:
+            ordering = list(self.cursor_ordering)
+        queryset = queryset.order_by(*ordering)
+        if position:
+            lookup = "lt" if descending != reverse else "gt"
+            condition = Q()
+            for index, field in enumerate(fields):
+                # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y)
+                key = Q(**{field + "__" + lookup: position["values"][index]})
+                for previous, value in zip(fields[:index], position["values"][:index]):
+                    key &= Q(**{previous: value})
+                condition |= key
+            queryset = queryset.filter(condition)
+
+        page_size = int(self.page_size or 10)
+        rows = list(queryset[: page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        has_next = bool(position) if reverse else has_more
+        has_prev = has_more if reverse else bool(position)
+        self.next_cursor = self.encode_cursor(rows[-1], fields, False) if rows and has_next else None
+        self.prev_cursor = self.encode_cursor(rows[0], fields, True) if rows and has_prev else None
+        return rows
+
+    @staticmethod
+    def encode_cursor(row, fields, reverse):
+        values = []
+        for field in fields:
+            value = getattr(row, field)
+            values.append(value.isoformat() if hasattr(value, "isoformat") else value)
+        payload = json.dumps({"v": values, "r": reverse}).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    @staticmethod
+    def decode_cursor(model, fields, cursor):
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [
+                (model._meta.pk if field == "pk" else model._meta.get_field(field)).to_python(value)
+                for field, value in zip(fields, payload["v"])
+            ]
+            return {"values": values, "reverse": bool(payload["r"])}
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Planner row estimate instead of a COUNT(*). Only available on PostgreSQL."""
+        if connections[queryset.db].vendor != "postgresql":
+            return None
+        # QuerySet.explain() stringifies the plan psycopg2 has already decoded, so run EXPLAIN directly
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def get_response(self, data):
+        if self.cursor_mode:
+            return self.get_cursor_response(data)
+        if self.page.number == self.page.paginator.num_pages:
+            return self.get_last_page_data(data)
+        return self.get_paginated_response(data)
+
+    def get_cursor_response(self, data):
+        return Response(
+            {
+                "next_page": self.next_cursor,
+                "prev_page": self.prev_cursor,
+                "total_count": self.estimated_count,
+                "current_page": None,
+                "total_page": None,
+                "success": True,
+                "data": data,
+                "last_page": self.next_cursor is None,
+            }
+        )
+
     def get_paginated_response(self, data):
         try:
             previous_page = self.page.previous_page_number()
@@ -385,74 +679,32 @@ def get_this_month():
 
 def booking_confirmation(name, booking_date, email):
     """
-    Send email to user
+    Queue email to user
     """
-    rtx = {"name": name, "booking_date": booking_date}
-
-    message = get_template("booking_confirmation.html").render(rtx)
-    email = EmailMessage(
-        subject="Booking Confirmation",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
+    enqueue_email(
+        email, "Booking Confirmation", "booking_confirmation.html", {"name": name, "booking_date": booking_date}
     )
-    email.content_subtype = "html"
-    email.send()
 
 
 def send_email_customer(name, status, email):
     """
-    Send email to user
+    Queue email to user
     """
-    rtx = {"name": name, "status": status}
-
-    message = get_template("notify_customer.html").render(rtx)
-    email = EmailMessage(
-        subject="Booking Completion",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
-    )
-    email.content_subtype = "html"
-    email.send()
+    enqueue_email(email, "Booking Completion", "notify_customer.html", {"name": name, "status": status})
 
 
 def send_email_customer_feedback(name, status, email):
     """
-    Send email to user
+    Queue email to user
     """
-    rtx = {"name": name, "status": status}
-
-    message = get_template("booking_feedback.html").render(rtx)
-    email = EmailMessage(
-        subject="Booking Feedback",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
-    )
-    email.content_subtype = "html"
-    email.send()
+    enqueue_email(email, "Booking Feedback", "booking_feedback.html", {"name": name, "status": status})
 
 
 def send_email_customer_tip(name, status, email):
     """
-    Send email to user
+    Queue email to user
     """
-    rtx = {"name": name, "status": status}
-
-    message = get_template("booking_tipe.html").render(rtx)
-    email = EmailMessage(
-        subject="Booking Tip",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
-    )
-    email.content_subtype = "html"
-    email.send()
+    enqueue_email(email, "Booking Tip", "booking_tipe.html", {"name": name, "status": status})
 
 
 def complete_booking(data: dict, bod: BookingOrderDetails):
@@ -474,14 +726,22 @@ def cancel_booking(data: dict, booking: Booking):
     notify_service_provider = data['notify_service_provider']
     profile = UserProfile.objects.filter(user=booking.bod.user).first()
     if profile:
+        emails = []
         if notify_customer == 'yes':
-            send_email_customer(name=profile.first_name, status="cancelled", email=booking.bod.user.email)
+            emails.append(
+                build_outbound_email(booking.bod.user.email, "Booking Completion", "notify_customer.html",
+                                     {"name": profile.first_name, "status": "cancelled"})
+            )
         if notify_service_provider == 'yes':
-            service_provider = DispatchedAppointment.objects.filter(booking=booking)
-            for sp in service_provider:
-                profile = UserProfile.objects.filter(user=sp.service_provider).first()
-                if profile:
-                    send_email_customer(name=profile.first_name, status="cancelled", email=sp.service_provider.email)
+            service_providers = DispatchedAppointment.objects.filter(
+                booking=booking, service_provider__user_in_profile__isnull=False
+            ).values_list("service_provider__email", "service_provider__user_in_profile__first_name")
+            for email, first_name in service_providers:
+                emails.append(
+                    build_outbound_email(email, "Booking Completion", "notify_customer.html",
+                                         {"name": first_name, "status": "cancelled"})
+                )
+        enqueue_emails(emails)
 
 
 def booking_confirmation_test():
@@ -490,11 +750,7 @@ def booking_confirmation_test():
     """
     rtx = {"userfirstname": "Ad", "bill": 77, "nationality": "Nigeria", "booking_date": "2021-05-05"}
     er = EmailTypes.objects.filter().first()
-    # message = get_template(er.body).render(rtx)
-    html_template_str = er.body
-    t = template.Template(html_template_str)
-    c = template.Context({"userfirstname": "Ad", "bill": 77, "nationality": "Nigeria", "booking_date": "2021-05-05"})
-    html = t.render(c)
+    html = render_batch(er, [rtx])[0]
 
     email = EmailMessage(
         subject="Booking Confirmation",
@@ -525,10 +781,4 @@ def dashboard_filter_data(filters):
 
 
 def push_notifications(user: User, message_title: str, message_body: str, data):
-    push_service = FCMNotification(
-        api_key="AAAA8BtKFRE:APA91bEqSxCmdIepghMb4HKcwVTnzvj6DHVIAYoxXieWmooy_QnALyZb9NotK-8QO5WLKwgTIoLr4nYQqQPYpvthv6mPfp7xzuvwpe-byFACRoIXp-vooT6NG8-0HIIV2n4zBYPiyvdR")
-    push_service.notify_single_device(registration_id=user.device_token,
-                                      message_title=message_title,
-                                      message_body=message_body,
-                                      data_message=data
-                                      )
+    push_to_users([user], message_title, message_body, data)
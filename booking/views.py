@@ -3,7 +3,7 @@ from dateutil import parser
 import stripe
 from .models import Service
 from dateutil.relativedelta import relativedelta
-from django.http import HttpResponse
+from django.db import transaction
 from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.permissions import IsAuthenticated
@@ -13,10 +13,28 @@ from service_provider.models import LeaveTime
 from service_provider.serializers import DispatchSerializer, UserListSerializer
 from .serializers import *
 from .utils import CustomPagination, capture_amount, charge_booking, page_view_count, booking_filters, complete_booking, \
-    cancel_booking, dashboard_filter_data, push_notifications, cleaner_booking_filter
-import csv
+    cancel_booking, dashboard_filter_data, push_notifications, cleaner_booking_filter, quote_booking
+import math
 import os
 from django.core.exceptions import ObjectDoesNotExist
+from .availability import (
+    booking_slot,
+    bump_availability_version,
+    check_dispatch,
+    describe_conflicts,
+    get_availability_index,
+)
+from .calendar_events import get_calendar
+from .dispatch_optimizer import commit_dispatch, plan_dispatch
+from .geo import parse_point
+from .proximity import bookings_within_radius, nearest_available_cleaners
+from .catalog import get_catalog
+from .listing import listed_bookings, schedule_listing_refresh
+from .exports import csv_response, customer_lines, payroll_lines
+from .metrics import get_metric_totals
+from .payroll import accrue_booking, accrue_tip
+from .recurrence import get_occurrences
+from .reschedule import describe_reschedule_conflicts, reschedule_booking
 
 stripe.api_key = os.environ['STRIPE_SECRET_KEY']
 
@@ -199,7 +217,7 @@ class ServicesViewSet(ModelViewSet, BaseAPIView):
         try:
             query = self.queryset.all().filter(status="Published").order_by("-id")
             serializer = ServicesSerializerCustomer(query, many=True)
-            banners = Banners.objects.all().order_by("-id")
+            banners = get_catalog().banners[::-1]
             banner_serializer = BannerSerializer(banners, many=True)
             response = {
                 "services": serializer.data,
@@ -280,6 +298,24 @@ class ServiceBookingViewSet(ModelViewSet, BaseAPIView):
             return self.send_bad_request_response(message=str(e))
 
 
+class QuoteViewSet(ModelViewSet, BaseAPIView):
+    queryset = Service.objects.all()
+
+    @swagger_auto_schema(tags=["Booking"])
+    def create(self, request, *args, **kwargs):
+        """Price of the current selection on the booking page. Nothing is saved."""
+        try:
+            data = request.data
+            quote = quote_booking(
+                data.get("service_id"),
+                items=data.get("items", []),
+                extras=data.get("extras", []),
+            )
+            return self.send_success_response(message="Booking quote", data=quote)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+
 class PackagesViewSet(ModelViewSet, BaseAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Package.objects.all()
@@ -456,19 +492,16 @@ class BookingViewSet(ModelViewSet, BaseAPIView):
             to_date = request.GET.get("to_date")
             if to_date:
                 to_date = parser.parse(to_date)
-            bookings = Booking.objects.filter(status__iexact=booking_status)
+            bookings = BookingListing.objects.filter(status__iexact=booking_status)
             bookings = booking_filters(bookings, date_filter, to_date)
-            if request.GET.get("page"):
+            if CustomPagination.is_requested(request):
                 paginator = CustomPagination()
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
-                serializer = BookingSerializerList(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
-            serializer = BookingSerializerList(bookings, many=True)
+                serializer = BookingSerializerList(listed_bookings(query_set), many=True)
+                return paginator.get_response(serializer.data)
+            serializer = BookingSerializerList(listed_bookings(bookings), many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
             )
@@ -479,16 +512,13 @@ class BookingViewSet(ModelViewSet, BaseAPIView):
     def booking_created_at(self, request, *args, **kwargs):
         try:
             bookings = Booking.objects.filter(status__in=["scheduled", "dispatched"]).order_by('-created_at')
-            if request.GET.get("page"):
-                paginator = CustomPagination()
+            if CustomPagination.is_requested(request):
+                paginator = CustomPagination(cursor_ordering=("-created_at", "-pk"))
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
                 serializer = BookingSerializerList(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
+                return paginator.get_response(serializer.data)
             serializer = BookingSerializerList(bookings, many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
@@ -496,6 +526,24 @@ class BookingViewSet(ModelViewSet, BaseAPIView):
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
+    @swagger_auto_schema(tags=["Booking"])
+    def occurrences(self, request, *args, **kwargs):
+        """
+        Calendar/list view of a date range. Recurring orders only have Booking rows within the horizon, the rest of
+        their series comes back as virtual occurrences (virtual=True, id=None).
+        """
+        try:
+            from_date = request.GET.get("from_date")
+            to_date = request.GET.get("to_date")
+            if not from_date or not to_date:
+                return self.send_bad_request_response(message="from_date and to_date are required")
+            from_date = datetime.datetime.strptime(from_date, "%Y-%m-%d")
+            to_date = datetime.datetime.strptime(to_date, "%Y-%m-%d") + timedelta(days=1, microseconds=-1)
+            data = get_occurrences(from_date, to_date, request.GET.get("bod"))
+            return self.send_success_response(message="Booking Occurrences", data=data)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
     @swagger_auto_schema(tags=["Booking"])
     def retrieve(self, request, *args, **kwargs):
         try:
@@ -589,98 +637,28 @@ class RescheduleBookingViewSet(ModelViewSet, BaseAPIView):
     def update(self, request, *args, **kwargs):
         try:
             data = request.data
-            is_all = data.get("is_all")
-            current_booking = Booking.objects.get(
-                id=data["id"]
-            )  # changes //appointed date
-            appointment_date = data.get("time")
-            # appointment_date = "2021-01-01 00:00:00"
-            if is_all == "on":
-                all_booking = Booking.objects.filter(
-                    bod__id=current_booking.bod.id
-                ).order_by("id")
-                all_booking_ids = all_booking.values_list("id", flat=True)
-                if current_booking.bod.frequency.type == "weekly":
-                    appointment_date = datetime.datetime.strptime(
-                        appointment_date, "%Y-%m-%d %H:%M:%S"
-                    )
-                    schedule = Schedule.objects.filter(booking__in=all_booking_ids)
-                    schedule_len = len(schedule)
-                    index = schedule_len
-                    for obj in schedule:
-                        days = 7 * (schedule_len - index)
-                        obj.start_time = appointment_date + datetime.timedelta(
-                            days=days
-                        )
-                        obj.end_time = appointment_date + timedelta(hours=2)
-                        obj.booking.appointment_date_time = (
-                                appointment_date + datetime.timedelta(days=days)
-                        )
-                        obj.booking.save()
-                        obj.save()
-                        index -= 1
-                if current_booking.bod.frequency.type == "once":
-                    appointment_date = datetime.datetime.strptime(
-                        appointment_date, "%Y-%m-%d %H:%M:%S"
-                    )
-                    schedule = Schedule.objects.filter(booking__in=all_booking_ids)
-                    for obj in schedule:
-                        obj.start_time = appointment_date
-                        obj.end_time = appointment_date + timedelta(hours=2)
-                        obj.booking.appointment_date_time = appointment_date
-                        obj.booking.save()
-                        obj.save()
-                if current_booking.bod.frequency.type == "biweekly":
-                    appointment_date = datetime.datetime.strptime(
-                        appointment_date, "%Y-%m-%d %H:%M:%S"
-                    )
-                    schedule = Schedule.objects.filter(booking__in=all_booking_ids)
-                    schedule_len = len(schedule)
-                    index = schedule_len
-                    for obj in schedule:
-                        days = 14 * (schedule_len - index)
-                        obj.start_time = appointment_date + datetime.timedelta(
-                            days=days
-                        )
-                        obj.end_time = appointment_date + timedelta(hours=2)
-                        obj.booking.appointment_date_time = (
-                                appointment_date + datetime.timedelta(days=days)
-                        )
-                        obj.booking.save()
-                        obj.save()
-                        index -= 1
-                if current_booking.bod.frequency.type == "monthly":
-                    appointment_date = datetime.datetime.strptime(
-                        appointment_date, "%Y-%m-%d %H:%M:%S"
-                    )
-                    schedule = Schedule.objects.filter(booking__in=all_booking_ids)
-                    date_list = list()
-                    date_list.append(appointment_date)
-                    for obj in schedule:
-                        obj.start_time = date_list[-1]
-                        obj.end_time = date_list[-1] + timedelta(hours=2)
-                        obj.booking.appointment_date_time = date_list[-1]
-                        obj.booking.save()
-                        obj.save()
-                        new_date = date_list[-1] + relativedelta(months=1)
-                        date_list.append(new_date)
-            else:
-                appointment_date = datetime.datetime.strptime(
-                    appointment_date, "%Y-%m-%d %H:%M:%S"
-                )
-                schedule = Schedule.objects.filter(booking=current_booking.id)
-                for obj in schedule:
-                    obj.start_time = appointment_date
-                    obj.end_time = appointment_date + timedelta(hours=2)
-                    obj.booking.appointment_date_time = appointment_date
-                    obj.booking.save()
-                    obj.save()
+            current_booking = Booking.objects.select_related("bod__frequency").get(id=data["id"])
+            appointment_date = datetime.datetime.strptime(data.get("time"), "%Y-%m-%d %H:%M:%S")
+            dry_run = str(data.get("dry_run", "")).lower() in ("1", "true", "on", "yes")
+            force = str(data.get("force", "")).lower() in ("1", "true", "on", "yes")
+            # Cleaner conflicts reject the reschedule unless it is forced, then they are only reported back.
+            result = reschedule_booking(
+                current_booking,
+                appointment_date,
+                whole_series=data.get("is_all") == "on",
+                dry_run=dry_run,
+                force=force,
+            )
+            if dry_run:
+                return self.send_success_response(message="Reschedule Preview", data=result)
+            if not result["applied"]:
+                return self.send_bad_request_response(message=describe_reschedule_conflicts(result["conflicts"]))
             BookingNotifications.objects.create(
                 bod=current_booking.bod,
                 title="Booking Rescheduled",
             )
             return self.send_success_response(
-                message="Booking Rescheduled Successfully"
+                message="Booking Rescheduled Successfully", data=result
             )
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
@@ -818,10 +796,10 @@ class BookingUpdateViewSet(BaseAPIView, ModelViewSet):
     @swagger_auto_schema(tags=["Booking Dispatch"])
     def list(self, request, *args, **kwargs):
         try:
-            booking = Booking.objects.filter().exclude(
+            booking = BookingListing.objects.exclude(
                 status__in=["cancelled", "completed"]
-            )
-            serializer = BookingSerializerList(booking, many=True)
+            ).order_by("booking")
+            serializer = BookingSerializerList(listed_bookings(booking), many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
             )
@@ -832,17 +810,40 @@ class BookingUpdateViewSet(BaseAPIView, ModelViewSet):
     def create(self, request, *args, **kwargs):
         try:
             data = request.data
-            booking = Booking.objects.filter(id=data["booking"]).first()
+            booking = Booking.objects.filter(id=data["booking"]).select_related("booking_in_schedule").first()
             if not booking:
                 return self.send_bad_request_response(message="Booking not exist")
-            serializer = DispatchBookingSerializer(
-                data=data, context={"request": request}
-            )
-            if serializer.is_valid(raise_exception=True):
-                serializer.save()
-                return self.send_success_response(
-                    message="Booking dispatched Successfully"
+            force = str(data.get("force", "")).lower() in ("1", "true", "on", "yes")
+            with transaction.atomic():
+                # Conflicts reject the dispatch unless it is forced, then they are only reported back. The
+                # cleaner stays locked until the dispatch is saved.
+                conflicts = check_dispatch(booking, int(data["service_provider"]))
+                if conflicts and not force:
+                    return self.send_bad_request_response(message=describe_conflicts(conflicts))
+                serializer = DispatchBookingSerializer(
+                    data=data, context={"request": request}
                 )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            return self.send_success_response(
+                message="Booking dispatched Successfully", data={"conflicts": conflicts}
+            )
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+    @swagger_auto_schema(tags=["Booking Dispatch"])
+    def available_cleaners(self, request, *args, **kwargs):
+        try:
+            booking = Booking.objects.filter(id=kwargs.get("pk")).select_related("booking_in_schedule").first()
+            if not booking:
+                return self.send_bad_request_response(message="Booking not exist")
+            start, end = booking_slot(booking)
+            cleaners = get_availability_index(start, end).free_cleaners(start, end, exclude_booking=booking.id)
+            profiles = UserProfile.objects.filter(user__in=cleaners).order_by("first_name", "last_name")
+            return self.send_success_response(
+                message="Available Cleaners",
+                data=list(profiles.values("user", "first_name", "last_name", "color")),
+            )
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
@@ -997,26 +998,141 @@ class BookingDashboardViewSet(BaseAPIView, ModelViewSet):
         try:
             start_date = request.GET.get("start_date")
             start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
-            data_list = []
-            for i in range(0, 7):
-                booking = Booking.objects.filter(
-                    status="scheduled",
-                    appointment_date_time__date__lte=start_date,
-                    appointment_date_time__date__gte=start_date,
-                )
-                serializer = BookingSerializerList(booking, many=True)
-                data_dict = {
+            calendar = get_calendar(
+                start_date, start_date + timedelta(days=6), status="scheduled"
+            )
+            # the calendar picks the bookings of each day, one serializer pass renders all of them
+            bookings = Booking.objects.filter(
+                id__in=[event["id"] for day in calendar for event in day["events"]]
+            )
+            serialized = {
+                booking["id"]: booking
+                for booking in BookingSerializerList(bookings, many=True).data
+            }
+            data_list = [
+                {
                     "name": "start_date",
-                    "value": start_date,
-                    "data": serializer.data,
+                    "value": day["date"],
+                    "data": [serialized[event["id"]] for event in day["events"] if event["id"] in serialized],
                 }
-                data_list.append(data_dict)
-                start_date = start_date + datetime.timedelta(days=1)
+                for day in calendar
+            ]
             return self.send_success_response(message="Booking Data", data=data_list)
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
 
+class BookingCalendarViewSet(BaseAPIView, ModelViewSet):
+    queryset = BookingListing.objects.all()
+    permission_classes = [IsAuthenticated]
+    calendar_views = {"day": 1, "week": 7}
+
+    @swagger_auto_schema(tags=["Booking Dashboard"])
+    def list(self, request, *args, **kwargs):
+        """
+        Compact booking events per local day. Takes start_date and either end_date or view (day, week or month,
+        default week), plus optional cleaner and status filters.
+        """
+        try:
+            start_date = datetime.datetime.strptime(request.GET.get("start_date"), "%Y-%m-%d").date()
+            end_date = request.GET.get("end_date")
+            view = request.GET.get("view", "week")
+            if end_date:
+                end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+            elif view == "month":
+                end_date = start_date + relativedelta(months=1) - timedelta(days=1)
+            elif view in self.calendar_views:
+                end_date = start_date + timedelta(days=self.calendar_views[view] - 1)
+            else:
+                return self.send_bad_request_response(message="view should be day, week or month")
+            if end_date < start_date or (end_date - start_date).days > 92:
+                return self.send_bad_request_response(message="Date range should be 1 to 93 days")
+            calendar = get_calendar(
+                start_date,
+                end_date,
+                cleaner=request.GET.get("cleaner"),
+                status=request.GET.get("status"),
+            )
+            return self.send_success_response(message="Booking Calendar", data=calendar)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+
+class DispatchOptimizerViewSet(BaseAPIView, ModelViewSet):
+    queryset = Booking.objects.all()
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=["Booking Dispatch"])
+    def list(self, request, *args, **kwargs):
+        """Proposed cleaner for every undispatched booking of `date` (YYYY-MM-DD), nothing is written."""
+        try:
+            date = datetime.datetime.strptime(request.GET.get("date"), "%Y-%m-%d").date()
+            return self.send_success_response(message="Dispatch Preview", data=plan_dispatch(date))
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+    @swagger_auto_schema(tags=["Booking Dispatch"])
+    def create(self, request, *args, **kwargs):
+        """
+        Dispatches `date`. Takes the previewed `assignments` ([{"booking_id", "cleaner_id"}]) or, without them,
+        the plan as it stands now.
+        """
+        try:
+            data = request.data
+            date = datetime.datetime.strptime(data.get("date"), "%Y-%m-%d").date()
+            assignments = data.get("assignments")
+            if assignments is not None:
+                assignments = [(assignment["booking_id"], assignment["cleaner_id"]) for assignment in assignments]
+            result = commit_dispatch(date, assignments)
+            return self.send_success_response(message="Bookings dispatched Successfully", data=result)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+
+class ProximityViewSet(BaseAPIView, ModelViewSet):
+    queryset = Booking.objects.all()
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=["Booking Dispatch"])
+    def nearest_cleaners(self, request, *args, **kwargs):
+        """Nearest cleaners free for the booking's slot. Takes an optional limit (default 5)."""
+        try:
+            booking = Booking.objects.filter(id=kwargs.get("pk")).select_related("booking_in_schedule").first()
+            if not booking:
+                return self.send_bad_request_response(message="Booking not exist")
+            cleaners = nearest_available_cleaners(booking, limit=int(request.GET.get("limit", 5)))
+            return self.send_success_response(message="Nearest Cleaners", data=cleaners)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+    @swagger_auto_schema(tags=["Booking Dispatch"])
+    def bookings_within_radius(self, request, *args, **kwargs):
+        """
+        Bookings within radius_km (default 10) of latitude/longitude, nearest first. Optional start_date and
+        end_date (YYYY-MM-DD, inclusive) and status.
+        """
+        try:
+            latitude, longitude = parse_point(request.GET.get("latitude"), request.GET.get("longitude"))
+            if math.isnan(latitude):
+                return self.send_bad_request_response(message="latitude and longitude are required")
+            start_date, end_date = request.GET.get("start_date"), request.GET.get("end_date")
+            if start_date:
+                start_date = timezone.make_aware(datetime.datetime.strptime(start_date, "%Y-%m-%d"))
+            if end_date:
+                end_date = timezone.make_aware(datetime.datetime.strptime(end_date, "%Y-%m-%d")) + timedelta(days=1)
+            bookings = bookings_within_radius(
+                latitude,
+                longitude,
+                float(request.GET.get("radius_km", 10)),
+                start=start_date,
+                end=end_date,
+                status=request.GET.get("status"),
+            )
+            return self.send_success_response(message="Bookings Within Radius", data=bookings)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+
 class ChargeViewSet(BaseAPIView, ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = ChargeNowSerializer
@@ -1090,75 +1206,24 @@ class DashboardAPIsViewSet(BaseAPIView, ModelViewSet):
     @swagger_auto_schema(tags=["Dashboard Analytics"])
     def list(self, request, *args, **kwargs):
         try:
-            customer_filter = dashboard_filter_data(request.GET.get("customer_filter") or None)
-            booking_filter = dashboard_filter_data(request.GET.get("booking_filter") or None)
-            amount_filter = dashboard_filter_data(request.GET.get("amount_filter") or None)
-            hours_filter = dashboard_filter_data(request.GET.get("hours_filter") or None)
-            page_view_filter = dashboard_filter_data(request.GET.get("page_view_filter") or None)
-            service_filter = dashboard_filter_data(request.GET.get("service_filter") or None)
-            cleaner_filter = dashboard_filter_data(request.GET.get("cleaner_filter") or None)
-            data_list = []
-            service_count = Service.objects.filter()
-            if service_filter[0]:
-                service_count = service_count.filter(created_at__gte=service_filter[1],
-                                                     created_at__lte=service_filter[0])
-            data_dict = {
-                "name": "Services Count",
-                "value": service_count.count(),
+            filters = {
+                "services": "service_filter",
+                "customers": "customer_filter",
+                "cleaners": "cleaner_filter",
+                "page_views": "page_view_filter",
+                "bookings": "booking_filter",
+                "gross": "amount_filter",
+                "hours": "hours_filter",
             }
-            data_list.append(data_dict)
-            customer_count = UserProfile.objects.filter(role="Customer")
-            if customer_filter[0]:
-                customer_count = customer_count.filter(created_at__gte=customer_filter[1],
-                                                       created_at__lte=customer_filter[0])
-            data_dict = {
-                "name": "Customer Count",
-                "value": customer_count.count(),
-            }
-            data_list.append(data_dict)
-            cleaner_count = UserProfile.objects.filter(role="Cleaner")
-            if customer_filter[0]:
-                cleaner_count = cleaner_count.filter(created_at__gte=cleaner_filter[1],
-                                                     created_at__lte=cleaner_filter[0])
-            data_dict = {
-                "name": "Cleaner Count",
-                "value": cleaner_count.count(),
-            }
-            data_list.append(data_dict)
-            page_views = PageViewsCount.objects.filter()
-            if page_view_filter[0]:
-                page_views = page_views.filter(created_at__gte=page_view_filter[1],
-                                               created_at__lte=page_view_filter[0])
-            data_dict = {
-                "name": "Page Views",
-                "value": page_views.count(),
-            }
-            data_list.append(data_dict)
-            booking_count = Booking.objects.filter()
-            if booking_filter[0]:
-                booking_count = booking_count.filter(created_at__gte=booking_filter[1],
-                                                     created_at__lte=booking_filter[0])
-            data_dict = {
-                "name": "Booking Count",
-                "value": booking_count.count(),
-            }
-            data_list.append(data_dict)
-            total_amount = PaymentSale.objects.filter()
-            if amount_filter[0]:
-                total_amount = total_amount.filter(created_at__gte=amount_filter[1],
-                                                   created_at__lte=amount_filter[0])
-            data_dict = {
-                "name": "Total Gross",
-                "value": total_amount.filter().aggregate(Sum("amount"))["amount__sum"],
-            }
-            data_list.append(data_dict)
-            total_hours = BookingOrderDetails.objects.filter()
-            if hours_filter[0]:
-                total_hours = total_hours.filter(created_at__gte=hours_filter[1],
-                                                 created_at__lte=hours_filter[0])
-            data_dict = {"name": "Clocked Hours",
-                         "value": total_hours.filter().aggregate(Sum("total_hours"))["total_hours__sum"]}
-            data_list.append(data_dict)
+            windows = {}
+            for metric, param in filters.items():
+                window_start = dashboard_filter_data(request.GET.get(param) or None)[1]
+                windows[metric] = window_start.date() if window_start else None
+            totals = get_metric_totals(windows)
+            data_list = [
+                {"name": name, "value": totals[metric]}
+                for metric, name in DailyMetrics.metric_choices
+            ]
             data_dict = {"name": "Hot Leads", "value": 4}
             data_list.append(data_dict)
             return self.send_success_response(message="Dashboard Data", data=data_list)
@@ -1217,27 +1282,23 @@ class BookingReportsViewSet(BaseAPIView, ModelViewSet):
             if to_date:
                 to_date = parser.parse(to_date)
             booking_status = request.GET.get("booking_status")
-            sale = (
-                Sale.objects.filter()
-                .exclude(status="completed")
-                .values_list("booking__id", flat=True)
+            bookings = (
+                BookingListing.objects.filter(
+                    status__iexact=booking_status, sale_status__isnull=False
+                )
+                .exclude(sale_status="completed")
+                .order_by("-booking")
             )
-            bookings = Booking.objects.filter(
-                status__iexact=booking_status, id__in=sale
-            ).order_by("-id")
             if date_filter:
                 bookings = booking_filters(bookings, date_filter, to_date)
-            if request.GET.get("page"):
-                paginator = CustomPagination()
+            if CustomPagination.is_requested(request):
+                paginator = CustomPagination(cursor_ordering=("-booking_created_at", "-pk"))
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
-                serializer = BookingSerializerList(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
-            serializer = BookingSerializerList(bookings, many=True)
+                serializer = BookingSerializerList(listed_bookings(query_set), many=True)
+                return paginator.get_response(serializer.data)
+            serializer = BookingSerializerList(listed_bookings(bookings), many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
             )
@@ -1281,22 +1342,19 @@ class UserBookingView(BaseAPIView, ModelViewSet):
             to_date = request.GET.get("to_date")
             if to_date:
                 to_date = parser.parse(to_date)
-            bookings = Booking.objects.filter(bod__user=request.user, status__iexact=booking_status)
+            bookings = BookingListing.objects.filter(user=request.user, status__iexact=booking_status)
             bookings = booking_filters(bookings, date_filter, to_date)
-            if request.GET.get("page"):
+            if CustomPagination.is_requested(request):
                 paginator = CustomPagination()
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
-                serializer = BookingSerializerList(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
+                serializer = BookingSerializerList(listed_bookings(query_set), many=True)
+                return paginator.get_response(serializer.data)
             else:
-                bookings = Booking.objects.filter(bod__user=request.user)
+                bookings = BookingListing.objects.filter(user=request.user).order_by("booking")
 
-            serializer = BookingSerializerList(bookings, many=True)
+            serializer = BookingSerializerList(listed_bookings(bookings), many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
             )
@@ -1316,16 +1374,13 @@ class UserAdminBookingView(BaseAPIView, ModelViewSet):
             bookings = Booking.objects.filter(
                 bod__user__id=user, status__in=["scheduled", "dispatched"]
             )
-            if request.GET.get("page"):
+            if CustomPagination.is_requested(request):
                 paginator = CustomPagination()
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
                 serializer = BookingSerializerList(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
+                return paginator.get_response(serializer.data)
             serializer = BookingSerializerList(bookings, many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
@@ -1342,24 +1397,22 @@ class CleanerBookingView(BaseAPIView, ModelViewSet):
     @swagger_auto_schema(tags=["Cleaner Side"])
     def list(self, request, *args, **kwargs):
         try:
+            # every cleaner dispatched on a booking sees it, not only the one the listing shows
             appointments = DispatchedAppointment.objects.filter(
-                service_provider=request.user
-            ).values_list("booking__id", flat=True)
-            bookings = Booking.objects.filter(
-                status__in=["scheduled", "dispatched"], id__in=appointments
+                service_provider=request.user, status="Dispatched"
+            ).values("booking")
+            bookings = BookingListing.objects.filter(
+                status__in=["scheduled", "dispatched"], booking__in=appointments
             )
             bookings = cleaner_booking_filter(bookings)
-            if request.GET.get("page"):
+            if CustomPagination.is_requested(request):
                 paginator = CustomPagination()
                 paginator.page_size = request.GET.get("per_page")
                 paginator.page = request.GET.get("page")
                 query_set = paginator.paginate_queryset(bookings, request)
-                serializer = BookingSerializerListCleaner(query_set, many=True)
-                if paginator.page.paginator.num_pages == int(request.GET.get("page")):
-                    return paginator.get_last_page_data(serializer.data)
-                else:
-                    return paginator.get_paginated_response(serializer.data)
-            serializer = BookingSerializerListCleaner(bookings, many=True)
+                serializer = BookingSerializerListCleaner(listed_bookings(query_set), many=True)
+                return paginator.get_response(serializer.data)
+            serializer = BookingSerializerListCleaner(listed_bookings(bookings), many=True)
             return self.send_success_response(
                 message="Booking Data", data=serializer.data
             )
@@ -1380,10 +1433,11 @@ class PayrollViewSet(BaseAPIView, ModelViewSet):
             service_provider = request.GET.get("service_provider" or None)
             payroll = Payroll.objects.filter()
             if start_date and end_date:
-                start_date = parser.parse(start_date)
-                end_date = parser.parse(end_date)
+                start_date = parser.parse(start_date).date()
+                end_date = parser.parse(end_date).date()
+                # pay periods overlapping the range
                 payroll = payroll.filter(
-                    created_at__range=[start_date, end_date]
+                    period_start__lte=end_date, period_end__gte=start_date
                 )
             if service_provider:
                 payroll = payroll.filter(sp__id=service_provider)
@@ -1459,11 +1513,12 @@ class ChargeTipViewSet(BaseAPIView, ModelViewSet):
                 customer=token.stripe_customer,
                 description="Tip",
             )
-            ChargeTip.objects.create(
+            tip = ChargeTip.objects.create(
                 booking=booking,
                 tip_amount=request.data.get("amount"),
                 charge_id=charge.id,
             )
+            accrue_tip(tip)
             return self.send_success_response(message="Success! Tip charged.")
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
@@ -1489,6 +1544,15 @@ class CancelBookingView(BaseAPIView, ModelViewSet):
             booking.save()
             if request.data.get("cancel_all", None) and request.data.get("cancel_all", None) == "True":
                 Booking.objects.filter(bod=booking.bod).update(is_cancelled=True, status="cancelled")
+                # bulk writes send no signals
+                bump_availability_version(
+                    Schedule.objects.filter(booking__bod=booking.bod).values_list("start_time", "end_time")
+                )
+                # stops the horizon job from materializing the rest of the series
+                BookingOrderDetails.objects.filter(id=booking.bod_id).update(status="cancelled")
+                schedule_listing_refresh(
+                    Booking.objects.filter(bod=booking.bod).values_list("id", flat=True)
+                )
             cancel_booking(data=request.data, booking=booking)
             return self.send_success_response(message="Success! Booking cancelled.")
         except Exception as e:
@@ -1556,8 +1620,17 @@ class MarkBookingCompleteView(BaseAPIView, ModelViewSet):
                 return self.send_bad_request_response(message="Booking already completed.")
             if booking.is_cancelled:
                 return self.send_bad_request_response(message="Booking already cancelled.")
-            booking.status = "complete"
-            booking.save()
+            with transaction.atomic():
+                # only the request that moves the booking to complete accrues it
+                completed = Booking.objects.filter(id=booking.id, is_cancelled=False).exclude(
+                    status="complete"
+                ).update(status="complete", updated_at=timezone.now())
+                if completed != 1:
+                    return self.send_bad_request_response(message="Booking already completed.")
+                booking.status = "complete"
+                accrue_booking(booking)
+                # bulk writes send no signals, completed bookings stay in the availability index
+                schedule_listing_refresh([booking.id])
             complete_booking(data, booking.bod)
             return self.send_success_response(message="Success! Booking completed.")
         except Exception as e:
@@ -1640,35 +1713,15 @@ class PayrollCsvViewSet(BaseAPIView, ModelViewSet):
             service_provider = request.GET.get("service_provider" or None)
             payroll = Payroll.objects.filter()
             if start_date and end_date:
-                start_date = parser.parse(start_date)
-                end_date = parser.parse(end_date)
+                start_date = parser.parse(start_date).date()
+                end_date = parser.parse(end_date).date()
+                # pay periods overlapping the range
                 payroll = payroll.filter(
-                    created_at__range=[start_date, end_date]
+                    period_start__lte=end_date, period_end__gte=start_date
                 )
             if service_provider:
                 payroll = payroll.filter(sp__id=service_provider)
-            response = HttpResponse(
-                content_type='text/csv',
-                headers={'Content-Disposition': 'attachment; filename="somefilename.csv"'},
-            )
-            write = csv.writer(response)
-            serializer = PayrollSerializer(payroll, many=True)
-            write.writerow(['service provider', 'hourly wage', 'hours worked', 'amount', 'paid', 'total tips'])
-            for i in range(len(serializer.data)):
-                write.writerow(
-                    [serializer.data[i]['sp']['user_profile']['first_name'] + " " +
-                     serializer.data[i]['sp']['user_profile']["last_name"],
-                     serializer.data[i]['hourly_wage'],
-                     serializer.data[i]['total_hours'],
-                     serializer.data[i]['total_amount'],
-                     serializer.data[i]['paid_amount'],
-                     serializer.data[i]['tip_amount']
-                     ])
-            total_amount = payroll.aggregate(Sum('total_amount'))['total_amount__sum']
-            total_paid = payroll.aggregate(Sum('paid_amount'))['paid_amount__sum']
-            write.writerow(['total_amount', total_amount])
-            write.writerow(['total_paid', total_paid])
-            return response
+            return csv_response(payroll_lines(payroll), "somefilename.csv")
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
@@ -1681,30 +1734,7 @@ class CustomerCsvViewSet(BaseAPIView, ModelViewSet):
     @swagger_auto_schema(tags=["Customer CSV"])
     def list(self, request, *args, **kwargs):
         try:
-            user_ids = UserProfile.objects.filter(role="Customer").values_list('user__id', flat=True)
-            user = User.objects.filter(id__in=user_ids)
-            response = HttpResponse(
-                content_type='text/csv',
-                headers={'Content-Disposition': 'attachment; filename="somefilename.csv"'},
-            )
-            write = csv.writer(response)
-            serializer = UserListSerializer(user, many=True)
-            write.writerow(['email', 'role', 'first_name',
-                            'last_name', 'language', 'address',
-                            'city', 'state', 'zip_code', ])
-            for i in range(len(serializer.data)):
-                write.writerow(
-                    [serializer.data[i]['email'] + " " +
-                     serializer.data[i]['user_profile']["role"],
-                     serializer.data[i]['user_profile']["first_name"],
-                     serializer.data[i]['user_profile']["last_name"],
-                     serializer.data[i]['user_profile']["language"],
-                     serializer.data[i]['user_profile']["address"],
-                     serializer.data[i]['user_profile']['city'],
-                     serializer.data[i]['user_profile']['state'],
-                     serializer.data[i]['user_profile']['zip_code'],
-                     ])
-            return response
+            return csv_response(customer_lines(), "somefilename.csv")
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
@@ -0,0 +1,49 @@
+"""Serializers whose method fields are resolved for the whole page at once instead of once per row."""
+from collections import defaultdict
+
+from django.db import models
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers
+
+
+def group_by(objects, attribute):
+    """Groups objects by an attribute, e.g.: group_by(sales, "booking_id") -> {booking_id: [sale, ...]}."""
+    groups = defaultdict(list)
+    for obj in objects:
+        groups[getattr(obj, attribute)].append(obj)
+    return groups
+
+
+class BatchListSerializer(serializers.ListSerializer):
+    """Runs the child's batch loaders once for every instance on the page, then serializes them."""
+
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.load_batches(instances)
+        return [self.child.to_representation(item) for item in instances]
+
+
+class BatchSerializerMixin:
+    """
+    Method fields read their related data with self.batch(name, obj) instead of querying per row.
+    batch_loaders maps a name to a function that takes the instances and returns a dict keyed by instance pk.
+    batch_prefetch lists prefetch_related lookups for nested serializers. Set Meta.list_serializer_class to
+    BatchListSerializer so many=True loads them for the whole page. Serializing a single instance loads the batches
+    for that instance only.
+    """
+
+    batch_loaders = {}
+    batch_prefetch = ()
+
+    def load_batches(self, instances):
+        if self.batch_prefetch:
+            prefetch_related_objects(instances, *self.batch_prefetch)
+        self._batch_ids = {instance.pk for instance in instances}
+        self._batches = {
+            name: loader(instances) for name, loader in self.batch_loaders.items()
+        }
+
+    def batch(self, name, obj, default=None):
+        if obj.pk not in getattr(self, "_batch_ids", ()):
+            self.load_batches([obj])
+        return self._batches[name].get(obj.pk, default)
@@ -0,0 +1,306 @@
+"""
+Channel layer on the PostgreSQL database the project already uses, so chat groups work across ASGI processes.
+Messages are buffered in the ChannelLayerMessage table until received or expired, and group membership lives in
+ChannelLayerGroup. Every insert NOTIFYs the receiving channel's name on one LISTEN channel. Each process keeps a
+single listening connection that wakes up the matching receive() calls. When that connection drops it is
+reconnected and every receive() looks again, since notifications sent meanwhile are lost. Receivers otherwise only
+look every poll_interval seconds as a slow fallback, so idle sockets cost next to no queries. Enable it with:
+
+    CHANNEL_LAYER_BACKEND=cleany.channel_layers.PostgresChannelLayer
+"""
+import asyncio
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+import psycopg2
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.conf import settings
+from psycopg2.pool import ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+def _connection_kwargs(alias):
+    database = settings.DATABASES[alias]
+    kwargs = {
+        "dbname": database["NAME"],
+        "user": database.get("USER"),
+        "password": database.get("PASSWORD"),
+        "host": database.get("HOST"),
+        "port": database.get("PORT"),
+    }
+    kwargs.update(database.get("OPTIONS", {}))
+    return {key: value for key, value in kwargs.items() if value}
+
+
+class _Listener:
+    """
+    One LISTEN connection per event loop, waking the receive() calls of the notified channels. The connection is
+    opened off the loop, and so is a dropped one, every retry_interval seconds until it succeeds. Every waiter is
+    woken once it is attached, since nothing was heard before.
+    """
+
+    def __init__(self, connection_kwargs, notify_channel, loop, retry_interval=1.0):
+        self.loop = loop
+        self.connection_kwargs = connection_kwargs
+        self.notify_channel = notify_channel
+        self.retry_interval = retry_interval
+        self.waiters = {}  # channel: asyncio.Event
+        self.connection = None
+        self.closed = False
+        self._reconnect()
+
+    def _open(self):
+        connection = psycopg2.connect(**self.connection_kwargs)
+        connection.set_session(autocommit=True)
+        with connection.cursor() as cursor:
+            cursor.execute("LISTEN %s" % self.notify_channel)
+        return connection
+
+    def _attach(self, connection):
+        self.connection = connection
+        self.fileno = connection.fileno()
+        self.loop.add_reader(self.fileno, self._on_readable)
+
+    def _detach(self):
+        self.loop.remove_reader(self.fileno)
+        self.connection.close()
+        self.connection = None
+
+    def _on_readable(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.warning("Channel layer LISTEN connection lost, reconnecting")
+            self._detach()
+            self._reconnect()
+            return
+        while self.connection.notifies:
+            event = self.waiters.get(self.connection.notifies.pop(0).payload)
+            if event:
+                event.set()
+
+    def _reconnect(self):
+        if not self.closed:
+            self.loop.run_in_executor(None, self._open).add_done_callback(self._on_reconnected)
+
+    def _on_reconnected(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self.loop.call_later(self.retry_interval, self._reconnect)
+            return
+        if self.closed:
+            future.result().close()
+            return
+        self._attach(future.result())
+        for event in self.waiters.values():
+            event.set()
+
+    def watch(self, channel):
+        return self.waiters.setdefault(channel, asyncio.Event())
+
+    def unwatch(self, channel):
+        self.waiters.pop(channel, None)
+
+    def close(self):
+        self.closed = True
+        if self.connection is not None:
+            self._detach()
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+            self,
+            expiry=60,
+            group_expiry=86400,
+            capacity=100,
+            channel_capacity=None,
+            database="default",
+            notify_channel="channel_layer",
+            poll_interval=30.0,
+            pool_size=5,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.database = database
+        self.notify_channel = notify_channel
+        self.poll_interval = poll_interval
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # as many threads as pooled connections, so a query never waits for the pool
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="channel-layer")
+        self._listeners = {}
+        from booking.models import ChannelLayerGroup, ChannelLayerMessage
+
+        self.message_table = ChannelLayerMessage._meta.db_table
+        self.group_table = ChannelLayerGroup._meta.db_table
+
+    # Database access, run on the layer's executor so the event loop never waits on a query.
+
+    def _execute(self, sql, params=(), fetch=False):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # minconn == maxconn, psycopg2 closes connections above minconn when they are put back
+                    self._pool = ThreadedConnectionPool(
+                        self.pool_size, self.pool_size, **_connection_kwargs(self.database)
+                    )
+        connection = self._pool.getconn()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall() if fetch else cursor.rowcount
+        except psycopg2.Error:
+            self._pool.putconn(connection, close=True)
+            connection = None
+            raise
+        finally:
+            if connection is not None:
+                self._pool.putconn(connection)
+
+    async def _run(self, sql, params=(), fetch=False):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, sql, params, fetch)
+
+    def _get_listener(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._listeners:
+            self._listeners[loop] = _Listener(_connection_kwargs(self.database), self.notify_channel, loop)
+        return self._listeners[loop]
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        # Inserts only below capacity and notifies in the same statement.
+        sent = await self._run(
+            """
+            WITH inserted AS (
+                INSERT INTO {table} (channel, message, expires_at)
+                SELECT %(channel)s, %(message)s, now() + %(expiry)s * interval '1 second'
+                WHERE (
+                    SELECT count(*) FROM {table} WHERE channel = %(channel)s AND expires_at > now()
+                ) < %(capacity)s
+                RETURNING channel
+            )
+            SELECT pg_notify(%(notify)s, channel) FROM inserted
+            """.format(table=self.message_table),
+            {
+                "channel": channel,
+                "message": msgpack.packb(message, use_bin_type=True),
+                "expiry": self.expiry,
+                "capacity": self.get_capacity(channel),
+                "notify": self.notify_channel,
+            },
+            fetch=True,
+        )
+        if not sent:
+            raise ChannelFull(channel)
+
+    def _pop_sql(self):
+        return """
+            DELETE FROM {table} WHERE id = (
+                SELECT id FROM {table} WHERE channel = %s AND expires_at > now()
+                ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+            )
+            RETURNING message
+        """.format(table=self.message_table)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        listener = self._get_listener()
+        # Watch before the first read, so a message inserted in between still wakes us up.
+        event = listener.watch(channel)
+        try:
+            while True:
+                event.clear()
+                rows = await self._run(self._pop_sql(), (channel,), fetch=True)
+                if rows:
+                    return msgpack.unpackb(bytes(rows[0][0]), raw=False)
+                try:
+                    await asyncio.wait_for(event.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            listener.unwatch(channel)
+
+    async def new_channel(self, prefix="specific"):
+        return "%s.postgres!%s" % (prefix, uuid.uuid4().hex)
+
+    async def flush(self):
+        await self._run("DELETE FROM {}".format(self.message_table))
+        await self._run("DELETE FROM {}".format(self.group_table))
+
+    async def close(self):
+        for listener in self._listeners.values():
+            listener.close()
+        self._listeners = {}
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        await self._run(
+            """
+            INSERT INTO {table} ("group", channel, expires_at)
+            VALUES (%(group)s, %(channel)s, now() + %(expiry)s * interval '1 second')
+            ON CONFLICT ("group", channel) DO UPDATE SET expires_at = EXCLUDED.expires_at
+            """.format(table=self.group_table),
+            {"group": group, "channel": channel, "expiry": self.group_expiry},
+        )
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        await self._run(
+            'DELETE FROM {table} WHERE "group" = %s AND channel = %s'.format(table=self.group_table),
+            (group, channel),
+        )
+
+    async def group_send(self, group, message):
+        """Fans the message out to every member in one statement. Members at capacity are skipped."""
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        await self._run(
+            """
+            WITH members AS (
+                SELECT g.channel FROM {groups} g
+                WHERE g."group" = %(group)s AND g.expires_at > now() AND (
+                    SELECT count(*) FROM {table} m WHERE m.channel = g.channel AND m.expires_at > now()
+                ) < %(capacity)s
+            ), inserted AS (
+                INSERT INTO {table} (channel, message, expires_at)
+                SELECT channel, %(message)s, now() + %(expiry)s * interval '1 second' FROM members
+                RETURNING channel
+            )
+            SELECT pg_notify(%(notify)s, channel) FROM inserted
+            """.format(table=self.message_table, groups=self.group_table),
+            {
+                "group": group,
+                "message": msgpack.packb(message, use_bin_type=True),
+                "expiry": self.expiry,
+                "capacity": self.capacity,
+                "notify": self.notify_channel,
+            },
+            fetch=True,
+        )
+
+    # Housekeeping
+
+    def prune(self):
+        """Deletes expired messages and group memberships. Returns how many rows went."""
+        deleted = self._execute("DELETE FROM {} WHERE expires_at <= now()".format(self.message_table))
+        return deleted + self._execute("DELETE FROM {} WHERE expires_at <= now()".format(self.group_table))
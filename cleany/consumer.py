@@ -4,43 +4,54 @@ import json
 from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 
-from booking.models import CustomerSupportChat, CustomerSupportCollection, DispatchedAppointment
-from booking.utils import push_notifications
+from booking.models import Booking, CustomerSupportChat, CustomerSupportCollection, DispatchedAppointment
+from booking.push import push_to_tokens
+from service_provider.live import cleaner_location_group, location_event
+from service_provider.tracking import get_latest_locations
 from user_module.models import User
 
 
+CHAT_HISTORY_SIZE = 50
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Chat of a booking. On connect the last CHAT_HISTORY_SIZE messages are sent in one "history" frame, older pages
+    are requested with {"type": "load_more", "cursor": ...}. No history is kept on the connection.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.booking_id = None
         self.booking_group_name = None
         self.sender = None
-        self.chat_messages = []
 
     async def connect(self):
         self.booking_id = self.scope['url_route']['kwargs']['booking_id']
         self.booking_group_name = 'chat_%s' % self.booking_id
         self.sender = self.scope['user']
-        await self.chat_with_gpt()
         # Join booking group
         await self.channel_layer.group_add(
             self.booking_group_name,
             self.channel_name
         )
-        messages = await self.get_chat_messages()
-        for message in messages:
-            self.chat_messages.append({
-                'message': message['message'],
-                "user": message['user__id'],
-                "role": message['user__user_in_profile__role'],
-                "created_at": str(message['created_at'].strftime("%Y-%m-%d %H:%M:%S")),
-            })
-
         await self.accept()
-        if self.chat_messages:
-            for message in self.chat_messages:
-                await self.send(text_data=json.dumps(message))
+        await self.send_history()
+
+    async def send_history(self, cursor=None):
+        try:
+            messages, next_cursor = await self.get_chat_messages(cursor)
+        except (KeyError, TypeError, ValueError):
+            await self.send(text_data=json.dumps({"type": "error", "message": "Invalid cursor"}))
+            return
+        await self.send(text_data=json.dumps({
+            "type": "history",
+            "messages": messages,
+            "cursor": next_cursor,
+        }))
 
     async def disconnect(self, close_code):
         # Leave booking group
@@ -53,6 +64,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data=None, bytes_data=None):
         text_data_json = json.loads(text_data)
+        if text_data_json.get("type") == "load_more":
+            await self.send_history(text_data_json.get("cursor"))
+            return
         message = text_data_json['message']
 
         # Save chat message to database
@@ -68,11 +82,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }
         )
         await self.send_notification_to_users(message)
-        self.chat_messages.append({
-            'sender': self.sender.id,
-            'message': message,
-            "role": self.sender.user_in_profile.role
-        })
 
     async def chat_message(self, event):
         sender = event['sender']
@@ -102,31 +111,114 @@ class ChatConsumer(AsyncWebsocketConsumer):
         return chat_message
 
     @database_sync_to_async
-    def get_chat_messages(self):
-        collection = CustomerSupportCollection.objects.filter(booking__id=self.booking_id).first()
-        return list(CustomerSupportChat.objects.select_related("user").filter(collection=collection
-                                                                              ).order_by('created_at'
-                                                                                         ).values("message",
-                                                                                                  "user__id",
-                                                                                                  "user__user_in_profile__role",
-                                                                                                  "created_at"
-                                                                                                  )
-                    )
+    def get_chat_messages(self, cursor=None):
+        """
+        One page of messages older than cursor (the newest page without one), oldest first. Returns the page and
+        the cursor of the page before it, or None when there is none.
+        """
+        messages = CustomerSupportChat.objects.filter(collection__booking__id=self.booking_id)
+        if cursor:
+            created_at = parse_datetime(cursor["created_at"])
+            if created_at is None:
+                raise ValueError("Invalid cursor")
+            messages = messages.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=cursor["id"])
+            )
+        page = list(
+            messages.order_by("-created_at", "-id").values(
+                "id", "message", "user__id", "user__user_in_profile__role", "created_at"
+            )[:CHAT_HISTORY_SIZE + 1]
+        )
+        has_more = len(page) > CHAT_HISTORY_SIZE
+        page = page[:CHAT_HISTORY_SIZE][::-1]
+        next_cursor = None
+        if has_more:
+            next_cursor = {"created_at": page[0]["created_at"].isoformat(), "id": page[0]["id"]}
+        return [
+            {
+                "id": message["id"],
+                "message": message["message"],
+                "user": message["user__id"],
+                "role": message["user__user_in_profile__role"],
+                "created_at": str(message["created_at"].strftime("%Y-%m-%d %H:%M:%S")),
+            }
+            for message in page
+        ], next_cursor
 
     @database_sync_to_async
     def send_notification_to_users(self, event):
         try:
             message_title = "New message"
+            data = {"booking_id": self.booking_id}
             if self.sender.user_in_profile.role == 'Customer':
-                dispatch = DispatchedAppointment.objects.filter(booking__id=self.booking_id).first()
-                if not dispatch:
-                    return
-                data = {"booking_id": self.booking_id}
-                push_notifications(dispatch.service_provider, message_title, event, data=data)
+                tokens = DispatchedAppointment.objects.filter(booking__id=self.booking_id).values_list(
+                    "service_provider__device_token", flat=True
+                )
             else:
-                from booking.models import Booking
-                booking = Booking.objects.get(id=self.booking_id)
-                data = {"booking_id": self.booking_id}
-                push_notifications(booking.bod.user, message_title, event, data)
+                tokens = Booking.objects.filter(id=self.booking_id).values_list("bod__user__device_token", flat=True)
+            # only enqueues, delivery happens on the push worker pool
+            push_to_tokens(list(tokens), message_title, event, data)
         except Exception as e:  # pragma: no cover
             pass
+
+
+class CleanerLocationConsumer(AsyncWebsocketConsumer):
+    """
+    Live positions of the cleaners dispatched to a booking, for its customer and the office. The latest fix of each
+    cleaner is sent on connect as one "locations" frame, then every throttled update as a "location" frame.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.booking_id = None
+        self.groups_joined = []
+
+    async def connect(self):
+        self.booking_id = self.scope['url_route']['kwargs']['booking_id']
+        cleaners = await self.get_followed_cleaners()
+        if cleaners is None:
+            await self.close()
+            return
+        self.groups_joined = [cleaner_location_group(self.booking_id)]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+        locations = await database_sync_to_async(get_latest_locations)(self.booking_id)
+        await self.send(text_data=json.dumps({
+            "type": "locations",
+            "locations": [location_event(location["cleaner_id"], location) for location in locations],
+        }))
+
+    async def disconnect(self, close_code):
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def location_update(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "location",
+            "cleaner_id": event["cleaner_id"],
+            "latitude": event["latitude"],
+            "longitude": event["longitude"],
+            "recorded_at": event["recorded_at"],
+        }))
+
+    @database_sync_to_async
+    def get_followed_cleaners(self):
+        """Ids of the cleaners dispatched to the booking, or None when the user may not follow them."""
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            return None
+        booking = Booking.objects.filter(id=self.booking_id).values_list("bod__user", flat=True)
+        if not booking:
+            return None
+        cleaners = list(
+            DispatchedAppointment.objects.filter(booking__id=self.booking_id, status="Dispatched").values_list(
+                "service_provider", flat=True
+            )
+        )
+        profile = getattr(user, "user_in_profile", None)
+        if user.id != booking[0] and user.id not in cleaners and (
+                not profile or profile.role not in ("Admin", "Manager")
+        ):
+            return None
+        return cleaners
@@ -1,5 +1,8 @@
-from asgiref.sync import sync_to_async
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from channels.db import database_sync_to_async
+
+from user_module.principal import CachedJWTAuthentication
+
+authentication = CachedJWTAuthentication()
 
 
 class JWTAuthMiddleware:
@@ -11,9 +14,8 @@ class JWTAuthMiddleware:
         if b'authorization' in headers:
             try:
                 token = headers[b'authorization'].decode()
-                validated_token = JWTAuthentication().get_validated_token(token)
-                user = await sync_to_async(JWTAuthentication().get_user)(validated_token)
-                scope['user'] = user
+                validated_token = authentication.get_validated_token(token)
+                scope['user'] = await database_sync_to_async(authentication.get_user)(validated_token)
             except Exception as e:
                 pass
         return await self.app(scope, receive, send)
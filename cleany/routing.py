@@ -1,8 +1,9 @@
 from django.urls import re_path, path
 from django_private_chat2 import consumers
 
-from cleany.consumer import ChatConsumer
+from cleany.consumer import ChatConsumer, CleanerLocationConsumer
 
 websocket_urlpatterns = [
     path('ws/chat/<int:booking_id>', ChatConsumer.as_asgi()),
+    path('ws/location/<int:booking_id>', CleanerLocationConsumer.as_asgi()),
 ]
\ No newline at end of file
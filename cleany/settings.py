@@ -89,7 +89,7 @@ CORS_ALLOW_METHODS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "user_module.principal.CachedJWTAuthentication",
     ]
 }
 
@@ -159,6 +159,22 @@ DATABASES = {
     },
 }
 
+# Shared by every web, websocket and clock process, so an invalidation in one reaches all of them (cleaner
+# availability, calendar days). The table of the database cache is created by the user_module migrations.
+# "principals" holds the authenticated users (see user_module.principal), looked up on every request. It is per process
+# by default, so a lookup costs no database round trip, and other processes see a user's changes once their
+# PRINCIPAL_CACHE_SECONDS run out. Point PRINCIPAL_CACHE_BACKEND at memcached or Redis to share it instead.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "cleany_cache"),
+    },
+    "principals": {
+        "BACKEND": os.environ.get("PRINCIPAL_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("PRINCIPAL_CACHE_LOCATION", "principals"),
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -214,16 +230,35 @@ EMAIL_HOST_PASSWORD = os.environ['EMAIL_HOST_PASSWORD']
 DEFAULT_FROM_EMAIL = os.environ['DEFAULT_FROM_EMAIL']
 
 # CRONJOBS = [
-#     ('0 * * * *', 'booking.booking_crons.booking_three_days_reminder'),
-#     ('0 * * * *', 'booking.booking_crons.booking_one_day_reminder'),
-#     ('0 * * * *', 'booking.booking_crons.three_hour_reminder'),
+#     ('0 * * * *', 'booking.booking_crons.booking_reminders'),
 # ]
+# Recurring bookings are materialized as Booking rows this many days ahead, the rest of the series stays virtual.
+BOOKING_HORIZON_DAYS = int(os.environ.get("BOOKING_HORIZON_DAYS", 56))
+# Closed (past) calendar days are cached this long, changes to their bookings drop them earlier.
+BOOKING_CALENDAR_CACHE_SECONDS = int(os.environ.get("BOOKING_CALENDAR_CACHE_SECONDS", 60 * 60))
+# Cleaner availability indexes used by dispatch, see booking.availability. Relevant writes drop them earlier.
+CLEANER_AVAILABILITY_CACHE_SECONDS = int(os.environ.get("CLEANER_AVAILABILITY_CACHE_SECONDS", 10 * 60))
+# Pay period of the payroll accruals, "week" (from Monday) or "month", see booking.payroll.
+PAYROLL_PERIOD = os.environ.get("PAYROLL_PERIOD", "week")
+# Push notifications, see booking.push. booking.push.StubPushBackend keeps them in memory instead of sending.
+PUSH_BACKEND = os.environ.get("PUSH_BACKEND", "booking.push.FCMPushBackend")
+# FCM server key, only read from the environment. FCMPushBackend cannot send without it.
+FCM_API_KEY = os.environ.get("FCM_API_KEY")
+PUSH_WORKERS = int(os.environ.get("PUSH_WORKERS", 4))
+PUSH_COALESCE_SECONDS = float(os.environ.get("PUSH_COALESCE_SECONDS", 0.5))
+PUSH_MAX_PENDING = int(os.environ.get("PUSH_MAX_PENDING", 1000))
+# Authenticated users (with their profile) are cached this long, see user_module.principal. Kept short while the
+# "principals" cache is per process, since saves elsewhere only reach other processes through expiry.
+PRINCIPAL_CACHE_SECONDS = int(os.environ.get("PRINCIPAL_CACHE_SECONDS", 30))
 ASGI_APPLICATION = "cleany.asgi.application"
 ATOMIC_REQUESTS=False
 # settings.py
+# In memory by default, which delivers within one ASGI process only. Set CHANNEL_LAYER_BACKEND to
+# cleany.channel_layers.PostgresChannelLayer to deliver across processes. Live cleaner locations are published from
+# the WSGI web processes, so they are only pushed with a cross-process layer.
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": os.environ.get("CHANNEL_LAYER_BACKEND", "channels.layers.InMemoryChannelLayer"),
     },
 }
 LOGGING = {
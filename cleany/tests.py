@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from booking.models import ChannelLayerGroup, ChannelLayerMessage, CustomerSupportChat, CustomerSupportCollection
+from booking.tests import create_booking, create_cleaner, create_service
+from cleany import consumer
+from cleany.channel_layers import PostgresChannelLayer, _Listener
+
+
+def run(test):
+    """Runs an async test body on one event loop and closes the layers it was given afterwards."""
+
+    def wrapper(self):
+        async def body():
+            try:
+                await test(self)
+            finally:
+                for layer in self.layers:
+                    await layer.close()
+
+        async_to_sync(body)()
+
+    return wrapper
+
+
+class PostgresChannelLayerTests(TransactionTestCase):
+    def setUp(self):
+        self.layers = []
+
+    def layer(self, **kwargs):
+        # a long poll interval, so only a NOTIFY can wake a receive() within the tests' timeouts
+        layer = PostgresChannelLayer(**{"poll_interval": 30.0, "pool_size": 2, **kwargs})
+        self.layers.append(layer)
+        return layer
+
+    @staticmethod
+    async def receive(layer, channel, timeout=2):
+        try:
+            return await asyncio.wait_for(layer.receive(channel), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    @run
+    async def test_send_and_receive(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "test.message", "text": "hello"})
+        await layer.send(channel, {"type": "test.message", "text": "again"})
+        self.assertEqual((await self.receive(layer, channel))["text"], "hello")
+        self.assertEqual((await self.receive(layer, channel))["text"], "again")
+        self.assertIsNone(await self.receive(layer, channel, timeout=0.2))
+
+    @run
+    async def test_waiting_receive_is_woken_by_a_send(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        waiting = asyncio.ensure_future(self.receive(layer, channel))
+        await asyncio.sleep(0.2)
+        await layer.send(channel, {"type": "test.message"})
+        self.assertEqual(await waiting, {"type": "test.message"})
+
+    @run
+    async def test_listen_connection_is_opened_off_the_loop(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        open_connection, threads = _Listener._open, []
+
+        def record_open(listener):
+            threads.append(threading.current_thread())
+            return open_connection(listener)
+
+        with mock.patch.object(_Listener, "_open", record_open):
+            waiting = asyncio.ensure_future(self.receive(layer, channel))
+            await asyncio.sleep(0.2)
+        await layer.send(channel, {"type": "test.message"})
+        self.assertEqual(await waiting, {"type": "test.message"})
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    @run
+    async def test_group_send_across_layers(self):
+        # two instances stand in for two processes, sharing nothing but the database
+        receiving, sending = self.layer(), self.layer()
+        channel, other_channel = await receiving.new_channel(), await receiving.new_channel()
+        await receiving.group_add("chat", channel)
+        await receiving.group_add("chat", other_channel)
+        await receiving.group_discard("chat", other_channel)
+        await sending.group_send("chat", {"type": "chat.message", "text": "hi"})
+        self.assertEqual((await self.receive(receiving, channel))["text"], "hi")
+        self.assertIsNone(await self.receive(receiving, other_channel, timeout=0.2))
+
+    @run
+    async def test_capacity(self):
+        layer = self.layer(capacity=2)
+        channel, member = await layer.new_channel(), await layer.new_channel()
+        await layer.send(channel, {"type": "test.message"})
+        await layer.send(channel, {"type": "test.message"})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "test.message"})
+        # a full member is skipped by group sends instead of failing them
+        await layer.group_add("chat", channel)
+        await layer.group_add("chat", member)
+        await layer.group_send("chat", {"type": "chat.message"})
+        self.assertEqual(await self.receive(layer, member), {"type": "chat.message"})
+        for _ in range(2):
+            self.assertEqual(await self.receive(layer, channel), {"type": "test.message"})
+        self.assertIsNone(await self.receive(layer, channel, timeout=0.2))
+
+    @run
+    async def test_expired_messages_and_memberships_are_not_delivered(self):
+        layer = self.layer(expiry=0, group_expiry=0)
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "test.message"})
+        self.assertIsNone(await self.receive(layer, channel, timeout=0.2))
+        await layer.group_add("chat", channel)
+        await self.layer().group_send("chat", {"type": "chat.message"})
+        self.assertIsNone(await self.receive(layer, channel, timeout=0.2))
+
+    def test_prune(self):
+        layer = self.layer(expiry=0, group_expiry=0)
+        live_layer = self.layer()
+
+        async def fill():
+            await layer.send("expired", {"type": "test.message"})
+            await layer.group_add("chat", "expired")
+            await live_layer.send("live", {"type": "test.message"})
+            await live_layer.group_add("chat", "live")
+
+        async_to_sync(fill)()
+        try:
+            self.assertEqual(layer.prune(), 2)
+            self.assertEqual(list(ChannelLayerMessage.objects.values_list("channel", flat=True)), ["live"])
+            self.assertEqual(list(ChannelLayerGroup.objects.values_list("channel", flat=True)), ["live"])
+        finally:
+            for each in self.layers:
+                async_to_sync(each.close)()
+
+    @run
+    async def test_flush(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "test.message"})
+        await layer.group_add("chat", channel)
+        await layer.flush()
+        self.assertIsNone(await self.receive(layer, channel, timeout=0.2))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChatHistoryTests(TransactionTestCase):
+    def setUp(self):
+        self.booking = create_booking(create_service())
+        self.cleaner = create_cleaner()
+        collection = CustomerSupportCollection.objects.create(booking=self.booking)
+        self.messages = [
+            CustomerSupportChat.objects.create(collection=collection, user=self.cleaner, message=str(number))
+            for number in range(5)
+        ]
+        # two messages share the first second and three the next, so pages split ties on created_at
+        first = timezone.now().replace(microsecond=0)
+        for number, message in enumerate(self.messages):
+            created_at = first + datetime.timedelta(seconds=0 if number < 2 else 1)
+            CustomerSupportChat.objects.filter(id=message.id).update(created_at=created_at)
+        mock.patch.object(consumer, "CHAT_HISTORY_SIZE", 2).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_history_pages_backwards(self):
+        async def pages():
+            communicator = WebsocketCommunicator(consumer.ChatConsumer.as_asgi(), "/ws/chat/")
+            communicator.scope["url_route"] = {"kwargs": {"booking_id": self.booking.id}}
+            communicator.scope["user"] = self.cleaner
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            frames = [await communicator.receive_json_from()]
+            while frames[-1]["cursor"]:
+                await communicator.send_json_to({"type": "load_more", "cursor": frames[-1]["cursor"]})
+                frames.append(await communicator.receive_json_from())
+            await communicator.send_json_to({"type": "load_more", "cursor": {"created_at": "yesterday", "id": 1}})
+            frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+
+        frames = async_to_sync(pages)()
+        self.assertEqual({frame["type"] for frame in frames[:-1]}, {"history"})
+        self.assertEqual([[message["message"] for message in frame["messages"]] for frame in frames[:-1]],
+                         [["3", "4"], ["1", "2"], ["0"]])
+        self.assertEqual(frames[-1], {"type": "error", "message": "Invalid cursor"})
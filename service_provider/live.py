@@ -0,0 +1,75 @@
+"""
+Live cleaner positions over Channels. Every booking has a group its location websocket joins. Fixes ingested on a
+booking are pushed to that group only, at most once per LIVE_PUSH_INTERVAL_SECONDS per cleaner, and only when the
+position changed since the last push. A new subscriber gets the latest fixes on connect, so nothing is lost
+by skipping the fixes in between.
+
+The web processes run under WSGI and publish from there, so pushes need a channel layer shared with the ASGI
+processes (CHANNEL_LAYER_BACKEND=cleany.channel_layers.PostgresChannelLayer). With the process-local in-memory layer
+nothing is pushed and a warning is logged instead.
+"""
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LIVE_PUSH_INTERVAL_SECONDS = 3
+
+_warned_process_local = False
+
+
+def cleaner_location_group(booking_id):
+    return "cleaner_location_%s" % booking_id
+
+
+def _pushed_key(booking_id, cleaner_id):
+    return "cleaner_location_pushed:%s:%s" % (booking_id, cleaner_id)
+
+
+def location_event(cleaner_id, latest):
+    return {
+        "cleaner_id": cleaner_id,
+        "latitude": float(latest["latitude"]),
+        "longitude": float(latest["longitude"]),
+        "recorded_at": latest["recorded_at"].isoformat(),
+    }
+
+
+def publish_location(cleaner_id, booking_id, latest):
+    """
+    Pushes the newest fix of a cleaner to the group of the booking it was ingested on, unless throttled or unchanged.
+    Returns whether it did.
+    """
+    global _warned_process_local
+    layer = get_channel_layer()
+    if layer is None or isinstance(layer, InMemoryChannelLayer):
+        if not _warned_process_local:
+            logger.warning(
+                "Live cleaner locations are not pushed, CHANNEL_LAYERS has no layer shared between processes. "
+                "Set CHANNEL_LAYER_BACKEND to cleany.channel_layers.PostgresChannelLayer."
+            )
+            _warned_process_local = True
+        return False
+    now = time.time()
+    event = location_event(cleaner_id, latest)
+    last = cache.get(_pushed_key(booking_id, cleaner_id))
+    if last is not None:
+        pushed_at, latitude, longitude = last
+        if now - pushed_at < LIVE_PUSH_INTERVAL_SECONDS:
+            return False
+        if (latitude, longitude) == (event["latitude"], event["longitude"]):
+            return False
+    cache.set(_pushed_key(booking_id, cleaner_id), (now, event["latitude"], event["longitude"]), LIVE_PUSH_INTERVAL_SECONDS * 20)
+    try:
+        async_to_sync(layer.group_send)(
+            cleaner_location_group(booking_id), {"type": "location.update", **event}
+        )
+    except Exception:
+        # subscribers catch up on their next update or reconnect, the fix itself is stored
+        logger.exception("Location push for cleaner %s failed", cleaner_id)
+        return False
+    return True
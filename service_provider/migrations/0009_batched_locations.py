@@ -0,0 +1,46 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('booking', '0063_numeric_coordinates'),
+        ('service_provider', '0008_managertask_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceProviderLatestLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('recorded_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='serviceproviderlocation',
+            name='recorded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='serviceproviderlocation',
+            index=models.Index(fields=['booking', 'service_provider', 'recorded_at'], name='service_pro_booking_250393_idx'),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderlatestlocation',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='booking_in_latest_location', to='booking.booking'),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderlatestlocation',
+            name='service_provider',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='user_in_latest_location', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
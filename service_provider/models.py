@@ -84,5 +84,32 @@ class ServiceProviderLocation(models.Model):
     total_hours = models.FloatField(null=True, blank=True)
     latitude = models.CharField(max_length=255)
     longitude = models.CharField(max_length=255)
+    recorded_at = models.DateTimeField(null=True, blank=True)  # when the device took the fix
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["booking", "service_provider", "recorded_at"]),
+        ]
+
+
+class ServiceProviderLatestLocation(models.Model):
+    """
+    Newest fix of each service provider, kept current by every ingested batch, see service_provider.tracking.
+    """
+
+    service_provider = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="user_in_latest_location"
+    )
+    booking = models.ForeignKey(
+        "booking.Booking",
+        on_delete=models.SET_NULL,
+        related_name="booking_in_latest_location",
+        null=True,
+        blank=True,
+    )
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
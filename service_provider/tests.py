@@ -1,3 +1,188 @@
-from django.test import TestCase
+import asyncio
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from booking.models import DispatchedAppointment
+from booking.tests import create_booking, create_cleaner, create_service
+from service_provider import live
+from service_provider.live import cleaner_location_group, publish_location
+from service_provider.models import ServiceProviderLatestLocation, ServiceProviderLocation
+from service_provider.tracking import get_latest_locations, ingest_locations
+
+POSTGRES_CHANNEL_LAYERS = {"default": {"BACKEND": "cleany.channel_layers.PostgresChannelLayer"}}
+
+
+def fix(minute, latitude=40.75, longitude=-73.99):
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": datetime.datetime(2030, 1, 7, 10, minute, tzinfo=datetime.timezone.utc).isoformat(),
+    }
+
+
+def create_bookings_of_one_cleaner():
+    """Two bookings, the same cleaner dispatched to both."""
+    service = create_service()
+    bookings = create_booking(service, "2030-01-07", "10:00"), create_booking(service, "2030-01-08", "10:00")
+    cleaner = create_cleaner()
+    for booking in bookings:
+        DispatchedAppointment.objects.create(service_provider=cleaner, booking=booking)
+    return bookings, cleaner
+
+
+class IngestLocationsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.booking, cls.other_booking), cls.cleaner = create_bookings_of_one_cleaner()
+
+    def stored(self):
+        rows = ServiceProviderLocation.objects.order_by("recorded_at")
+        return list(rows.values_list("recorded_at__minute", "booking"))
+
+    def test_downsampling(self):
+        # 11 m after a minute is dropped, 111 m is kept, and so is standing still for the keepalive
+        points = [fix(0), fix(1, 40.7501), fix(2, 40.751), fix(8, 40.751), fix(9, 40.751)]
+        stats = ingest_locations(self.cleaner.id, points, self.booking.id)
+        self.assertEqual((stats["received"], stats["stored"]), (5, 3))
+        self.assertEqual(self.stored(), [(0, self.booking.id), (2, self.booking.id), (8, self.booking.id)])
+        # the newest fix is the latest one even when it was not stored
+        self.assertEqual(ServiceProviderLatestLocation.objects.get().recorded_at.minute, 9)
+
+    def test_the_next_batch_continues_the_track(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        self.assertEqual(ingest_locations(self.cleaner.id, [fix(1, 40.7501)], self.booking.id)["stored"], 0)
+
+    def test_invalid_points_are_rejected(self):
+        points = [fix(0), "fix", {"latitude": "north", "longitude": 1, "timestamp": 0}, {**fix(1), "timestamp": "?"}]
+        stats = ingest_locations(self.cleaner.id, points, self.booking.id)
+        self.assertEqual((stats["rejected"], stats["stored"]), (3, 1))
+
+    def test_retried_batch_is_stale(self):
+        points = [fix(0), fix(2, 40.751)]
+        ingest_locations(self.cleaner.id, points, self.booking.id)
+        stats = ingest_locations(self.cleaner.id, points + [fix(4, 40.752)], self.booking.id)
+        self.assertEqual((stats["stale"], stats["stored"]), (2, 1))
+        self.assertEqual(len(self.stored()), 3)
+
+    def test_new_booking_starts_its_own_track(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        stats = ingest_locations(self.cleaner.id, [fix(1)], self.other_booking.id)
+        self.assertEqual(stats["stored"], 1)
+        self.assertEqual(self.stored(), [(0, self.booking.id), (1, self.other_booking.id)])
+        self.assertEqual(ServiceProviderLatestLocation.objects.get().booking_id, self.other_booking.id)
+
+    def test_batch_size_is_limited(self):
+        with self.assertRaises(ValueError):
+            ingest_locations(self.cleaner.id, [fix(0)] * 1001)
+
+
+@override_settings(ROOT_URLCONF="service_provider.urls")
+class CreateLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.booking, _), cls.cleaner = create_bookings_of_one_cleaner()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cleaner)
+
+    def test_ping_moves_the_latest_location(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        response = self.client.post(
+            "/cleaner_location",
+            {"booking": self.booking.id, "latitude": "40.76", "longitude": "-73.98", "recorded_at": fix(5)["timestamp"],
+             "total_hours": 2},
+            format="json",
+        )
+        self.assertTrue(response.json()["success"], response.json())
+        location = ServiceProviderLocation.objects.get(total_hours=2)
+        self.assertEqual((location.service_provider_id, location.booking_id), (self.cleaner.id, self.booking.id))
+        locations = get_latest_locations(self.booking.id)
+        self.assertEqual([(row["cleaner_id"], float(row["latitude"])) for row in locations], [(self.cleaner.id, 40.76)])
+
+    def test_older_ping_keeps_the_latest_location(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        self.client.post(
+            "/cleaner_location",
+            {"booking": self.booking.id, "latitude": "40.76", "longitude": "-73.98",
+             "recorded_at": fix(0)["timestamp"]},
+            format="json",
+        )
+        self.assertEqual(float(ServiceProviderLatestLocation.objects.get().latitude), 40.75)
+
+
+class LatestLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.booking, cls.other_booking), cls.cleaner = create_bookings_of_one_cleaner()
+
+    def test_latest_location_of_the_booking(self):
+        ingest_locations(self.cleaner.id, [fix(0), fix(1, 40.76)], self.booking.id)
+        locations = get_latest_locations(self.booking.id)
+        self.assertEqual([(location["cleaner_id"], float(location["latitude"])) for location in locations],
+                         [(self.cleaner.id, 40.76)])
+
+    def test_fixes_of_other_bookings_are_not_shown(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        self.assertEqual(get_latest_locations(self.other_booking.id), [])
+
+    def test_cancelled_dispatch_is_not_shown(self):
+        ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)
+        DispatchedAppointment.objects.filter(booking=self.booking).update(status="Cancelled")
+        self.assertEqual(get_latest_locations(self.booking.id), [])
+
+
+class ProcessLocalLayerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.booking, _), cls.cleaner = create_bookings_of_one_cleaner()
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_nothing_is_pushed_on_the_in_memory_layer(self):
+        latest = ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)["latest"]
+        with mock.patch.object(live, "_warned_process_local", False), self.assertLogs(live.logger, "WARNING"):
+            self.assertFalse(publish_location(self.cleaner.id, self.booking.id, latest))
+
+
+@override_settings(CHANNEL_LAYERS=POSTGRES_CHANNEL_LAYERS)
+class PublishLocationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        (self.booking, self.other_booking), self.cleaner = create_bookings_of_one_cleaner()
+        self.layer = get_channel_layer()
+        self.addCleanup(async_to_sync(self.layer.close))
+
+    def subscribe(self, booking):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(cleaner_location_group(booking.id), channel)
+        return channel
+
+    def receive(self, channel, timeout=1):
+        async def receive():
+            try:
+                return await asyncio.wait_for(self.layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        return async_to_sync(receive)()
+
+    def test_push_reaches_only_the_booking_group(self):
+        subscriber, other_subscriber = self.subscribe(self.booking), self.subscribe(self.other_booking)
+        latest = ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)["latest"]
+        self.assertTrue(publish_location(self.cleaner.id, self.booking.id, latest))
+        message = self.receive(subscriber)
+        self.assertEqual((message["type"], message["cleaner_id"], message["latitude"]),
+                         ("location.update", self.cleaner.id, 40.75))
+        self.assertIsNone(self.receive(other_subscriber, timeout=0.2))
+
+    def test_pushes_are_throttled(self):
+        latest = ingest_locations(self.cleaner.id, [fix(0)], self.booking.id)["latest"]
+        self.assertTrue(publish_location(self.cleaner.id, self.booking.id, latest))
+        latest = ingest_locations(self.cleaner.id, [fix(1, 40.76)], self.booking.id)["latest"]
+        self.assertFalse(publish_location(self.cleaner.id, self.booking.id, latest))
@@ -0,0 +1,166 @@
+"""
+Batched GPS ingestion. The cleaner apps send arrays of timestamped fixes. Each batch is validated in plain Python,
+downsampled and written with one bulk_create. A fix is only stored when the cleaner moved at least
+MIN_MOVE_METERS since the last stored one, or when KEEPALIVE_SECONDS passed, so a parked cleaner leaves a point
+every few minutes instead of every few seconds. The newest fix always goes to ServiceProviderLatestLocation, so
+"where is my cleaner" reads one row. Single pings stored with their check-in data go there too, through
+record_latest_location.
+"""
+import datetime
+import math
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from booking.geo import haversine_km, parse_point, to_coordinate
+from service_provider.models import ServiceProviderLatestLocation, ServiceProviderLocation
+
+MIN_MOVE_METERS = 25
+KEEPALIVE_SECONDS = 300
+MAX_BATCH_POINTS = 1000
+
+
+def parse_timestamp(value):
+    """Aware datetime from an ISO 8601 string or epoch seconds/milliseconds, None when invalid."""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace(".", "", 1).isdigit()):
+        value = float(value)
+        # epoch milliseconds are too large to be seconds for the next few centuries
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def _parse_points(points):
+    """[(recorded_at, latitude, longitude)] sorted by time, and the number of invalid points."""
+    parsed, rejected = [], 0
+    for point in points:
+        if not isinstance(point, dict):
+            rejected += 1
+            continue
+        latitude, longitude = parse_point(point.get("latitude"), point.get("longitude"))
+        recorded_at = parse_timestamp(point.get("timestamp"))
+        if math.isnan(latitude) or recorded_at is None:
+            rejected += 1
+            continue
+        parsed.append((recorded_at, latitude, longitude))
+    parsed.sort(key=lambda fix: fix[0])
+    return parsed, rejected
+
+
+def downsample(fixes, anchor=None):
+    """
+    The fixes worth storing. anchor is the last stored (recorded_at, latitude, longitude) the first fix is
+    compared with.
+    """
+    kept = []
+    for fix in fixes:
+        if anchor is not None:
+            moved = haversine_km(anchor[1], anchor[2], fix[1], fix[2]) * 1000
+            if moved < MIN_MOVE_METERS and (fix[0] - anchor[0]).total_seconds() < KEEPALIVE_SECONDS:
+                continue
+        kept.append(fix)
+        anchor = fix
+    return kept
+
+
+def ingest_locations(cleaner_id, points, booking_id=None):
+    """
+    Stores a batch of fixes of one cleaner, optionally on the booking being worked on. Fixes not newer than the
+    cleaner's latest one (retried uploads) are skipped. Returns {"received", "rejected", "stale", "stored",
+    "latest"}, latest being the newest fix as {"latitude", "longitude", "recorded_at"} or None.
+    """
+    if len(points) > MAX_BATCH_POINTS:
+        raise ValueError("At most %s points per batch" % MAX_BATCH_POINTS)
+    fixes, rejected = _parse_points(points)
+    stats = {"received": len(points), "rejected": rejected, "stale": 0, "stored": 0, "latest": None}
+    with transaction.atomic():
+        latest = (
+            ServiceProviderLatestLocation.objects.select_for_update()
+            .filter(service_provider_id=cleaner_id)
+            .first()
+        )
+        anchor = None
+        if latest is not None:
+            anchor = (latest.recorded_at, float(latest.latitude), float(latest.longitude))
+            fresh = [fix for fix in fixes if fix[0] > latest.recorded_at]
+            stats["stale"] = len(fixes) - len(fresh)
+            fixes = fresh
+            if latest.booking_id != booking_id:
+                # a new booking starts its own track
+                anchor = None
+        if not fixes:
+            return stats
+        kept = downsample(fixes, anchor)
+        ServiceProviderLocation.objects.bulk_create(
+            [
+                ServiceProviderLocation(
+                    service_provider_id=cleaner_id,
+                    booking_id=booking_id,
+                    latitude=str(to_coordinate(latitude, 90)),
+                    longitude=str(to_coordinate(longitude)),
+                    recorded_at=recorded_at,
+                )
+                for recorded_at, latitude, longitude in kept
+            ]
+        )
+        stats["latest"] = _save_latest(cleaner_id, latest, booking_id, *fixes[-1])
+    stats["stored"] = len(kept)
+    return stats
+
+
+def _save_latest(cleaner_id, latest, booking_id, recorded_at, latitude, longitude):
+    """Writes the cleaner's latest location row, latest being the current one or None. Returns the fix stored."""
+    values = {
+        "booking_id": booking_id,
+        "latitude": to_coordinate(latitude, 90),
+        "longitude": to_coordinate(longitude),
+        "recorded_at": recorded_at,
+    }
+    if latest is None:
+        ServiceProviderLatestLocation.objects.create(service_provider_id=cleaner_id, **values)
+    else:
+        ServiceProviderLatestLocation.objects.filter(id=latest.id).update(updated_at=timezone.now(), **values)
+    return {"latitude": values["latitude"], "longitude": values["longitude"], "recorded_at": recorded_at}
+
+
+def record_latest_location(cleaner_id, latitude, longitude, recorded_at, booking_id=None):
+    """
+    Makes a single fix stored outside ingest_locations the cleaner's latest one, unless a newer one is known.
+    Returns it like ingest_locations' "latest", or None when it was invalid or not newer.
+    """
+    latitude, longitude = parse_point(latitude, longitude)
+    if math.isnan(latitude):
+        return None
+    with transaction.atomic():
+        latest = (
+            ServiceProviderLatestLocation.objects.select_for_update()
+            .filter(service_provider_id=cleaner_id)
+            .first()
+        )
+        if latest is not None and latest.recorded_at >= recorded_at:
+            return None
+        return _save_latest(cleaner_id, latest, booking_id, recorded_at, latitude, longitude)
+
+
+def get_latest_locations(booking_id):
+    """
+    Newest fix each cleaner dispatched to a booking sent on that booking: [{"cleaner_id", "latitude", "longitude",
+    "recorded_at"}]. Fixes sent on other bookings or without one are not shown.
+    """
+    return [
+        {"cleaner_id": cleaner_id, "latitude": latitude, "longitude": longitude, "recorded_at": recorded_at}
+        for cleaner_id, latitude, longitude, recorded_at in ServiceProviderLatestLocation.objects.filter(
+            booking=booking_id,
+            service_provider__user_in_dispatched_appointment__booking=booking_id,
+            service_provider__user_in_dispatched_appointment__status="Dispatched",
+        )
+        .order_by("service_provider")
+        .values_list("service_provider", "latitude", "longitude", "recorded_at")
+    ]
@@ -77,9 +77,19 @@ urlpatterns = [
     # Cleaner Location
     path(
         "cleaner_location",
-        ServiceProviderLocationViewSet.as_view({"get": "list"}),
+        ServiceProviderLocationViewSet.as_view({"get": "list", "post": "create"}),
         name="create_location",
     ),
+    path(
+        "cleaner_location_batch",
+        ServiceProviderLocationViewSet.as_view({"post": "batch_create"}),
+        name="cleaner_location_batch",
+    ),
+    path(
+        "cleaner_latest_location",
+        ServiceProviderLocationViewSet.as_view({"get": "latest"}),
+        name="cleaner_latest_location",
+    ),
 
 
 ]
@@ -21,6 +21,8 @@ from service_provider.serializers import (
     ManagerTaskSerializer,
     ManagerTaskSerializerCreate,
 )
+from service_provider.live import publish_location
+from service_provider.tracking import get_latest_locations, ingest_locations, record_latest_location
 from user_module.models import User, UserProfile
 
 
@@ -265,7 +267,16 @@ class ServiceProviderLocationViewSet(BaseAPIView, ModelViewSet):
             data = request.data
             serializer = self.serializer_class(data=data, context={"request": request})
             if serializer.is_valid(raise_exception=True):
-                serializer.save()
+                location = serializer.save(service_provider=request.user)
+                latest = record_latest_location(
+                    request.user.id,
+                    location.latitude,
+                    location.longitude,
+                    location.recorded_at or location.created_at,
+                    location.booking_id,
+                )
+                if latest and location.booking_id:
+                    publish_location(request.user.id, location.booking_id, latest)
                 return self.send_success_response(
                     message="Cleaner location created successfully"
                 )
@@ -273,6 +284,43 @@ class ServiceProviderLocationViewSet(BaseAPIView, ModelViewSet):
         except Exception as e:
             return self.send_bad_request_response(message=e.args[0])
 
+    @swagger_auto_schema(tags=["Cleaner Location"])
+    def batch_create(self, request, *args, **kwargs):
+        """
+        Batch of fixes of the requesting cleaner: {"booking": id (optional), "points": [{"latitude", "longitude",
+        "timestamp"}]}, timestamp being ISO 8601 or epoch (milli)seconds.
+        """
+        try:
+            profile = getattr(request.user, "user_in_profile", None)
+            if not profile or profile.role != "Cleaner":
+                return self.send_bad_request_response(message="Only cleaner can add location")
+            data = request.data
+            points = data.get("points")
+            if not isinstance(points, list):
+                return self.send_bad_request_response(message="points should be a list")
+            booking_id = data.get("booking") or None
+            if booking_id and not DispatchedAppointment.objects.filter(
+                    booking=booking_id, service_provider=request.user, status="Dispatched"
+            ).exists():
+                return self.send_bad_request_response(message="Booking is not dispatched to this cleaner")
+            booking_id = int(booking_id) if booking_id else None
+            stats = ingest_locations(request.user.id, points, booking_id)
+            if stats["latest"] and booking_id:
+                publish_location(request.user.id, booking_id, stats["latest"])
+            return self.send_success_response(message="Cleaner locations stored", data=stats)
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+    @swagger_auto_schema(tags=["Cleaner Location"])
+    def latest(self, request, *args, **kwargs):
+        """Newest fix of each cleaner dispatched to booking_id."""
+        try:
+            return self.send_success_response(
+                message="Cleaner Location", data=get_latest_locations(request.GET.get("booking_id"))
+            )
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
     @swagger_auto_schema(tags=["Cleaner Location"])
     def list(self, request, *args, **kwargs):
         try:
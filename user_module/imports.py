@@ -0,0 +1,191 @@
+"""
+Bulk customer import. The CSV is read IMPORT_CHUNK_SIZE rows at a time. Each chunk is validated in plain Python, its
+emails are resolved against the existing users with one IN query, ignoring case, and the new users and profiles are written with two
+bulk_creates in one transaction. Invalid rows end up in the error report instead of aborting the import. Customers
+that already exist are skipped, so an interrupted import is resumed by uploading the same file again.
+
+Uploads are only stored as CustomerImport rows by the API. process_customer_imports, run from booking_crons, claims
+and imports them, so a large file never runs into the request timeout.
+"""
+import datetime
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from booking.metrics import metric_day, record_metric
+from user_module.models import CHOICES_IN_GENDER, CHOICES_IN_LANGUAGE, CustomerImport, User, UserProfile
+from user_module.utils import read_csv_chunks
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+# hashing releases the GIL, so passwords of a chunk are hashed in parallel
+PASSWORD_HASH_WORKERS = 8
+# imports left running longer than this belong to a worker that died mid-file
+IMPORT_STALE_AFTER = datetime.timedelta(hours=1)
+REQUIRED_COLUMNS = ("email", "first_name", "last_name")
+PROFILE_COLUMNS = ("phone_number", "address", "city", "state", "zip_code", "gender", "language")
+CHOICES = {"gender": dict(CHOICES_IN_GENDER), "language": dict(CHOICES_IN_LANGUAGE)}
+MAX_LENGTHS = {
+    "email": User._meta.get_field("email").max_length,
+    **{column: UserProfile._meta.get_field(column).max_length for column in ("first_name", "last_name") + PROFILE_COLUMNS},
+}
+
+logger = logging.getLogger(__name__)
+
+
+def clean_row(row):
+    """(cleaned values, {column: error}) of one CSV row."""
+    values, errors = {}, {}
+    for column in REQUIRED_COLUMNS:
+        if not row.get(column):
+            errors[column] = "This field is required."
+    email = User.objects.normalize_email(row.get("email", ""))
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors["email"] = "Enter a valid email address."
+    values["email"] = email
+    values["password"] = row.get("password") or None
+    for column in ("first_name", "last_name") + PROFILE_COLUMNS:
+        value = row.get(column) or None
+        if value is None:
+            continue
+        if column in CHOICES and value not in CHOICES[column]:
+            errors[column] = "Must be one of %s." % ", ".join(CHOICES[column])
+        values[column] = value
+    for column, limit in MAX_LENGTHS.items():
+        if values.get(column) and len(values[column]) > limit:
+            errors[column] = "Ensure this field has no more than %s characters." % limit
+    return values, errors
+
+
+def _create_customers(customers):
+    """Creates the users and profiles of [cleaned values] with two bulk_creates."""
+    passwords = [values["password"] for values in customers]
+    if any(passwords):
+        with ThreadPoolExecutor(PASSWORD_HASH_WORKERS) as executor:
+            passwords = list(executor.map(make_password, passwords))
+    else:
+        passwords = [make_password(None) for values in customers]
+    with transaction.atomic():
+        users = User.objects.bulk_create(
+            [User(email=values["email"], password=password) for values, password in zip(customers, passwords)]
+        )
+        UserProfile.objects.bulk_create(
+            [
+                UserProfile(
+                    user=user,
+                    role="Customer",
+                    **{column: values[column] for column in ("first_name", "last_name") + PROFILE_COLUMNS
+                       if column in values},
+                )
+                for user, values in zip(users, customers)
+            ]
+        )
+        # bulk_create skips the UserProfile signals that keep DailyMetrics current
+        record_metric("customers", metric_day(), len(users))
+
+
+def import_customers(file, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports the customers of a CSV upload (email, first_name, last_name, optional password and profile columns).
+    Rows without a password get an unusable one, the customer sets it through forget password. Returns
+    {"rows", "created", "existing", "invalid", "seconds", "rows_per_second", "errors"}, errors listing up to
+    MAX_REPORTED_ERRORS {"row", "email", "errors"}.
+    """
+    started = time.monotonic()
+    stats = {"rows": 0, "created": 0, "existing": 0, "invalid": 0}
+    errors = []
+    seen = set()
+
+    def reject(row_number, email, row_errors):
+        stats["invalid"] += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": row_number, "email": email, "errors": row_errors})
+
+    for first_row, rows in read_csv_chunks(file, chunk_size):
+        stats["rows"] += len(rows)
+        customers = []
+        for row_number, row in enumerate(rows, first_row):
+            values, row_errors = clean_row(row)
+            if row_errors:
+                reject(row_number, values["email"], row_errors)
+            elif values["email"].lower() in seen:
+                reject(row_number, values["email"], {"email": "Duplicate email in the file."})
+            else:
+                seen.add(values["email"].lower())
+                customers.append(values)
+        for attempt in range(2):
+            existing = set(
+                User.objects.annotate(email_lower=Lower("email"))
+                .filter(email_lower__in=[values["email"].lower() for values in customers])
+                .values_list("email_lower", flat=True)
+            )
+            new = [values for values in customers if values["email"].lower() not in existing]
+            try:
+                if new:
+                    _create_customers(new)
+                break
+            except IntegrityError:
+                # someone signed up with one of the emails in the meantime, resolve the chunk again
+                if attempt:
+                    raise
+        stats["existing"] += len(customers) - len(new)
+        stats["created"] += len(new)
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_second"] = round(stats["rows"] / stats["seconds"]) if stats["seconds"] else stats["rows"]
+    stats["errors"] = errors
+    return stats
+
+
+def enqueue_customer_import(file, user=None):
+    """Stores an uploaded CSV for process_customer_imports."""
+    return CustomerImport.objects.create(created_by=user, file_name=getattr(file, "name", "") or "", data=file.read())
+
+
+def _claim_import():
+    with transaction.atomic():
+        customer_import = (
+            CustomerImport.objects.select_for_update(skip_locked=True)
+            .filter(status="queued")
+            .order_by("id")
+            .first()
+        )
+        if customer_import:
+            customer_import.status, customer_import.started_at = "running", timezone.now()
+            customer_import.save(update_fields=["status", "started_at", "updated_at"])
+    return customer_import
+
+
+def requeue_stale_imports():
+    return CustomerImport.objects.filter(
+        status="running", started_at__lt=timezone.now() - IMPORT_STALE_AFTER
+    ).update(status="queued")
+
+
+def process_customer_imports():
+    """Imports the queued uploads one at a time until none is left. Returns the CustomerImport rows processed."""
+    requeue_stale_imports()
+    processed = []
+    while True:
+        customer_import = _claim_import()
+        if customer_import is None:
+            return processed
+        try:
+            customer_import.report = import_customers(io.BytesIO(bytes(customer_import.data)))
+            customer_import.status, customer_import.data = "done", b""
+        except Exception as e:
+            logger.exception("Customer import %s failed", customer_import.id)
+            customer_import.status, customer_import.error = "failed", str(e)
+        customer_import.finished_at = timezone.now()
+        customer_import.save(update_fields=["report", "status", "data", "error", "finished_at", "updated_at"])
+        processed.append(customer_import)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from user_module.imports import process_customer_imports
+
+
+class Command(BaseCommand):
+    help = "Imports the queued customer CSV uploads."
+
+    def handle(self, *args, **options):
+        for customer_import in process_customer_imports():
+            self.stdout.write(
+                "Import %s %s: %s" % (customer_import.id, customer_import.status, _summary(customer_import))
+            )
+
+
+def _summary(customer_import):
+    if customer_import.status == "failed":
+        return customer_import.error
+    return "%(created)s created, %(existing)s existing, %(invalid)s invalid of %(rows)s rows in %(seconds)ss" % (
+        customer_import.report
+    )
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+from booking.geo import grid_cell, to_coordinate
+
+
+def clean_coordinates(apps, schema_editor):
+    """Empties the coordinates that are not numbers, so the columns can become numeric, and fills grid_cell."""
+    UserProfile = apps.get_model("user_module", "UserProfile")
+    profiles = []
+    for profile in UserProfile.objects.exclude(latitude=None, longitude=None).only("latitude", "longitude"):
+        latitude, longitude = to_coordinate(profile.latitude, 90), to_coordinate(profile.longitude)
+        if latitude is None or longitude is None:
+            latitude = longitude = None
+        profile.latitude, profile.longitude = latitude, longitude
+        profile.grid_cell = grid_cell(latitude, longitude)
+        profiles.append(profile)
+    UserProfile.objects.bulk_update(profiles, ["latitude", "longitude", "grid_cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_module', '0012_userreview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='grid_cell',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(clean_coordinates, migrations.RunPython.noop),
+    ]
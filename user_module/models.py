@@ -1,9 +1,12 @@
 from django.contrib.auth import password_validation
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 
+from booking.geo import grid_cell
+
 
 
 CHOICES_IN_GENDER = [
@@ -102,6 +105,10 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []
     USERNAME_FIELD = "email"
 
+    class Meta(AbstractUser.Meta):
+        # case-insensitive email lookups, see user_module.imports
+        indexes = [models.Index(Lower("email"), name="user_email_lower_idx")]
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         if self.password is not None:
@@ -115,8 +122,9 @@ class UserProfile(models.Model):
     """
 
     use_for_related_fields = True
-    latitude = models.CharField(max_length=255, null=True, blank=True)
-    longitude = models.CharField(max_length=255, null=True, blank=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    grid_cell = models.PositiveIntegerField(null=True, blank=True, db_index=True)  # see booking.geo.grid_cell
     hourly_rate = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     color = models.CharField(max_length=50, default="#800020")
     user = models.OneToOneField(
@@ -155,6 +163,13 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        self.grid_cell = grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"grid_cell"}
+        return super(UserProfile, self).save(*args, **kwargs)
+
 
 class VerificationCode(models.Model):
     code = models.CharField(max_length=30)
@@ -178,3 +193,33 @@ class UserReview(models.Model):
     review = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class CustomerImport(models.Model):
+    """
+    Customer CSV upload, processed in the background by user_module.imports.process_customer_imports. The file is
+    kept in the row until then, so the clock process can read it.
+    """
+
+    status_choices = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="user_in_customer_import"
+    )
+    file_name = models.CharField(max_length=255, blank=True, default="")
+    data = models.BinaryField(default=bytes)
+    status = models.CharField(max_length=16, choices=status_choices, default="queued")
+    # stats and error report of import_customers
+    report = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"])]
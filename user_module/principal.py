@@ -0,0 +1,90 @@
+"""
+Cached principal behind JWT authentication, for REST requests and websocket connects alike. The cache keeps a snapshot
+of the user row and its profile row per user id for PRINCIPAL_CACHE_SECONDS, in the "principals" cache (see CACHES).
+Every request gets fresh instances built from it, as if just loaded from the database, with user_in_profile already
+attached. The password hash is left out of the snapshot and loaded on access. Saving or deleting a User or UserProfile
+drops the snapshot, again once the write commits. With the default per-process cache that only reaches the process
+that saved, the others pick the change up when their snapshot expires.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from user_module.models import User, UserProfile
+
+PRINCIPAL_CACHE = "principals"
+PROFILE_ACCESSOR = "user_in_profile"
+# never cached, a deferred field of the built user instead
+UNCACHED_USER_FIELDS = {"password"}
+
+
+def _principal_key(user_id):
+    return "jwt_principal:%s" % user_id
+
+
+def _user_attnames():
+    return [field.attname for field in User._meta.concrete_fields if field.name not in UNCACHED_USER_FIELDS]
+
+
+def _load_snapshot(user_id):
+    """(user values, profile values or None) in concrete field order, read with one query."""
+    user_fields = _user_attnames()
+    profile_fields = [PROFILE_ACCESSOR + "__" + field.name for field in UserProfile._meta.concrete_fields]
+    row = User.objects.filter(pk=user_id).values_list(*user_fields, *profile_fields).first()
+    if row is None:
+        return None
+    user_values, profile_values = tuple(row[:len(user_fields)]), tuple(row[len(user_fields):])
+    return user_values, profile_values if profile_values[0] is not None else None
+
+
+def _build_user(snapshot):
+    user_values, profile_values = snapshot
+    user = User.from_db(router.db_for_read(User), _user_attnames(), user_values)
+    if profile_values is not None:
+        profile = UserProfile.from_db(
+            router.db_for_read(UserProfile),
+            [field.attname for field in UserProfile._meta.concrete_fields],
+            profile_values,
+        )
+        User._meta.get_field(PROFILE_ACCESSOR).set_cached_value(user, profile)
+        UserProfile._meta.get_field("user").set_cached_value(profile, user)
+    return user
+
+
+def get_principal(user_id):
+    """The user with its profile attached, or None if there is no such user."""
+    cache = caches[PRINCIPAL_CACHE]
+    snapshot = cache.get(_principal_key(user_id))
+    if snapshot is None:
+        snapshot = _load_snapshot(user_id)
+        if snapshot is None:
+            return None
+        cache.set(_principal_key(user_id), snapshot, settings.PRINCIPAL_CACHE_SECONDS)
+    return _build_user(snapshot)
+
+
+def invalidate_principal(user_id):
+    if user_id:
+        key, cache = _principal_key(user_id), caches[PRINCIPAL_CACHE]
+        cache.delete(key)
+        # another process may cache the old rows again before the write commits
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication reading the user from the principal cache instead of querying it."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+        user = get_principal(user_id)
+        if user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
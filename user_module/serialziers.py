@@ -275,3 +275,9 @@ class UserProfilePictureSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['id', 'profile_picture']
+
+
+class CustomerImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerImport
+        exclude = ["data"]
@@ -1,3 +1,115 @@
+import io
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import IntegrityError
 from django.test import TestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user_module import imports
+from user_module.imports import enqueue_customer_import, import_customers, process_customer_imports
+from user_module.models import User, UserProfile
+from user_module.principal import PRINCIPAL_CACHE, CachedJWTAuthentication, get_principal
+
+
+class PrincipalCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="sam@example.com")
+        cls.user.set_password("secret")
+        cls.user.save()
+        UserProfile.objects.create(user=cls.user, role="Cleaner", first_name="Sam")
+
+    def setUp(self):
+        caches[PRINCIPAL_CACHE].clear()
+
+    def test_cached_principal_costs_no_query(self):
+        get_principal(self.user.id)
+        with self.assertNumQueries(0):
+            user = get_principal(self.user.id)
+            self.assertEqual((user.email, user.user_in_profile.role), ("sam@example.com", "Cleaner"))
+
+    def test_password_hash_is_not_cached(self):
+        get_principal(self.user.id)
+        user = get_principal(self.user.id)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("secret"))
+
+    def test_profile_save_drops_the_principal(self):
+        get_principal(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.get(user=self.user)
+            profile.role = "Manager"
+            profile.save()
+        self.assertEqual(get_principal(self.user.id).user_in_profile.role, "Manager")
+
+    def test_deleted_user(self):
+        get_principal(self.user.id)
+        self.user.delete()
+        self.assertIsNone(get_principal(self.user.id))
+
+    def test_inactive_user_is_rejected(self):
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+
+
+def customer_csv(*rows, header="email,first_name,last_name,gender"):
+    return io.BytesIO("\n".join((header,) + rows).encode())
+
+
+class ImportCustomersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(email="sam@example.com")
+
+    def test_chunks(self):
+        rows = ["customer%s@example.com,Customer,%s," % (number, number) for number in range(5)]
+        stats = import_customers(customer_csv(*rows), chunk_size=2)
+        self.assertEqual((stats["rows"], stats["created"], stats["invalid"]), (5, 5, 0))
+        self.assertEqual(UserProfile.objects.filter(role="Customer", first_name="Customer").count(), 5)
+        self.assertFalse(User.objects.get(email="customer0@example.com").has_usable_password())
+
+    def test_existing_emails_match_ignoring_case(self):
+        stats = import_customers(customer_csv("SAM@example.com,Sam,Smith,", "Ann@Example.com,Ann,Lee,"))
+        self.assertEqual((stats["created"], stats["existing"]), (1, 1))
+        stats = import_customers(customer_csv("ann@example.com,Ann,Lee,"))
+        self.assertEqual((stats["created"], stats["existing"]), (0, 1))
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_duplicates_in_the_file_are_reported(self):
+        # across chunks too
+        stats = import_customers(customer_csv("ann@example.com,Ann,Lee,", "bob@example.com,Bob,Lee,",
+                                              "ANN@example.com,Ann,Lee,"), chunk_size=2)
+        self.assertEqual((stats["created"], stats["invalid"]), (2, 1))
+        self.assertEqual(stats["errors"], [
+            {"row": 4, "email": "ANN@example.com", "errors": {"email": "Duplicate email in the file."}},
+        ])
+
+    def test_error_report(self):
+        stats = import_customers(customer_csv("not-an-email,Ann,Lee,", "bob@example.com,,Lee,Robot",
+                                              "eve@example.com,Eve,Lee,Female"))
+        self.assertEqual((stats["created"], stats["invalid"]), (1, 2))
+        self.assertEqual([(error["row"], sorted(error["errors"])) for error in stats["errors"]],
+                         [(2, ["email"]), (3, ["first_name", "gender"])])
+
+    def test_chunk_is_resolved_again_after_a_concurrent_signup(self):
+        create_customers = imports._create_customers
+
+        def signup_first(customers):
+            if not User.objects.filter(email="ann@example.com").exists():
+                User.objects.create(email="ann@example.com")
+                raise IntegrityError("duplicate key value violates unique constraint")
+            create_customers(customers)
+
+        with mock.patch.object(imports, "_create_customers", side_effect=signup_first):
+            stats = import_customers(customer_csv("ann@example.com,Ann,Lee,", "bob@example.com,Bob,Lee,"))
+        self.assertEqual((stats["created"], stats["existing"]), (1, 1))
+        self.assertTrue(UserProfile.objects.filter(user__email="bob@example.com").exists())
 
-# Create your tests here.
+    def test_queued_upload_is_processed(self):
+        upload = enqueue_customer_import(customer_csv("ann@example.com,Ann,Lee,"))
+        self.assertEqual(process_customer_imports(), [upload])
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.report["created"], bytes(upload.data)), ("done", 1, b""))
@@ -68,7 +68,7 @@ urlpatterns = [
 
     path(
         "import_customers",
-        ImportCustomerCsv.as_view({"post": "create"}),
+        ImportCustomerCsv.as_view({"post": "create", "get": "list"}),
         name="user_card_list",
     ),
 
@@ -2,10 +2,7 @@ import csv
 import random
 import pandas as pd
 
-from django.core.mail import EmailMessage
-from django.template.loader import get_template
-
-from cleany import settings
+from booking.mailer import enqueue_email
 from user_module.models import User, VerificationCode
 
 
@@ -33,29 +30,25 @@ def create_verification(user: User):
 
 def forget_password_email(user: User, template: str = "verify_email.html"):
     """
-        Send email to user
+        Queue email to user
         """
-    code = create_verification(user=user),
+    code = create_verification(user=user)
     rtx = {
         "name": user.first_name + " " + user.last_name,
         'code': code
     }
-    message = get_template(template).render(rtx)
-    email = EmailMessage(
-        subject="User SignUp",
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email],
-        reply_to=[settings.DEFAULT_FROM_EMAIL],
-    )
-    email.content_subtype = "html"
-    email.send()
-
-
-def read_csv(path):
-    """Read the csv into dictionaries, transform the keys necessary
-    and return a list of cleaned-up dictionaries.
+    enqueue_email(user.email, "User SignUp", template, rtx)
+
+
+def read_csv_chunks(path, chunk_size):
+    """Read the csv chunk_size rows at a time, yielding (first row number, list of dictionaries) per chunk.
+    Every value is a stripped string, empty when missing, and the keys are lowercased.
     """
-    data = pd.read_csv(path)
-    return data.to_dict('records')
+    reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+    row_number = 2  # the header is line 1
+    for chunk in reader:
+        chunk.columns = [str(column).strip().lower() for column in chunk.columns]
+        rows = [{key: value.strip() for key, value in row.items()} for row in chunk.to_dict('records')]
+        yield row_number, rows
+        row_number += len(rows)
 
@@ -3,16 +3,19 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 import stripe
+from booking.geo import to_coordinate
 from booking.models import UserStripe, EmailTypes
 from booking.serializers import EmailTypeSerializer
 from cleany.base.response_mixins import BaseAPIView
-from service_provider.serializers import UpdateUserProfileSerializer, CustomerSerializer, CustomerSerializerCsv
+from service_provider.serializers import UpdateUserProfileSerializer, CustomerSerializer
 from .serialziers import *
-from .utils import forget_password_email, read_csv
+from .imports import enqueue_customer_import
+from .utils import forget_password_email
 import csv
 import dotenv
+from django.conf import settings
 import os
-dotenv_file = os.path.join(BASE_DIR, ".env")
+dotenv_file = os.path.join(settings.BASE_DIR, ".env")
 if os.path.isfile(dotenv_file):
     dotenv.load_dotenv(dotenv_file)
 stripe.api_key =os.environ['STRIPE_KEY']
@@ -355,21 +358,40 @@ class EmailTypesViewSet(BaseAPIView, ModelViewSet):
 
 
 class ImportCustomerCsv(BaseAPIView, ModelViewSet):
-    # permission_classes = [IsAuthenticated]
-    queryset = User.objects.all()
-    serializer_class = CustomerSerializerCsv
+    permission_classes = [IsAuthenticated]
+    queryset = CustomerImport.objects.all()
+    serializer_class = CustomerImportSerializer
+    import_roles = ("Admin", "Manager")
+
+    def can_import(self, user):
+        return UserProfile.objects.filter(user=user, role__in=self.import_roles).exists()
 
     def create(self, request, *args, **kwargs):
+        """Queues the CSV, booking_crons imports it in the background. Poll the list for its status and report."""
         try:
+            if not self.can_import(request.user):
+                return self.send_bad_request_response(message="Only admins and managers can import customers")
             file = request.FILES.get('file')
-            file_data = read_csv(file)
-            for data in file_data:
-                serializer = self.serializer_class(data=data, context={'request': request})
-                if serializer.is_valid():
-                    serializer.save()
-                else:
-                    return self.send_bad_request_response(message=serializer.errors)
-            return self.send_success_response(message="Customers imported successfully")
+            if not file:
+                return self.send_bad_request_response(message="file is required")
+            customer_import = enqueue_customer_import(file, request.user)
+            return self.send_success_response(
+                message="Customer import queued", data=self.serializer_class(customer_import).data
+            )
+        except Exception as e:
+            return self.send_bad_request_response(message=str(e))
+
+    def list(self, request, *args, **kwargs):
+        """The latest imports, or the one of import_id, with their status and report."""
+        try:
+            if not self.can_import(request.user):
+                return self.send_bad_request_response(message="Only admins and managers can import customers")
+            imports = CustomerImport.objects.defer("data").order_by("-id")
+            import_id = request.GET.get("import_id")
+            if import_id:
+                imports = imports.filter(id=import_id)
+            serializer = self.serializer_class(imports[:20], many=True)
+            return self.send_success_response(message="Customer imports", data=serializer.data)
         except Exception as e:
             return self.send_bad_request_response(message=str(e))
 
@@ -386,8 +408,8 @@ class CleanerLocationView(BaseAPIView, ModelViewSet):
                 return self.send_bad_request_response(message="Profile not found")
             if not profile.role == 'Cleaner':
                 return self.send_bad_request_response(message="Only cleaner can add location")
-            profile.latitude = request.data.get('latitude')
-            profile.longitude = request.data.get('longitude')
+            profile.latitude = to_coordinate(request.data.get('latitude'), 90)
+            profile.longitude = to_coordinate(request.data.get('longitude'))
             profile.save()
             return self.send_success_response(message="Location updated successfully")
         except Exception as e: